@@ -25,6 +25,8 @@ import (
 var (
 	db        *sql.DB
 	jwtSecret []byte
+	// Max age of the bot's monthly summary views in seconds (MONTHLY_SUMMARY_MAX_AGE, same as the bot)
+	summaryMaxAge float64 = 600
 )
 
 var defaultAppUserSeeds = []appUserRequest{
@@ -354,33 +356,32 @@ func getExpensesSummary(c *gin.Context) {
 	// Date 30 days ago
 	date30DaysAgo := time.Now().AddDate(0, 0, -30).Format("2006-01-02")
 
-	// Get aggregated expenses by category (entire family)
-	rows, err := db.Query(`
-		SELECT category, SUM(amount) as total
-		FROM expenses
-		WHERE date >= $1 AND transaction_type = 'expense'
-		GROUP BY category
+	// Get aggregated expenses by category (entire family): the bot's materialized
+	// view while it is fresh, otherwise the live aggregate over expenses
+	categories, total, err := queryCategoryTotals(`
+		SELECT category, total
+		FROM monthly_category_totals
+		WHERE EXISTS (
+			SELECT 1 FROM summary_refreshes
+			WHERE view_name = 'monthly_category_totals'
+			  AND window_end = CURRENT_DATE
+			  AND refreshed_at >= now() - make_interval(secs => $1)
+		)
 		ORDER BY total DESC
-	`, date30DaysAgo)
+	`, summaryMaxAge)
+	if err != nil || len(categories) == 0 {
+		categories, total, err = queryCategoryTotals(`
+			SELECT category, SUM(amount) as total
+			FROM expenses
+			WHERE date >= $1 AND transaction_type = 'expense'
+			GROUP BY category
+			ORDER BY total DESC
+		`, date30DaysAgo)
+	}
 	if err != nil {
 		c.JSON(http.StatusInternalServerError, gin.H{"error": err.Error()})
 		return
 	}
-	defer rows.Close()
-
-	var categories []CategoryTotal
-	var total float64
-
-	for rows.Next() {
-		var ct CategoryTotal
-		err := rows.Scan(&ct.Category, &ct.Amount)
-		if err != nil {
-			c.JSON(http.StatusInternalServerError, gin.H{"error": err.Error()})
-			return
-		}
-		categories = append(categories, ct)
-		total += ct.Amount
-	}
 
 	// Get daily expenses for chart (entire family)
 	rows2, err := db.Query(`
@@ -423,6 +424,27 @@ func getExpensesSummary(c *gin.Context) {
 	c.JSON(http.StatusOK, summary)
 }
 
+// Run a (category, total) query and return its rows with their sum
+func queryCategoryTotals(query string, args ...interface{}) ([]CategoryTotal, float64, error) {
+	rows, err := db.Query(query, args...)
+	if err != nil {
+		return nil, 0, err
+	}
+	defer rows.Close()
+
+	var categories []CategoryTotal
+	var total float64
+	for rows.Next() {
+		var ct CategoryTotal
+		if err := rows.Scan(&ct.Category, &ct.Amount); err != nil {
+			return nil, 0, err
+		}
+		categories = append(categories, ct)
+		total += ct.Amount
+	}
+	return categories, total, rows.Err()
+}
+
 // Get budgets for entire family (no user_id filter)
 func getBudgets(c *gin.Context) {
 	userID := getTelegramUserID(c) // Keep for audit, but don't filter by it
@@ -1691,6 +1713,14 @@ func main() {
 	}
 	jwtSecret = []byte(authSecret)
 
+	if raw := strings.TrimSpace(os.Getenv("MONTHLY_SUMMARY_MAX_AGE")); raw != "" {
+		maxAge, err := strconv.ParseFloat(raw, 64)
+		if err != nil || maxAge < 0 {
+			log.Fatalf("❌ Invalid MONTHLY_SUMMARY_MAX_AGE %q", raw)
+		}
+		summaryMaxAge = maxAge
+	}
+
 	// Initialize database
 	initDB()
 	defer db.Close()
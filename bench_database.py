@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк горячих путей database.py на локальном PostgreSQL.
+
+Создает временную базу на сервере из --dsn (по умолчанию DATABASE_URL),
+применяет схему и миграции бота, заполняет ее синтетическими семьями
+(пользователи, расходы, бюджеты, напоминания) и замеряет функции
+database.py. Результаты - p50/p95/p99 в миллисекундах; --output пишет JSON,
+--compare сравнивает с JSON прошлого запуска (например, другого коммита).
+
+Отдельно печатается время планирования запросов из реестра prepared_query()
+(db.py) по EXPLAIN ANALYZE: обычный текст SQL против EXECUTE подготовленного
+оператора, то есть сколько планирования экономится на одной трате.
+Для запросов с generic_plan=True сравнивается план под параметры и общий
+план (время планирования и выполнения) в узком и широком периоде.
+--no-prepared выполняет database.py без PREPARE для сравнения целиком.
+
+Пример:
+    python bench_database.py --rows 1000000 --output bench_main.json
+    python bench_database.py --rows 1000000 --compare bench_main.json
+    python bench_database.py --no-prepared --output bench_plain.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, make_dsn, parse_dsn
+
+from config import CATEGORIES, Config
+
+logger = logging.getLogger(__name__)
+
+BENCH_USER_BASE = 100000
+PERIODS = ["daily", "weekly", "monthly"]
+
+# Справочник категорий создает Go backend (backend-go/schema.go); во временной базе - его копия
+CATEGORIES_TABLE = """
+CREATE TABLE IF NOT EXISTS categories (
+    id SERIAL PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    type TEXT NOT NULL CHECK (type IN ('expense', 'income')),
+    description TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Процентиль по методу ближайшего ранга"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Статистика по замерам в секундах; значения в миллисекундах"""
+    values = sorted(samples)
+    total = sum(values)
+    return {
+        "iterations": len(values),
+        "mean_ms": round(total / len(values) * 1000, 3),
+        "min_ms": round(values[0] * 1000, 3),
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3),
+        "ops_per_sec": round(len(values) / total, 1) if total else 0.0,
+    }
+
+
+def measure(func: Callable, iterations: int, warmup: int, setup: Optional[Callable] = None) -> Dict[str, float]:
+    """Вызывает func iterations раз после warmup прогревочных; setup перед каждым вызовом не замеряется"""
+    samples = []
+    for i in range(warmup + iterations):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        if i >= warmup:
+            samples.append(elapsed)
+    return summarize(samples)
+
+
+# ========== ВРЕМЕННАЯ БАЗА ==========
+
+def create_database(admin_dsn: str, name: str) -> str:
+    conn = psycopg2.connect(admin_dsn)
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    try:
+        conn.cursor().execute(f"CREATE DATABASE {name}")
+    finally:
+        conn.close()
+    return make_dsn(admin_dsn, dbname=name)
+
+
+def drop_database(admin_dsn: str, name: str) -> None:
+    conn = psycopg2.connect(admin_dsn)
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    try:
+        conn.cursor().execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+    finally:
+        conn.close()
+
+
+def prepare_schema(days: int) -> None:
+    """Схема и миграции бота; партиции expenses на всю глубину истории"""
+    from database_migrations import DatabaseMigration, ensure_expense_partitions
+    from db import get_connection
+    from db_schema import init_db
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(CATEGORIES_TABLE)
+        cursor.execute(
+            "INSERT INTO categories (name, type) SELECT unnest(%s::text[]), 'expense' ON CONFLICT (name) DO NOTHING",
+            (CATEGORIES,),
+        )
+        conn.commit()
+    init_db()
+    migration = DatabaseMigration()
+    migration.run_migrations()
+    # Как в production после partition-expenses; на пустой таблице это мгновенно
+    migration.partition()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT (CURRENT_DATE - %s)::date AS first_date", (days,))
+        ensure_expense_partitions(cursor, Config.EXPENSE_PARTITIONS_AHEAD, start=cursor.fetchone()["first_date"])
+        conn.commit()
+
+
+def seed(users: int, rows: int, days: int, reminders: int) -> None:
+    """Синтетические данные: пользователи, расходы за days дней, бюджеты и напоминания на сегодня"""
+    from database_migrations import rebuild_daily_totals
+    from db import get_connection
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT INTO users (user_id, user_name, created_date)
+            SELECT %(base)s + g, 'Пользователь ' || g, CURRENT_DATE
+            FROM generate_series(1, %(users)s) g
+            """,
+            {"base": BENCH_USER_BASE, "users": users},
+        )
+
+        # Свертку пересчитываем одним запросом, а не построчным триггером
+        cursor.execute("ALTER TABLE expenses DISABLE TRIGGER expenses_daily_totals")
+        cursor.execute(
+            """
+            INSERT INTO expenses (user_id, amount, category, date, user_name, transaction_type)
+            SELECT %(base)s + 1 + g %% %(users)s,
+                   round((1 + random() * 5000)::numeric, 2),
+                   (%(categories)s::text[])[1 + g %% %(category_count)s],
+                   CURRENT_DATE - (random() * %(days)s)::int,
+                   'Пользователь ' || (1 + g %% %(users)s),
+                   CASE WHEN g %% 10 = 0 THEN 'income' ELSE 'expense' END
+            FROM generate_series(1, %(rows)s) g
+            """,
+            {
+                "base": BENCH_USER_BASE,
+                "users": users,
+                "categories": CATEGORIES,
+                "category_count": len(CATEGORIES),
+                "days": days,
+                "rows": rows,
+            },
+        )
+        cursor.execute("ALTER TABLE expenses ENABLE TRIGGER expenses_daily_totals")
+        rebuild_daily_totals(cursor)
+
+        cursor.execute(
+            """
+            INSERT INTO budgets (user_id, category, amount, period, start_date, user_name)
+            SELECT %(base)s + 1, c, 10000, p, CURRENT_DATE, 'Пользователь 1'
+            FROM unnest(%(categories)s::text[]) c CROSS JOIN unnest(%(periods)s::text[]) p
+            """,
+            {"base": BENCH_USER_BASE, "categories": CATEGORIES, "periods": PERIODS},
+        )
+        cursor.execute(
+            """
+            INSERT INTO reminders (user_id, message, frequency, next_reminder_date, created_date)
+            SELECT %(base)s + 1 + g %% %(users)s, 'Напоминание ' || g,
+                   (ARRAY['Ежедневно', 'Еженедельно', 'Ежемесячно'])[1 + g %% 3],
+                   CURRENT_DATE, CURRENT_DATE
+            FROM generate_series(1, %(reminders)s) g
+            """,
+            {"base": BENCH_USER_BASE, "users": users, "reminders": reminders},
+        )
+        conn.commit()
+
+    with get_connection() as conn:
+        conn.autocommit = True
+        conn.cursor().execute("VACUUM ANALYZE")
+        conn.autocommit = False
+
+
+# ========== СЦЕНАРИИ ==========
+
+def run_benchmarks(users: int, iterations: int, warmup: int) -> Dict[str, Dict]:
+    import database
+    from db import get_connection
+    from utils import format_budget_report
+
+    rng = random.Random(42)
+
+    def random_user() -> int:
+        return BENCH_USER_BASE + rng.randint(1, users)
+
+    def reset_reminders() -> None:
+        with get_connection() as conn:
+            conn.cursor().execute("UPDATE reminders SET next_reminder_date = CURRENT_DATE")
+            conn.commit()
+
+    database.refresh_monthly_summaries()
+
+    scenarios = {
+        "add_expense": (lambda: database.add_expense(random_user(), 150.0, rng.choice(CATEGORIES)), None),
+        "record_expense_with_alerts": (
+            lambda: database.record_expense_with_alerts(random_user(), 150.0, rng.choice(CATEGORIES)), None
+        ),
+        "check_budget_alerts": (
+            lambda: database.check_budget_alerts(random_user(), rng.choice(CATEGORIES), 150.0), None
+        ),
+        "get_monthly_expenses": (database.get_monthly_expenses, None),
+        "get_detailed_monthly_expenses": (database.get_detailed_monthly_expenses, None),
+        "get_todays_reminders": (database.get_todays_reminders, reset_reminders),
+        # Как /budget: выборка статусов и форматирование вместе
+        "format_budget_report": (lambda: format_budget_report(database.get_budget_statuses(), None), None),
+    }
+
+    results = {}
+    for name, (func, setup) in scenarios.items():
+        results[name] = measure(func, iterations, warmup, setup)
+        logger.info("%s: p50=%.3f ms p99=%.3f ms", name, results[name]["p50_ms"], results[name]["p99_ms"])
+    return results
+
+
+def explain_planning(cursor, sql: str, params) -> float:
+    """Planning Time (мс) из EXPLAIN ANALYZE; запрос выполняется, поэтому вызывать в откатываемой транзакции"""
+    cursor.execute("EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) " + sql, params)
+    return cursor.fetchone()["QUERY PLAN"][0]["Planning Time"]
+
+
+def measure_planning(users: int, iterations: int, warmup: int) -> Dict[str, Dict]:
+    """Время планирования запросов реестра: текст SQL против EXECUTE подготовленного оператора"""
+    import database
+    from db import GENERIC_PLAN_SQL, get_connection, registered_queries
+
+    rng = random.Random(7)
+    today = datetime.now()
+    starts = {period: database.get_period_start_date(period, today) for period in PERIODS}
+
+    def random_user() -> int:
+        return BENCH_USER_BASE + rng.randint(1, users)
+
+    # Параметры как у database.py на одну трату
+    params = {
+        "user_name": lambda: (random_user(),),
+        "insert_expense": lambda: (random_user(), 150.0, rng.choice(CATEGORIES), today.strftime("%Y-%m-%d"), "bench"),
+        "budgets": lambda: (),
+        "category_spent": lambda: (rng.choice(CATEGORIES), starts[rng.choice(PERIODS)]),
+        "record_expense": lambda: {
+            "user_id": random_user(), "amount": 150.0, "category": rng.choice(CATEGORIES),
+            "today": today.strftime("%Y-%m-%d"), "earliest": min(starts.values()), **starts,
+        },
+    }
+
+    results = {}
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        for name, query in registered_queries().items():
+            make_params = params.get(name)
+            if make_params is None:
+                logger.warning("Нет параметров для запроса %s, пропускаем", name)
+                continue
+            if name not in conn.prepared:
+                cursor.execute(query.prepare_sql)
+                conn.prepared.add(name)
+
+            plain, prepared = [], []
+            for i in range(warmup + iterations):
+                values = make_params()
+                plain_ms = explain_planning(cursor, query.sql, values)
+                if query.generic_plan:
+                    cursor.execute(GENERIC_PLAN_SQL)
+                prepared_ms = explain_planning(cursor, query.execute_sql, query.arguments(values))
+                conn.rollback()
+                if i >= warmup:
+                    plain.append(plain_ms)
+                    prepared.append(prepared_ms)
+
+            results[name] = {
+                "plain_planning_ms": round(sum(plain) / len(plain), 4),
+                "prepared_planning_ms": round(sum(prepared) / len(prepared), 4),
+            }
+            results[name]["saved_ms"] = round(
+                results[name]["plain_planning_ms"] - results[name]["prepared_planning_ms"], 4
+            )
+    return results
+
+
+def explain_timing(cursor, sql: str, params) -> Dict[str, float]:
+    """Planning Time и Execution Time (мс) из EXPLAIN ANALYZE; вызывать в откатываемой транзакции"""
+    cursor.execute("EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) " + sql, params)
+    plan = cursor.fetchone()["QUERY PLAN"][0]
+    return {"planning_ms": plan["Planning Time"], "execution_ms": plan["Execution Time"]}
+
+
+def measure_plan_modes(users: int, iterations: int, warmup: int) -> Dict[str, Dict]:
+    """
+    Запросы реестра с generic_plan=True: EXECUTE с общим планом против плана,
+    построенного под параметры, по отдельности для узкого и широкого периода.
+    Общий план оправдан, только если он не медленнее и в узком периоде.
+    """
+    import database
+    from db import GENERIC_PLAN_SQL, get_connection, registered_queries
+
+    rng = random.Random(11)
+    today = datetime.now()
+    starts = {period: database.get_period_start_date(period, today) for period in PERIODS}
+    year_ago = (today - timedelta(days=365)).strftime("%Y-%m-%d")
+
+    def random_user() -> int:
+        return BENCH_USER_BASE + rng.randint(1, users)
+
+    def record_expense(earliest: str) -> Callable:
+        return lambda: {
+            "user_id": random_user(), "amount": 150.0, "category": rng.choice(CATEGORIES),
+            "today": today.strftime("%Y-%m-%d"), "earliest": earliest, **starts,
+        }
+
+    # Узкий период - сегодняшний день, широкий - год истории
+    cases = {
+        "category_spent": {
+            "narrow": lambda: (rng.choice(CATEGORIES), starts["daily"]),
+            "wide": lambda: (rng.choice(CATEGORIES), year_ago),
+        },
+        "record_expense": {
+            "narrow": record_expense(starts["daily"]),
+            "wide": record_expense(year_ago),
+        },
+    }
+    modes = {"custom": "SET LOCAL plan_cache_mode = force_custom_plan", "generic": GENERIC_PLAN_SQL}
+
+    results = {}
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        for name, query in registered_queries().items():
+            if not query.generic_plan:
+                continue
+            if name not in cases:
+                logger.warning("Нет параметров для запроса %s, пропускаем", name)
+                continue
+            if name not in conn.prepared:
+                cursor.execute(query.prepare_sql)
+                conn.prepared.add(name)
+
+            for case, make_params in cases[name].items():
+                samples = {mode: {"planning_ms": [], "execution_ms": []} for mode in modes}
+                for i in range(warmup + iterations):
+                    values = make_params()
+                    for mode, set_mode in modes.items():
+                        cursor.execute(set_mode)
+                        timing = explain_timing(cursor, query.execute_sql, query.arguments(values))
+                        conn.rollback()
+                        if i >= warmup:
+                            for key, value in timing.items():
+                                samples[mode][key].append(value)
+
+                results[f"{name} ({case})"] = {
+                    f"{mode}_{key}": round(sum(values) / len(values), 4)
+                    for mode, timings in samples.items()
+                    for key, values in timings.items()
+                }
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: Dict[str, Dict], baseline: Optional[Dict[str, Dict]] = None) -> None:
+    header = f"{'функция':32} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'ops/s':>10}"
+    if baseline:
+        header += f" {'Δp50':>8} {'Δp99':>8}"
+    print(header)
+    for name, stats in results.items():
+        line = (
+            f"{name:32} {stats['p50_ms']:>10.3f} {stats['p95_ms']:>10.3f} "
+            f"{stats['p99_ms']:>10.3f} {stats['ops_per_sec']:>10.1f}"
+        )
+        base = (baseline or {}).get(name)
+        if base:
+            for key in ("p50_ms", "p99_ms"):
+                change = (stats[key] - base[key]) / base[key] * 100 if base[key] else 0.0
+                line += f" {change:>+7.1f}%"
+        print(line)
+
+
+def print_planning(planning: Dict[str, Dict]) -> None:
+    print(f"\n{'запрос (планирование)':32} {'SQL ms':>10} {'EXECUTE ms':>10} {'экономия ms':>12}")
+    for name, stats in planning.items():
+        print(
+            f"{name:32} {stats['plain_planning_ms']:>10.4f} {stats['prepared_planning_ms']:>10.4f} "
+            f"{stats['saved_ms']:>12.4f}"
+        )
+    # Трата из бота - один record_expense; add_expense + check_budget_alerts - вставка и три суммы
+    # (имя пользователя и бюджеты обычно берутся из кэша)
+    if "record_expense" in planning:
+        print(f"На одну трату (record_expense_with_alerts): экономия {planning['record_expense']['saved_ms']:.4f} ms планирования")
+    if "insert_expense" in planning and "category_spent" in planning:
+        saved = planning["insert_expense"]["saved_ms"] + 3 * planning["category_spent"]["saved_ms"]
+        print(f"На одну трату (add_expense + check_budget_alerts): экономия {saved:.4f} ms планирования")
+
+
+def print_plan_modes(plan_modes: Dict[str, Dict]) -> None:
+    print(f"\n{'запрос (план под параметры / общий)':40} {'план ms':>16} {'выполнение ms':>18} {'итого ms':>18}")
+    for name, stats in plan_modes.items():
+        custom_total = stats["custom_planning_ms"] + stats["custom_execution_ms"]
+        generic_total = stats["generic_planning_ms"] + stats["generic_execution_ms"]
+        print(
+            f"{name:40} {stats['custom_planning_ms']:>7.4f} / {stats['generic_planning_ms']:<7.4f}"
+            f" {stats['custom_execution_ms']:>8.4f} / {stats['generic_execution_ms']:<8.4f}"
+            f" {custom_total:>8.4f} / {generic_total:<8.4f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк функций database.py на временной базе PostgreSQL")
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL", Config.DATABASE_URL),
+                        help="сервер для временной базы (нужно право CREATE DATABASE)")
+    parser.add_argument("--users", type=int, default=20, help="синтетических пользователей")
+    parser.add_argument("--rows", type=int, default=100000, help="строк в expenses (10k-10M)")
+    parser.add_argument("--days", type=int, default=730, help="глубина истории в днях")
+    parser.add_argument("--reminders", type=int, default=200, help="напоминаний на сегодня")
+    parser.add_argument("--iterations", type=int, default=200, help="замеров на функцию")
+    parser.add_argument("--warmup", type=int, default=20, help="прогревочных вызовов")
+    parser.add_argument("--output", help="записать результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--no-prepared", action="store_true",
+                        help="выполнять database.py без PREPARE (DB_PREPARED_STATEMENTS=false)")
+    parser.add_argument("--keep", action="store_true", help="не удалять временную базу")
+    args = parser.parse_args()
+
+    # Подробные INFO-логи database.py на каждый вызов зашумили бы замеры
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    logger.setLevel(logging.INFO)
+    # Фоновые обновления materialized views исказили бы замеры записи
+    Config.MONTHLY_SUMMARY_REFRESH_WRITES = 0
+    Config.DB_PREPARED_STATEMENTS = not args.no_prepared
+
+    name = f"bench_{os.getpid()}"
+    bench_dsn = create_database(args.dsn, name)
+    os.environ["DATABASE_URL"] = bench_dsn
+    logger.info("Временная база %s создана", name)
+
+    try:
+        prepare_schema(args.days)
+        started = time.perf_counter()
+        seed(args.users, args.rows, args.days, args.reminders)
+        logger.info("Заполнено %s строк за %.1f с", args.rows, time.perf_counter() - started)
+
+        results = run_benchmarks(args.users, args.iterations, args.warmup)
+        planning = measure_planning(args.users, args.iterations, args.warmup)
+        plan_modes = measure_plan_modes(args.users, args.iterations, args.warmup)
+    finally:
+        from db import close_pools
+        close_pools()
+        if args.keep:
+            logger.info("Временная база оставлена: %s", bench_dsn)
+        else:
+            drop_database(args.dsn, name)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "server": parse_dsn(args.dsn).get("host", "local"),
+            "users": args.users,
+            "rows": args.rows,
+            "days": args.days,
+            "iterations": args.iterations,
+            "prepared_statements": not args.no_prepared,
+        },
+        "results": results,
+        "planning": planning,
+        "plan_modes": plan_modes,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+    print_planning(planning)
+    print_plan_modes(plan_modes)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ Результаты записаны в {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -3,19 +3,36 @@ Main entry point for the Telegram expense tracking bot.
 This file orchestrates all components and starts the bot.
 """
 
+from time import perf_counter
+
+_IMPORT_STARTED = perf_counter()
+
+import asyncio
 import logging
+import sys
 from datetime import time
-from telegram import BotCommand, BotCommandScopeDefault, BotCommandScopeAllPrivateChats, BotCommandScopeAllGroupChats
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ConversationHandler
+from typing import Optional
+from telegram import Update, BotCommand, BotCommandScopeDefault, BotCommandScopeAllPrivateChats, BotCommandScopeAllGroupChats
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
 
 # Import configuration
 from config import Config, BUDGET_AMOUNT, BUDGET_CATEGORY, SAVINGS_DESCRIPTION, SAVINGS_AMOUNT
 
 # Import database components
-from db import wait_for_db
+from db import acting_user, close_pools, wait_for_db
+from database_migrations import DatabaseMigration
+from database_async import shutdown_executor
+from cache_listener import start_listener, stop_listener
+from update_processor import PerChatUpdateProcessor
+from persistence import PostgresPersistence, SharedConversationHandler
+from job_leases import CoordinatedJob, daily_at, every
+from outbound import OutboundDispatcher
+
+# Import metrics
+from metrics import instrument, instrument_handlers, observe_update, start_metrics_server, stop_metrics_server
 
 # Import utilities
-from utils import setup_logging
+from utils import setup_logging, prewarm_charts
 
 # Import all handlers
 from handlers import (
@@ -27,18 +44,57 @@ from handlers import (
     process_savings_callback,
     set_reminder_start, process_reminder_callback,
     reset_portal_password, handle_general_messages,
-    send_daily_reports, check_reminders,
+    build_daily_report, send_daily_reports, check_reminders, maintain_expense_partitions, refresh_summary_views,
     category_callback,
     show_recent_expenses, process_delete_expense_callback
 )
 
+# Время импорта модулей бота (регрессии старта видны в логе)
+IMPORT_SECONDS = perf_counter() - _IMPORT_STARTED
+
 # Setup logging
 logger = setup_logging()
 
 
+class InstrumentedApplication(Application):
+    """Application recording per-update latency, query counts and slow-update profiles"""
+
+    async def process_update(self, update: object) -> None:
+        # Запросы апдейта знают своего пользователя: после его записи отчеты читаются с primary
+        user = update.effective_user if isinstance(update, Update) else None
+        with acting_user(user.id if user else None):
+            await observe_update(self._process_with_persistence, update)
+
+    _persistence_write: Optional[asyncio.Task] = None
+
+    async def _process_with_persistence(self, update: object) -> None:
+        # Состояние могла изменить другая реплика: подтягиваем его до обработки, а
+        # свое записываем вскоре после, чтобы следующий апдейт диалога увидел его где угодно
+        if not isinstance(self.persistence, PostgresPersistence):
+            await super().process_update(update)
+            return
+        await self.persistence.prefetch(self, update)
+        await super().process_update(update)
+        if self._persistence_write is None:
+            self._persistence_write = self.create_task(self._write_persistence_soon(), name="persistence-write")
+
+    async def _write_persistence_soon(self) -> None:
+        # Апдейты, закончившиеся за BOT_PERSISTENCE_FLUSH_DELAY, уходят одним upsert
+        try:
+            await asyncio.sleep(Config.BOT_PERSISTENCE_FLUSH_DELAY)
+        finally:
+            self._persistence_write = None
+        await self.update_persistence()
+
+    async def update_persistence(self) -> None:
+        await super().update_persistence()
+        if isinstance(self.persistence, PostgresPersistence):
+            await self.persistence.write_pending()
+
+
 def create_budget_handler():
     """Create conversation handler for setting budgets"""
-    return ConversationHandler(
+    return SharedConversationHandler(
         entry_points=[CommandHandler("set_budget", set_budget_start)],
         states={
             BUDGET_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, budget_amount)],
@@ -46,18 +102,22 @@ def create_budget_handler():
             BUDGET_CATEGORY + 1: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_budget)],
         },
         fallbacks=[],
+        name="budget",
+        persistent=Config.BOT_PERSISTENCE,
     )
 
 
 def create_savings_handler():
     """Create conversation handler for creating savings goals"""
-    return ConversationHandler(
+    return SharedConversationHandler(
         entry_points=[CommandHandler("add_savings_goal", savings_goal_start)],
         states={
             SAVINGS_DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, savings_description)],
             SAVINGS_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, savings_amount)],
         },
         fallbacks=[],
+        name="savings",
+        persistent=Config.BOT_PERSISTENCE,
     )
 
 
@@ -99,6 +159,31 @@ async def setup_bot_commands(application: Application) -> None:
     logger.info("All bot commands successfully registered")
 
 
+async def shutdown_database(application: Application) -> None:
+    """Stop the metrics endpoint, the cache listener, the database and chart executors and close pooled connections"""
+    stop_metrics_server()
+    stop_listener()
+    shutdown_executor()
+    charts = sys.modules.get('charts')
+    if charts is not None:
+        charts.shutdown_executor()
+    close_pools()
+    logger.info("Database connections closed")
+
+
+async def post_init(application: Application) -> None:
+    """Register commands, start the cache listener and metrics endpoint, warm up lazily loaded modules"""
+    await setup_bot_commands(application)
+
+    if Config.CACHE_LISTEN:
+        start_listener()
+
+    start_metrics_server()
+
+    if Config.CHART_PREWARM:
+        application.create_task(prewarm_charts())
+
+
 def setup_handlers(application: Application) -> None:
     """Setup all command and conversation handlers"""
 
@@ -134,19 +219,39 @@ def setup_handlers(application: Application) -> None:
 
 
 def setup_scheduled_tasks(application: Application) -> None:
-    """Setup scheduled tasks (reminders and daily reports)"""
+    """Setup scheduled tasks (reminders, daily reports, summary views and partition maintenance)"""
     try:
         job_queue = application.job_queue
 
-        # Настраиваем задания
-        job_queue.run_daily(
-            check_reminders,
-            time=time(hour=Config.REMINDER_CHECK_HOUR, minute=Config.REMINDER_CHECK_MINUTE)
-        )
-        job_queue.run_daily(
-            send_daily_reports,
-            time=time(hour=Config.DAILY_REPORT_HOUR, minute=Config.DAILY_REPORT_MINUTE)
-        )
+        # Каждая реплика опрашивает задачи, но запуск (и каждый его шард) выполняет
+        # только реплика, захватившая аренду в job_leases
+        jobs = [
+            CoordinatedJob(
+                "check_reminders",
+                instrument(check_reminders),
+                daily_at(time(hour=Config.REMINDER_CHECK_HOUR, minute=Config.REMINDER_CHECK_MINUTE)),
+                shards=Config.JOB_SHARDS,
+            ),
+            CoordinatedJob(
+                "send_daily_reports",
+                instrument(send_daily_reports),
+                daily_at(time(hour=Config.DAILY_REPORT_HOUR, minute=Config.DAILY_REPORT_MINUTE)),
+                shards=Config.JOB_SHARDS,
+                prepare=build_daily_report,
+            ),
+            CoordinatedJob(
+                "refresh_summary_views",
+                instrument(refresh_summary_views),
+                every(Config.MONTHLY_SUMMARY_REFRESH_INTERVAL),
+            ),
+            CoordinatedJob(
+                "maintain_expense_partitions",
+                instrument(maintain_expense_partitions),
+                daily_at(time(hour=Config.PARTITION_MAINTENANCE_HOUR)),
+            ),
+        ]
+        for job in jobs:
+            job_queue.run_repeating(job, interval=Config.JOB_POLL_INTERVAL, first=0, name=job.name)
 
         logger.info("Job queue configured successfully")
     except Exception as e:
@@ -155,37 +260,86 @@ def setup_scheduled_tasks(application: Application) -> None:
         logger.warning("Reminder and automatic report features will be unavailable")
 
 
+def build_application(bot=None, scheduled_tasks: bool = True) -> Application:
+    """
+    Build the bot Application with all handlers, metrics and lifecycle hooks.
+
+    Args:
+        bot: Prebuilt Bot instance (the load test passes one with a fake request); by default the bot is created from TELEGRAM_BOT_TOKEN.
+            A prebuilt bot keeps its own rate limiter: pass rate_limiter=OutboundDispatcher() to it for the OUTBOUND_* limits
+        scheduled_tasks: Register reminder/report/maintenance jobs in the JobQueue
+    """
+    builder = Application.builder().application_class(InstrumentedApplication)
+    if bot is not None:
+        builder = builder.bot(bot)
+        if Config.OUTBOUND_LIMITS and not isinstance(getattr(bot, "rate_limiter", None), OutboundDispatcher):
+            logger.info("Prebuilt bot has no OutboundDispatcher: only bulk sends are paced by OUTBOUND_GLOBAL_RATE")
+    else:
+        builder = builder.token(Config.TELEGRAM_BOT_TOKEN)
+        if Config.OUTBOUND_LIMITS:
+            builder = builder.rate_limiter(OutboundDispatcher())
+    if Config.BOT_PERSISTENCE:
+        builder = builder.persistence(PostgresPersistence(update_interval=Config.BOT_PERSISTENCE_UPDATE_INTERVAL))
+    if Config.CONCURRENT_UPDATES > 1:
+        builder = builder.concurrent_updates(PerChatUpdateProcessor(Config.CONCURRENT_UPDATES))
+    application = builder.build()
+
+    # Setup handlers
+    logger.info("Setting up handlers...")
+    setup_handlers(application)
+    instrument_handlers(application)
+
+    # Setup scheduled tasks
+    if scheduled_tasks:
+        logger.info("Setting up scheduled tasks...")
+        setup_scheduled_tasks(application)
+
+    # Register bot commands in Telegram
+    application.post_init = post_init
+    application.post_shutdown = shutdown_database
+    return application
+
+
 def main() -> None:
     """Main entry point for the bot"""
 
     # Validate configuration
     Config.validate()
 
-    # Wait for database and initialize structure
+    logger.info(f"Bot modules imported in {IMPORT_SECONDS:.2f}s")
+
+    # Wait for database; migrations are applied separately before rollout
+    # (python database_migrations.py migrate), not by every starting replica
     logger.info("Waiting for database...")
     wait_for_db()
 
+    pending = DatabaseMigration().pending_migrations()
+    if pending:
+        versions = ", ".join(str(version) for version, _ in pending)
+        logger.warning(
+            f"Database has pending migrations ({versions}); "
+            f"run `python database_migrations.py migrate` before starting the bot"
+        )
+
     logger.info("Database connection ready")
 
     # Create application
     logger.info("Creating bot application...")
-    application = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).build()
-
-    # Setup handlers
-    logger.info("Setting up handlers...")
-    setup_handlers(application)
-
-    # Setup scheduled tasks
-    logger.info("Setting up scheduled tasks...")
-    setup_scheduled_tasks(application)
-
-    # Register bot commands in Telegram
-    logger.info("Registering bot commands...")
-    application.post_init = setup_bot_commands
+    application = build_application()
 
     # Start the bot
-    logger.info("Starting bot...")
-    application.run_polling()
+    if Config.BOT_MODE == "webhook":
+        logger.info(f"Starting bot with webhook on {Config.WEBHOOK_LISTEN}:{Config.WEBHOOK_PORT}/{Config.WEBHOOK_PATH}...")
+        application.run_webhook(
+            listen=Config.WEBHOOK_LISTEN,
+            port=Config.WEBHOOK_PORT,
+            url_path=Config.WEBHOOK_PATH,
+            webhook_url=f"{Config.WEBHOOK_URL.rstrip('/')}/{Config.WEBHOOK_PATH}",
+            secret_token=Config.WEBHOOK_SECRET_TOKEN,
+        )
+    else:
+        logger.info("Starting bot with long polling...")
+        application.run_polling()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+"""
+In-process caches for near-static lookups (categories, user names, budgets).
+Entries expire after a TTL, the least recently used entries are evicted
+once a cache is full, and writers invalidate entries explicitly.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from config import Config
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache with a per-entry TTL and hit/miss counters"""
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._generation = 0  # растет при каждом invalidate()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Return the cached value or call loader() and cache its result.
+        A result loaded while the cache was invalidated is returned but not
+        stored: it may predate the change that caused the invalidation.
+        """
+        with self._lock:
+            generation = self._generation
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            with self._lock:
+                if self._generation == generation:
+                    self._store(key, value)
+        return value
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """Drop one key, or every entry when key is None"""
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_caches: Dict[str, TTLCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name: str, maxsize: Optional[int] = None, ttl: Optional[float] = None) -> TTLCache:
+    """Return the named cache, creating it with Config defaults on first use"""
+    with _caches_lock:
+        cache = _caches.get(name)
+        if cache is None:
+            cache = TTLCache(
+                name,
+                maxsize=maxsize or Config.CACHE_MAX_SIZE,
+                ttl=Config.CACHE_TTL if ttl is None else ttl,
+            )
+            _caches[name] = cache
+        return cache
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    """Hit/miss/eviction counters for every cache"""
+    with _caches_lock:
+        caches = list(_caches.values())
+    return {cache.name: cache.stats() for cache in caches}
+
+
+def invalidate_all() -> None:
+    """Clear every cache (e.g. after bulk data changes)"""
+    with _caches_lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        cache.invalidate()
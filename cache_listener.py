@@ -0,0 +1,131 @@
+"""
+Cross-process cache invalidation for the bot.
+Listens on the PostgreSQL channel fed by the notify_cache_invalidation()
+triggers (db_schema.CACHE_NOTIFY_TABLES) on a dedicated connection and drops
+the matching entries from the in-process caches, so edits made through the
+web portal are visible to the bot without waiting for the TTL.
+"""
+
+import logging
+import select
+import threading
+from typing import Optional
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from cache import get_cache, invalidate_all
+from db import get_database_url
+from db_schema import CACHE_NOTIFY_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+# Таблица -> имя кэша в database.py
+TABLE_CACHES = {
+    "categories": "categories",
+    "budgets": "budgets",
+    "users": "user_names",
+}
+
+
+def handle_notification(payload: str) -> None:
+    """Apply one NOTIFY payload: '<table>' or '<table>:<key>'"""
+    table, _, key = payload.partition(":")
+    cache_name = TABLE_CACHES.get(table)
+    if cache_name is None:
+        logger.warning(f"Unknown cache invalidation payload: {payload}")
+        return
+
+    cache = get_cache(cache_name)
+    if key:
+        try:
+            cache.invalidate(int(key))
+        except ValueError:
+            cache.invalidate()
+    else:
+        cache.invalidate()
+
+
+class CacheInvalidationListener:
+    """Background thread running LISTEN on its own autocommit connection"""
+
+    def __init__(
+        self,
+        dsn: Optional[str] = None,
+        channel: str = CACHE_NOTIFY_CHANNEL,
+        poll_interval: float = 5.0,
+        reconnect_delay: float = 5.0,
+    ):
+        self.dsn = dsn or get_database_url()
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout if timeout is not None else self.poll_interval + 1)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                conn.cursor().execute(f"LISTEN {self.channel}")
+                # Пока соединения не было, уведомления могли потеряться
+                invalidate_all()
+                logger.info(f"Listening for cache invalidations on '{self.channel}'")
+                self._listen(conn)
+            except psycopg2.Error as e:
+                logger.warning(f"Cache listener connection lost: {e}; retrying in {self.reconnect_delay}s")
+                self._stop.wait(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _listen(self, conn) -> None:
+        while not self._stop.is_set():
+            readable, _, _ = select.select([conn], [], [], self.poll_interval)
+            if not readable:
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                try:
+                    handle_notification(notify.payload)
+                except Exception as e:
+                    logger.error(f"Error handling cache invalidation '{notify.payload}': {e}")
+
+
+_listener: Optional[CacheInvalidationListener] = None
+_listener_lock = threading.Lock()
+
+
+def start_listener() -> CacheInvalidationListener:
+    """Start the shared listener thread (idempotent)"""
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = CacheInvalidationListener()
+            _listener.start()
+        return _listener
+
+
+def stop_listener() -> None:
+    """Stop the shared listener thread (called on bot shutdown)"""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
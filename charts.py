@@ -0,0 +1,124 @@
+"""
+Chart rendering service for the expense tracking bot.
+Draws with matplotlib's object-oriented Figure API (no global pyplot state)
+on a dedicated worker thread and caches PNG bytes by a hash of the
+aggregated data, so repeated reports over unchanged data reuse one image.
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import matplotlib
+from matplotlib.figure import Figure
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Установка русских шрифтов для matplotlib
+matplotlib.rcParams['font.family'] = 'DejaVu Sans'
+matplotlib.rcParams['font.size'] = 12
+
+MONTHLY_CHART_TITLE = 'Общие расходы семьи за месяц по категориям'
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_cache: "OrderedDict[str, bytes]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the chart rendering executor, creating it on first use"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=Config.CHART_WORKERS,
+                    thread_name_prefix="charts",
+                )
+    return _executor
+
+
+def shutdown_executor(wait: bool = True) -> None:
+    """Stop the chart executor (called on bot shutdown)"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
+
+
+def chart_data(expenses: list) -> List[Tuple[str, float]]:
+    """Convert aggregated expense rows to (category, total) pairs"""
+    return [
+        (expense['category'], float(expense['total']) if expense['total'] is not None else 0)
+        for expense in expenses
+    ]
+
+
+def chart_cache_key(title: str, data: List[Tuple[str, float]]) -> str:
+    """Stable hash of the chart title and its data"""
+    payload = json.dumps([title, data], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def render_pie_chart(data: List[Tuple[str, float]], title: str) -> bytes:
+    """Render a pie chart to PNG bytes"""
+    labels = [category for category, _ in data]
+    values = [total for _, total in data]
+
+    figure = Figure(figsize=(10, 6))
+    axes = figure.subplots()
+    axes.pie(values, labels=labels, autopct='%1.1f%%', startangle=90)
+    axes.axis('equal')  # Равные пропорции для круговой диаграммы
+    axes.set_title(title)
+
+    buf = io.BytesIO()
+    figure.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+def _cache_get(key: str) -> Optional[bytes]:
+    with _cache_lock:
+        image = _cache.get(key)
+        if image is not None:
+            _cache.move_to_end(key)
+        return image
+
+
+def _cache_put(key: str, image: bytes) -> None:
+    with _cache_lock:
+        _cache[key] = image
+        _cache.move_to_end(key)
+        while len(_cache) > Config.CHART_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+async def render_monthly_chart(expenses: list) -> Optional[bytes]:
+    """
+    Pie chart PNG for monthly expenses by category (entire family).
+    Takes the rows already returned by get_monthly_expenses.
+    Returns None if there is nothing to draw.
+    """
+    data = chart_data(expenses)
+    if not data or not any(total for _, total in data):
+        logger.warning("No expense data for creating chart")
+        return None
+
+    key = chart_cache_key(MONTHLY_CHART_TITLE, data)
+    image = _cache_get(key)
+    if image is not None:
+        return image
+
+    loop = asyncio.get_running_loop()
+    image = await loop.run_in_executor(get_executor(), render_pie_chart, data, MONTHLY_CHART_TITLE)
+    _cache_put(key, image)
+    return image
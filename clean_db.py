@@ -4,25 +4,13 @@
 ВНИМАНИЕ: Это действие необратимо!
 """
 
-from contextlib import contextmanager
 from typing import Iterable
 
-import psycopg2
-
-from db import get_database_url, wait_for_db
+from db import get_connection, wait_for_db
 
 TABLES = ['expenses', 'budgets', 'savings_goals', 'reminders', 'users']
 
 
-@contextmanager
-def get_connection():
-    conn = psycopg2.connect(get_database_url())
-    try:
-        yield conn
-    finally:
-        conn.close()
-
-
 def show_database_stats():
     """Показывает количество записей в основных таблицах"""
     with get_connection() as conn:
@@ -30,8 +18,8 @@ def show_database_stats():
         print("\n📊 Статистика базы данных:")
         print("-" * 40)
         for table in TABLES:
-            cursor.execute(f'SELECT COUNT(*) FROM {table}')
-            count = cursor.fetchone()[0]
+            cursor.execute(f'SELECT COUNT(*) AS count FROM {table}')
+            count = cursor.fetchone()['count']
             print(f"{table:15}: {count:5} записей")
 
 
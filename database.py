@@ -4,6 +4,7 @@ Contains all functions for working with expenses, budgets, savings goals, and re
 """
 
 import logging
+import threading
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional, Tuple
 
@@ -11,335 +12,510 @@ import bcrypt
 import psycopg2
 from psycopg2 import IntegrityError
 
-from db import get_db_connection
+from cache import get_cache
+from db import (
+    execute_prepared, get_connection, get_read_connection, is_acting_user_pinned, pin_primary, prepared_query
+)
+from db_schema import MONTHLY_SUMMARY_VIEWS
 from config import PERIOD_LABEL_TO_CODE, CODE_TO_PERIOD_LABEL, Config, CATEGORIES
 
 logger = logging.getLogger(__name__)
 
 
+BUDGET_PERIODS = ['daily', 'weekly', 'monthly']
+
+# Кэши почти неизменяемых справочников: записи живут Config.CACHE_TTL секунд,
+# а функции записи ниже сбрасывают их явно
+category_cache = get_cache('categories')
+user_name_cache = get_cache('user_names')
+budget_cache = get_cache('budgets')
+
+# Ключ, по которому бюджеты читаются с primary сразу после изменения: кэш
+# общий для семьи, и с отстающей реплики в него попали бы старые значения
+BUDGETS_PIN = 'budgets'
+
+# Запросы, которые выполняются на каждую трату: PREPARE один раз на соединение
+USER_NAME_QUERY = prepared_query('user_name', 'SELECT user_name FROM users WHERE user_id = %s')
+INSERT_EXPENSE_QUERY = prepared_query(
+    'insert_expense',
+    'INSERT INTO expenses (user_id, amount, category, date, user_name) VALUES (%s, %s, %s, %s, %s)'
+)
+BUDGETS_QUERY = prepared_query('budgets', 'SELECT category, amount, period FROM budgets ORDER BY category')
+# daily_category_totals не секционирована; общий план - тот же index-only scan по
+# (category, transaction_type, date) при любой дате начала (см. bench_database.py)
+CATEGORY_SPENT_QUERY = prepared_query(
+    'category_spent',
+    'SELECT SUM(total) as spent FROM daily_category_totals WHERE category = %s AND date >= %s AND transaction_type = \'expense\'',
+    generic_plan=True,
+)
+
+
 def normalize_period_value(period: str) -> str:
     """Normalize period value from label to code"""
     return PERIOD_LABEL_TO_CODE.get(period, period)
 
 
+def get_period_start_date(period_code: str, today: Optional[datetime] = None) -> str:
+    """Return the first day (YYYY-MM-DD) of the budget period containing today"""
+    today = today or datetime.now()
+    if period_code == 'weekly':
+        return (today - timedelta(days=today.weekday())).strftime('%Y-%m-%d')
+    if period_code == 'monthly':
+        return today.replace(day=1).strftime('%Y-%m-%d')
+    return today.strftime('%Y-%m-%d')
+
+
+def _cached_user_name(cursor, user_id: int) -> str:
+    """User name for audit columns, read through the cache using an already open cursor"""
+    def load():
+        execute_prepared(cursor, USER_NAME_QUERY, (user_id,))
+        result = cursor.fetchone()
+        return result['user_name'] if result else None
+
+    return user_name_cache.get_or_load(user_id, load) or "Пользователь"
+
+
 # ========== EXPENSE OPERATIONS ==========
+# Отчеты читают daily_category_totals - дневную свертку expenses, которую
+# триггер обновляет в той же транзакции, что и INSERT/DELETE (миграция 8).
 
 def add_expense(user_id: int, amount: float, category: str) -> None:
     """Add a new expense for a user"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    today = datetime.now().strftime('%Y-%m-%d')
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        today = datetime.now().strftime('%Y-%m-%d')
 
-    try:
-        # Получаем имя пользователя из базы
-        cursor.execute('SELECT user_name FROM users WHERE user_id = %s', (user_id,))
-        result = cursor.fetchone()
-        user_name = result['user_name'] if result else "Пользователь"
+        try:
+            # Получаем имя пользователя из базы
+            user_name = _cached_user_name(cursor, user_id)
 
-        cursor.execute(
-            'INSERT INTO expenses (user_id, amount, category, date, user_name) VALUES (%s, %s, %s, %s, %s)',
-            (user_id, amount, category, today, user_name)
-        )
+            execute_prepared(cursor, INSERT_EXPENSE_QUERY, (user_id, amount, category, today, user_name))
 
-        conn.commit()
-        logger.info(f"Expense added: user_id={user_id}, amount={amount}, category={category}")
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error adding expense: {e}")
-        raise
-    finally:
-        conn.close()
+            conn.commit()
+            logger.info(f"Expense added: user_id={user_id}, amount={amount}, category={category}")
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error adding expense: {e}")
+            raise
+
+    pin_primary(user_id)
+    _note_expense_writes()
 
 
 def get_recent_expenses(user_id: int = None, limit: int = 5) -> List[Dict]:
     """Get recent expenses for entire family (user_id kept for backward compatibility, but shows all family expenses)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
 
-    try:
-        cursor.execute(
-            '''SELECT id, amount, category, date, description, transaction_type, user_name
-               FROM expenses
-               ORDER BY date DESC, id DESC
-               LIMIT %s''',
-            (limit,)
-        )
-        results = cursor.fetchall()
-        return results
-    except Exception as e:
-        logger.error(f"Error getting recent expenses: {e}")
-        return []
-    finally:
-        conn.close()
+        try:
+            cursor.execute(
+                '''SELECT id, amount, category, date, description, transaction_type, user_name
+                   FROM expenses
+                   ORDER BY date DESC, id DESC
+                   LIMIT %s''',
+                (limit,)
+            )
+            results = cursor.fetchall()
+            return results
+        except Exception as e:
+            logger.error(f"Error getting recent expenses: {e}")
+            return []
 
 
 def delete_expense(user_id: int, expense_id: int) -> bool:
     """Delete an expense by ID"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-    try:
-        # Проверяем, что операция принадлежит пользователю
-        cursor.execute(
-            'SELECT user_id FROM expenses WHERE id = %s',
-            (expense_id,)
-        )
-        result = cursor.fetchone()
+        try:
+            # Проверяем, что операция принадлежит пользователю
+            cursor.execute(
+                'SELECT user_id, date FROM expenses WHERE id = %s',
+                (expense_id,)
+            )
+            result = cursor.fetchone()
 
-        if not result:
-            logger.warning(f"Expense {expense_id} not found")
-            return False
+            if not result:
+                logger.warning(f"Expense {expense_id} not found")
+                return False
 
-        if result['user_id'] != user_id:
-            logger.warning(f"User {user_id} trying to delete expense {expense_id} of another user")
-            return False
+            if result['user_id'] != user_id:
+                logger.warning(f"User {user_id} trying to delete expense {expense_id} of another user")
+                return False
 
-        cursor.execute('DELETE FROM expenses WHERE id = %s', (expense_id,))
-        conn.commit()
-        logger.info(f"Expense deleted: id={expense_id}, user_id={user_id}")
-        return True
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error deleting expense: {e}")
-        raise
-    finally:
-        conn.close()
+            # Дата позволяет удалить строку, заглянув только в ее месячную партицию
+            cursor.execute('DELETE FROM expenses WHERE id = %s AND date = %s', (expense_id, result['date']))
+            conn.commit()
+            logger.info(f"Expense deleted: id={expense_id}, user_id={user_id}")
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error deleting expense: {e}")
+            raise
+
+    pin_primary(user_id)
+    _note_expense_writes()
+    return True
 
 
 def get_daily_expenses(user_id: int = None) -> Tuple[List[Dict], float]:
     """Get today's expenses for entire family (user_id kept for backward compatibility)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    today = datetime.now().strftime('%Y-%m-%d')
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        today = datetime.now().strftime('%Y-%m-%d')
 
-    try:
-        cursor.execute(
-            '''SELECT category, SUM(amount) as total
-               FROM expenses
-               WHERE date = %s AND transaction_type = 'expense'
-               GROUP BY category
-               ORDER BY category''',
-            (today,)
-        )
+        try:
+            cursor.execute(
+                '''SELECT category, SUM(total) as total
+                   FROM daily_category_totals
+                   WHERE date = %s AND transaction_type = 'expense'
+                   GROUP BY category
+                   ORDER BY category''',
+                (today,)
+            )
 
-        results = cursor.fetchall()
-        total = sum(float(row['total']) for row in results if row['total'])
-        return results, total
-    except Exception as e:
-        logger.error(f"Error getting daily expenses: {e}")
-        return [], 0
-    finally:
-        conn.close()
+            results = cursor.fetchall()
+            total = sum(float(row['total']) for row in results if row['total'])
+            return results, total
+        except Exception as e:
+            logger.error(f"Error getting daily expenses: {e}")
+            return [], 0
 
 
 def get_weekly_expenses(user_id: int = None) -> Tuple[List[Dict], float]:
     """Get weekly expenses for entire family (user_id kept for backward compatibility)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    today = datetime.now()
-    week_ago = (today - timedelta(days=7)).strftime('%Y-%m-%d')
-    today_str = today.strftime('%Y-%m-%d')
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        today = datetime.now()
+        week_ago = (today - timedelta(days=7)).strftime('%Y-%m-%d')
+        today_str = today.strftime('%Y-%m-%d')
 
-    try:
-        cursor.execute(
-            '''SELECT date, SUM(amount) as total
-               FROM expenses
-               WHERE date BETWEEN %s AND %s AND transaction_type = 'expense'
-               GROUP BY date
-               ORDER BY date''',
-            (week_ago, today_str)
-        )
-        results = cursor.fetchall()
-        total = sum(float(row['total']) for row in results if row['total'])
-        return results, total
-    except Exception as e:
-        logger.error(f"Error getting weekly expenses: {e}")
-        return [], 0
-    finally:
-        conn.close()
+        try:
+            cursor.execute(
+                '''SELECT date, SUM(total) as total
+                   FROM daily_category_totals
+                   WHERE date BETWEEN %s AND %s AND transaction_type = 'expense'
+                   GROUP BY date
+                   ORDER BY date''',
+                (week_ago, today_str)
+            )
+            results = cursor.fetchall()
+            total = sum(float(row['total']) for row in results if row['total'])
+            return results, total
+        except Exception as e:
+            logger.error(f"Error getting weekly expenses: {e}")
+            return [], 0
 
 
 def get_monthly_expenses(user_id: int = None) -> Tuple[List[Dict], float]:
     """Get monthly expenses for entire family (user_id kept for backward compatibility)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    today = datetime.now()
-    month_ago = (today - timedelta(days=30)).strftime('%Y-%m-%d')
-    today_str = today.strftime('%Y-%m-%d')
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        today = datetime.now()
+        month_ago = (today - timedelta(days=30)).strftime('%Y-%m-%d')
+        today_str = today.strftime('%Y-%m-%d')
+
+        try:
+            logger.info(f"Getting expenses from {month_ago} to {today_str} for entire family")
+
+            # Свежая materialized view отвечает одним чтением, иначе считаем по свертке
+            params = _summary_params('monthly_category_totals', month_ago, today_str)
+            results = []
+            if _summary_usable():
+                cursor.execute(
+                    f'''SELECT category, total
+                        FROM monthly_category_totals
+                        WHERE {_FRESH_SUMMARY}
+                        ORDER BY category''',
+                    params
+                )
+                results = cursor.fetchall()
+            if not results:
+                cursor.execute(
+                    '''SELECT category, SUM(total) as total
+                       FROM daily_category_totals
+                       WHERE date BETWEEN %(start)s AND %(end)s AND transaction_type = 'expense'
+                       GROUP BY category
+                       ORDER BY category''',
+                    params
+                )
+                results = cursor.fetchall()
+
+            logger.info(f"Got {len(results)} expense records")
+            for i, row in enumerate(results):
+                logger.info(f"Record {i+1}: category={row['category']}, total={row['total']}")
+
+            total = sum(row['total'] for row in results)
+            logger.info(f"Total expenses: {total}")
+
+            return results, total
+        except Exception as e:
+            logger.error(f"Error getting monthly expenses: {e}")
+            return [], 0
 
-    try:
-        logger.info(f"Getting expenses from {month_ago} to {today_str} for entire family")
 
-        cursor.execute(
-            '''SELECT category, SUM(amount) as total
-               FROM expenses
-               WHERE date BETWEEN %s AND %s AND transaction_type = 'expense'
-               GROUP BY category
-               ORDER BY category''',
-            (month_ago, today_str)
-        )
-        results = cursor.fetchall()
+def get_detailed_monthly_expenses() -> List[Dict]:
+    """Get detailed monthly report with breakdown by users"""
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        today = datetime.now()
+        month_ago = (today - timedelta(days=30)).strftime('%Y-%m-%d')
+        today_str = today.strftime('%Y-%m-%d')
+
+        try:
+            params = _summary_params('monthly_user_category_totals', month_ago, today_str)
+            results = []
+            if _summary_usable():
+                cursor.execute(
+                    f'''SELECT user_name, category, total
+                        FROM monthly_user_category_totals
+                        WHERE {_FRESH_SUMMARY}
+                        ORDER BY user_name, category''',
+                    params
+                )
+                results = cursor.fetchall()
+            if not results:
+                cursor.execute(
+                    '''SELECT COALESCE(user_name, 'Пользователь') AS user_name, category, SUM(total) as total
+                       FROM daily_category_totals
+                       WHERE date BETWEEN %(start)s AND %(end)s
+                       GROUP BY 1, category
+                       ORDER BY 1, category''',
+                    params
+                )
+                results = cursor.fetchall()
+            return results
+        except Exception as e:
+            logger.error(f"Error getting detailed monthly expenses: {e}")
+            return []
+
+
+# ========== MONTHLY SUMMARY VIEWS ==========
+# monthly_category_totals и monthly_user_category_totals (миграция 11) хранят
+# итоги за 30 дней. Отчеты читают их, пока обновление не старше
+# Config.MONTHLY_SUMMARY_MAX_AGE и окно посчитано на сегодня, иначе - свертку.
+# Свертку читают и после записи этого процесса, не попавшей в views, и пока
+# пользователь закреплен за primary: иначе он не увидел бы свою трату.
+
+_FRESH_SUMMARY = '''EXISTS (
+    SELECT 1 FROM summary_refreshes
+    WHERE view_name = %(view)s
+      AND window_end = %(end)s
+      AND refreshed_at >= now() - make_interval(secs => %(max_age)s)
+)'''
+
+_summary_refresh_lock = threading.Lock()
+_summary_writes_lock = threading.Lock()
+_expense_writes = 0
+
+
+def _summary_usable() -> bool:
+    """Whether the summary views may already contain every write this process and the acting user made"""
+    with _summary_writes_lock:
+        if _expense_writes:
+            return False
+    return not is_acting_user_pinned()
 
-        logger.info(f"Got {len(results)} expense records")
-        for i, row in enumerate(results):
-            logger.info(f"Record {i+1}: category={row['category']}, total={row['total']}")
 
-        total = sum(row['total'] for row in results)
-        logger.info(f"Total expenses: {total}")
+def _summary_params(view: str, start: str, end: str) -> Dict:
+    return {'view': view, 'start': start, 'end': end, 'max_age': Config.MONTHLY_SUMMARY_MAX_AGE}
 
-        return results, total
-    except Exception as e:
-        logger.error(f"Error getting monthly expenses: {e}")
-        return [], 0
-    finally:
-        conn.close()
 
-
-def get_detailed_monthly_expenses() -> List[Dict]:
-    """Get detailed monthly report with breakdown by users"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    today = datetime.now()
-    month_ago = (today - timedelta(days=30)).strftime('%Y-%m-%d')
-    today_str = today.strftime('%Y-%m-%d')
+def refresh_monthly_summaries() -> bool:
+    """Refresh the monthly summary views concurrently; False if a refresh is already running"""
+    global _expense_writes
+    if not _summary_refresh_lock.acquire(blocking=False):
+        return False
 
     try:
-        cursor.execute(
-            '''SELECT user_name, category, SUM(amount) as total
-               FROM expenses
-               WHERE date BETWEEN %s AND %s
-               GROUP BY user_name, category
-               ORDER BY user_name, category''',
-            (month_ago, today_str)
-        )
-        results = cursor.fetchall()
-        return results
-    except Exception as e:
-        logger.error(f"Error getting detailed monthly expenses: {e}")
-        return []
+        # Записи, сделанные до начала обновления, попадут в views; сбрасываем их
+        # только после коммита, иначе при ошибке отчеты читали бы views без них
+        with _summary_writes_lock:
+            covered_writes = _expense_writes
+
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                for view in MONTHLY_SUMMARY_VIEWS:
+                    cursor.execute(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {view}')
+                    cursor.execute(
+                        '''INSERT INTO summary_refreshes (view_name, refreshed_at, window_end)
+                           VALUES (%s, now(), CURRENT_DATE)
+                           ON CONFLICT (view_name) DO UPDATE
+                           SET refreshed_at = EXCLUDED.refreshed_at, window_end = EXCLUDED.window_end''',
+                        (view,)
+                    )
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Error refreshing monthly summaries: {e}")
+                raise
+        with _summary_writes_lock:
+            _expense_writes -= covered_writes
+        logger.info("Monthly summary views refreshed")
+        return True
     finally:
-        conn.close()
+        _summary_refresh_lock.release()
+
+
+def _refresh_in_background() -> None:
+    try:
+        refresh_monthly_summaries()
+    except Exception:
+        pass  # ошибка уже в логе, следующее обновление сделает задание
+
+
+def _note_expense_writes(count: int = 1) -> None:
+    """Count expense writes and refresh the summary views in background past the threshold"""
+    global _expense_writes
+    threshold = Config.MONTHLY_SUMMARY_REFRESH_WRITES
+
+    with _summary_writes_lock:
+        _expense_writes += count
+        due = 0 < threshold <= _expense_writes
+    if due and not _summary_refresh_lock.locked():
+        threading.Thread(target=_refresh_in_background, name="summary-refresh", daemon=True).start()
 
 
 # ========== BUDGET OPERATIONS ==========
 
 def set_budget(user_id: int, category: str, amount: float, period: str) -> None:
     """Set or update a budget for a category and period (family-wide budget)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    start_date = datetime.now().strftime('%Y-%m-%d')
-    period_code = normalize_period_value(period)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        start_date = datetime.now().strftime('%Y-%m-%d')
+        period_code = normalize_period_value(period)
 
-    try:
-        # Получаем имя пользователя для аудита
-        cursor.execute('SELECT user_name FROM users WHERE user_id = %s', (user_id,))
-        result = cursor.fetchone()
-        user_name = result['user_name'] if result else "Пользователь"
+        try:
+            # Получаем имя пользователя для аудита
+            user_name = _cached_user_name(cursor, user_id)
 
-        # Проверяем, существует ли уже бюджет для этой категории и периода (общий для семьи)
-        cursor.execute(
-            'SELECT id FROM budgets WHERE category = %s AND period = %s',
-            (category, period_code)
-        )
-        existing_budget = cursor.fetchone()
-
-        if existing_budget:
-            # Обновляем существующий бюджет
-            cursor.execute(
-                'UPDATE budgets SET amount = %s, start_date = %s, user_name = %s WHERE id = %s',
-                (amount, start_date, user_name, existing_budget['id'])
-            )
-            logger.info(f"Family budget updated by {user_name}: category={category}, period={period_code}")
-        else:
-            # Создаем новый бюджет (без привязки к конкретному user_id, но с аудитом кто создал)
+            # Проверяем, существует ли уже бюджет для этой категории и периода (общий для семьи)
             cursor.execute(
-                'INSERT INTO budgets (user_id, category, amount, period, start_date, user_name) VALUES (%s, %s, %s, %s, %s, %s)',
-                (user_id, category, amount, period_code, start_date, user_name)
+                'SELECT id FROM budgets WHERE category = %s AND period = %s',
+                (category, period_code)
             )
-            logger.info(f"Family budget created by {user_name}: category={category}, period={period_code}")
+            existing_budget = cursor.fetchone()
+
+            if existing_budget:
+                # Обновляем существующий бюджет
+                cursor.execute(
+                    'UPDATE budgets SET amount = %s, start_date = %s, user_name = %s WHERE id = %s',
+                    (amount, start_date, user_name, existing_budget['id'])
+                )
+                logger.info(f"Family budget updated by {user_name}: category={category}, period={period_code}")
+            else:
+                # Создаем новый бюджет (без привязки к конкретному user_id, но с аудитом кто создал)
+                cursor.execute(
+                    'INSERT INTO budgets (user_id, category, amount, period, start_date, user_name) VALUES (%s, %s, %s, %s, %s, %s)',
+                    (user_id, category, amount, period_code, start_date, user_name)
+                )
+                logger.info(f"Family budget created by {user_name}: category={category}, period={period_code}")
 
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error setting budget: {e}")
-        raise
-    finally:
-        conn.close()
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error setting budget: {e}")
+            raise
 
+    pin_primary(user_id)
+    pin_primary(BUDGETS_PIN)
+    budget_cache.invalidate()
 
-def get_budgets(user_id: int = None) -> List[Dict]:
-    """Get all budgets for entire family (user_id kept for backward compatibility)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
 
+def _load_budgets() -> List[Dict]:
+    with get_read_connection(BUDGETS_PIN) as conn:
+        cursor = conn.cursor()
+        execute_prepared(cursor, BUDGETS_QUERY)
+        return cursor.fetchall()
+
+
+def get_budgets(user_id: int = None) -> List[Dict]:
+    """Get all budgets for entire family (cached; user_id kept for backward compatibility)"""
     try:
-        cursor.execute(
-            'SELECT category, amount, period FROM budgets ORDER BY category'
-        )
-        results = cursor.fetchall()
-        return results
+        results = budget_cache.get_or_load('all', _load_budgets)
     except Exception as e:
         logger.error(f"Error getting budgets: {e}")
         return []
-    finally:
-        conn.close()
+    return [dict(row) for row in results]
 
 
 def check_budget_status(user_id: int, category: str, period: str) -> Tuple[Optional[float], float, float]:
     """Check budget status for a category and period (checks against entire family spending)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    today = datetime.now()
     period_code = normalize_period_value(period)
 
+    # Бюджет для данной категории (общий для семьи) берем из кэша
+    budget = next(
+        (b for b in get_budgets() if b['category'] == category and b['period'] == period_code),
+        None
+    )
+    if not budget:
+        return None, 0, 0
+
     # Определяем дату начала периода
-    if period_code == 'daily':
-        start_date = today.strftime('%Y-%m-%d')
-    elif period_code == 'weekly':
-        start_date = (today - timedelta(days=today.weekday())).strftime('%Y-%m-%d')
-    elif period_code == 'monthly':
-        start_date = today.replace(day=1).strftime('%Y-%m-%d')
-    else:
-        start_date = today.strftime('%Y-%m-%d')
+    start_date = get_period_start_date(period_code)
 
-    try:
-        # Получаем бюджет для данной категории (общий для семьи)
-        cursor.execute(
-            'SELECT amount FROM budgets WHERE category = %s AND period = %s LIMIT 1',
-            (category, period_code)
-        )
-        budget = cursor.fetchone()
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-        if not budget:
+        try:
+            # Считаем расходы по категории за период (для всей семьи)
+            execute_prepared(cursor, CATEGORY_SPENT_QUERY, (category, start_date))
+            spent_row = cursor.fetchone()
+            spent = float(spent_row['spent']) if spent_row and spent_row['spent'] else 0
+
+            # Рассчитываем процент использования бюджета
+            budget_amount = float(budget['amount'])
+            percentage = (spent / budget_amount) * 100 if budget_amount > 0 else 0
+
+            return budget_amount, spent, percentage
+        except Exception as e:
+            logger.error(f"Error checking budget status: {e}")
             return None, 0, 0
 
-        # Считаем расходы по категории за период (для всей семьи)
-        cursor.execute(
-            'SELECT SUM(amount) as spent FROM expenses WHERE category = %s AND date >= %s AND transaction_type = \'expense\'',
-            (category, start_date)
-        )
-        spent_row = cursor.fetchone()
-        spent = float(spent_row['spent']) if spent_row and spent_row['spent'] else 0
 
-        # Рассчитываем процент использования бюджета
-        budget_amount = float(budget['amount'])
-        percentage = (spent / budget_amount) * 100 if budget_amount > 0 else 0
+def get_budget_statuses(user_id: int = None) -> List[Dict]:
+    """Get every family budget with spent amount and percentage in one query (user_id kept for backward compatibility)"""
+    today = datetime.now()
+    starts = {period: get_period_start_date(period, today) for period in BUDGET_PERIODS}
 
-        return budget_amount, spent, percentage
-    except Exception as e:
-        logger.error(f"Error checking budget status: {e}")
-        return None, 0, 0
-    finally:
-        conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute(
+                '''SELECT b.category, b.amount, b.period, COALESCE(SUM(e.total), 0) AS spent
+                   FROM budgets b
+                   LEFT JOIN daily_category_totals e
+                     ON e.category = b.category
+                    AND e.transaction_type = 'expense'
+                    AND e.date >= CASE b.period
+                                      WHEN 'weekly' THEN %(weekly)s::date
+                                      WHEN 'monthly' THEN %(monthly)s::date
+                                      ELSE %(daily)s::date
+                                  END
+                   GROUP BY b.id, b.category, b.amount, b.period
+                   ORDER BY b.category''',
+                starts
+            )
+            results = cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error getting budget statuses: {e}")
+            return []
+
+    for row in results:
+        budget_amount = float(row['amount']) if row['amount'] is not None else 0
+        spent = float(row['spent'])
+        row['spent'] = spent
+        row['percentage'] = (spent / budget_amount) * 100 if budget_amount > 0 else 0
+
+    return results
 
 
 def check_budget_alerts(user_id: int, category: str, amount: float) -> List[Dict]:
     """Check for budget alerts across all periods"""
-    periods = ['daily', 'weekly', 'monthly']
     alerts = []
 
-    for period in periods:
+    for period in BUDGET_PERIODS:
         budget_amount, spent, percentage = check_budget_status(user_id, category, period)
 
         if budget_amount and percentage > Config.BUDGET_ALERT_THRESHOLD:
@@ -353,264 +529,345 @@ def check_budget_alerts(user_id: int, category: str, amount: float) -> List[Dict
     return alerts
 
 
+# Вставка, бюджеты и траты за все периоды одним запросом.
+# Снимок запроса не видит новую строку и её вклад в daily_category_totals,
+# поэтому её сумма добавляется явно.
+RECORD_EXPENSE_QUERY = prepared_query(
+    'record_expense',
+    '''WITH new_expense AS (
+           INSERT INTO expenses (user_id, amount, category, date, user_name)
+           VALUES (%(user_id)s, %(amount)s, %(category)s, %(today)s,
+                   COALESCE((SELECT user_name FROM users WHERE user_id = %(user_id)s), 'Пользователь'))
+           RETURNING amount
+       ),
+       period_budgets AS (
+           SELECT DISTINCT ON (period) period, amount
+           FROM budgets
+           WHERE category = %(category)s AND period IN ('daily', 'weekly', 'monthly')
+           ORDER BY period, id
+       ),
+       spent AS (
+           SELECT COALESCE(SUM(total) FILTER (WHERE date >= %(daily)s), 0) AS daily,
+                  COALESCE(SUM(total) FILTER (WHERE date >= %(weekly)s), 0) AS weekly,
+                  COALESCE(SUM(total) FILTER (WHERE date >= %(monthly)s), 0) AS monthly
+           FROM daily_category_totals
+           WHERE category = %(category)s AND transaction_type = 'expense'
+             AND date >= %(earliest)s
+             AND EXISTS (SELECT 1 FROM period_budgets)
+       )
+       SELECT b.period, b.amount AS budget,
+              CASE b.period WHEN 'daily' THEN s.daily
+                            WHEN 'weekly' THEN s.weekly
+                            ELSE s.monthly END
+              + (SELECT amount FROM new_expense) AS spent
+       FROM period_budgets b CROSS JOIN spent s''',
+    generic_plan=True,
+)
+
+
+def record_expense_with_alerts(user_id: int, amount: float, category: str) -> List[Dict]:
+    """
+    Add an expense and evaluate family budgets for its category in one statement.
+    Returns the same alert list as check_budget_alerts.
+    """
+    today = datetime.now()
+    starts = {period: get_period_start_date(period, today) for period in BUDGET_PERIODS}
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            execute_prepared(
+                cursor,
+                RECORD_EXPENSE_QUERY,
+                {
+                    'user_id': user_id,
+                    'amount': amount,
+                    'category': category,
+                    'today': today.strftime('%Y-%m-%d'),
+                    'earliest': min(starts.values()),
+                    **starts,
+                }
+            )
+            rows = {row['period']: row for row in cursor.fetchall()}
+            conn.commit()
+            logger.info(f"Expense added: user_id={user_id}, amount={amount}, category={category}")
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error adding expense: {e}")
+            raise
+
+    pin_primary(user_id)
+    _note_expense_writes()
+
+    alerts = []
+    for period in BUDGET_PERIODS:
+        row = rows.get(period)
+        if not row:
+            continue
+
+        budget_amount = float(row['budget'])
+        spent = float(row['spent'])
+        percentage = (spent / budget_amount) * 100 if budget_amount > 0 else 0
+
+        if budget_amount and percentage > Config.BUDGET_ALERT_THRESHOLD:
+            alerts.append({
+                'period': CODE_TO_PERIOD_LABEL.get(period, period),
+                'budget': budget_amount,
+                'spent': spent,
+                'percentage': percentage
+            })
+
+    return alerts
+
+
 # ========== SAVINGS GOAL OPERATIONS ==========
 
 def add_savings_goal(user_id: int, description: str, target_amount: float, target_date: Optional[str] = None) -> None:
     """Add a new savings goal (family-wide goal)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    created_date = datetime.now().strftime('%Y-%m-%d')
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        created_date = datetime.now().strftime('%Y-%m-%d')
 
-    try:
-        # Получаем имя пользователя для аудита
-        cursor.execute('SELECT user_name FROM users WHERE user_id = %s', (user_id,))
-        result = cursor.fetchone()
-        user_name = result['user_name'] if result else "Пользователь"
+        try:
+            # Получаем имя пользователя для аудита
+            user_name = _cached_user_name(cursor, user_id)
 
-        cursor.execute(
-            'INSERT INTO savings_goals (user_id, description, target_amount, target_date, created_date, user_name) VALUES (%s, %s, %s, %s, %s, %s)',
-            (user_id, description, target_amount, target_date, created_date, user_name)
-        )
+            cursor.execute(
+                'INSERT INTO savings_goals (user_id, description, target_amount, target_date, created_date, user_name) VALUES (%s, %s, %s, %s, %s, %s)',
+                (user_id, description, target_amount, target_date, created_date, user_name)
+            )
 
-        conn.commit()
-        logger.info(f"Family savings goal added by {user_name}: description={description}")
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error adding savings goal: {e}")
-        raise
-    finally:
-        conn.close()
+            conn.commit()
+            logger.info(f"Family savings goal added by {user_name}: description={description}")
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error adding savings goal: {e}")
+            raise
+
+    pin_primary(user_id)
 
 
 def get_savings_goals(user_id: int = None) -> List[Dict]:
     """Get all savings goals for entire family (user_id kept for backward compatibility)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
 
-    try:
-        cursor.execute(
-            'SELECT id, description, target_amount, current_amount, target_date FROM savings_goals ORDER BY created_date DESC'
-        )
-        results = cursor.fetchall()
-        return results
-    except Exception as e:
-        logger.error(f"Error getting savings goals: {e}")
-        return []
-    finally:
-        conn.close()
+        try:
+            cursor.execute(
+                'SELECT id, description, target_amount, current_amount, target_date FROM savings_goals ORDER BY created_date DESC'
+            )
+            results = cursor.fetchall()
+            return results
+        except Exception as e:
+            logger.error(f"Error getting savings goals: {e}")
+            return []
 
 
 def update_savings_progress(user_id: int, goal_id: int, amount: float) -> None:
     """Update progress on a savings goal (family-wide goals)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-    try:
-        # Обновляем текущую сумму цели (без проверки user_id - общая для семьи)
-        cursor.execute(
-            'UPDATE savings_goals SET current_amount = current_amount + %s WHERE id = %s',
-            (amount, goal_id)
-        )
+        try:
+            # Обновляем текущую сумму цели (без проверки user_id - общая для семьи)
+            cursor.execute(
+                'UPDATE savings_goals SET current_amount = current_amount + %s WHERE id = %s',
+                (amount, goal_id)
+            )
 
-        conn.commit()
-        logger.info(f"Savings goal updated: goal_id={goal_id}, amount={amount} (by user_id={user_id})")
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error updating savings goal: {e}")
-        raise
-    finally:
-        conn.close()
+            conn.commit()
+            logger.info(f"Savings goal updated: goal_id={goal_id}, amount={amount} (by user_id={user_id})")
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error updating savings goal: {e}")
+            raise
+
+    pin_primary(user_id)
 
 
 # ========== REMINDER OPERATIONS ==========
 
 def add_reminder(user_id: int, message: str, frequency: str) -> None:
     """Add a new reminder"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    created_date = datetime.now().strftime('%Y-%m-%d')
-    next_reminder_date = created_date
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        created_date = datetime.now().strftime('%Y-%m-%d')
+        next_reminder_date = created_date
 
-    try:
-        cursor.execute(
-            'INSERT INTO reminders (user_id, message, frequency, next_reminder_date, created_date) VALUES (%s, %s, %s, %s, %s)',
-            (user_id, message, frequency, next_reminder_date, created_date)
-        )
+        try:
+            cursor.execute(
+                'INSERT INTO reminders (user_id, message, frequency, next_reminder_date, created_date) VALUES (%s, %s, %s, %s, %s)',
+                (user_id, message, frequency, next_reminder_date, created_date)
+            )
 
-        conn.commit()
-        logger.info(f"Reminder added: user_id={user_id}, frequency={frequency}")
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error adding reminder: {e}")
-        raise
-    finally:
-        conn.close()
+            conn.commit()
+            logger.info(f"Reminder added: user_id={user_id}, frequency={frequency}")
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error adding reminder: {e}")
+            raise
 
 
 def get_reminders(user_id: int) -> List[Dict]:
     """Get all reminders for a user"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-    try:
-        cursor.execute(
-            'SELECT id, message, frequency, next_reminder_date FROM reminders WHERE user_id = %s',
-            (user_id,)
-        )
-        results = cursor.fetchall()
-        return results
-    except Exception as e:
-        logger.error(f"Error getting reminders: {e}")
-        return []
-    finally:
-        conn.close()
+        try:
+            cursor.execute(
+                'SELECT id, message, frequency, next_reminder_date FROM reminders WHERE user_id = %s',
+                (user_id,)
+            )
+            results = cursor.fetchall()
+            return results
+        except Exception as e:
+            logger.error(f"Error getting reminders: {e}")
+            return []
 
 
 def delete_reminder(user_id: int, reminder_id: int) -> None:
     """Delete a reminder"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-    try:
-        cursor.execute(
-            'DELETE FROM reminders WHERE id = %s AND user_id = %s',
-            (reminder_id, user_id)
-        )
-
-        conn.commit()
-        logger.info(f"Reminder deleted: reminder_id={reminder_id}")
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error deleting reminder: {e}")
-        raise
-    finally:
-        conn.close()
-
-
-def get_todays_reminders() -> List[Dict]:
-    """Get all reminders that need to be sent today"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    today = datetime.now().strftime('%Y-%m-%d')
+        try:
+            cursor.execute(
+                'DELETE FROM reminders WHERE id = %s AND user_id = %s',
+                (reminder_id, user_id)
+            )
 
-    try:
-        cursor.execute(
-            'SELECT user_id, id, message, frequency FROM reminders WHERE next_reminder_date <= %s',
-            (today,)
-        )
-        results = cursor.fetchall()
+            conn.commit()
+            logger.info(f"Reminder deleted: reminder_id={reminder_id}")
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error deleting reminder: {e}")
+            raise
 
-        # Обновляем даты следующих напоминаний
-        for reminder in results:
-            next_date = datetime.now()
 
-            if reminder['frequency'] == 'Ежедневно':
-                next_date = next_date + timedelta(days=1)
-            elif reminder['frequency'] == 'Еженедельно':
-                next_date = next_date + timedelta(days=7)
-            elif reminder['frequency'] == 'Ежемесячно':
-                # Для простоты: добавляем 30 дней для месячных напоминаний
-                next_date = next_date + timedelta(days=30)
+def get_todays_reminders(shard: int = 0, shards: int = 1) -> List[Dict]:
+    """Claim reminders due today (of users in this shard) and reschedule them in a single statement"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        today = datetime.now().strftime('%Y-%m-%d')
 
+        try:
+            # Для простоты: месячные напоминания сдвигаются на 30 дней
             cursor.execute(
-                'UPDATE reminders SET next_reminder_date = %s WHERE id = %s',
-                (next_date.strftime('%Y-%m-%d'), reminder['id'])
+                '''UPDATE reminders
+                   SET next_reminder_date = %(today)s::date + CASE frequency
+                           WHEN 'Ежедневно' THEN 1
+                           WHEN 'Еженедельно' THEN 7
+                           WHEN 'Ежемесячно' THEN 30
+                           ELSE 0
+                       END
+                   WHERE next_reminder_date <= %(today)s
+                     AND MOD(user_id, %(shards)s) = %(shard)s
+                   RETURNING user_id, id, message, frequency''',
+                {'today': today, 'shard': shard, 'shards': shards}
             )
+            results = cursor.fetchall()
 
-        conn.commit()
-        return results
-    except Exception as e:
-        logger.error(f"Error getting today's reminders: {e}")
-        return []
-    finally:
-        conn.close()
+            conn.commit()
+            return results
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error getting today's reminders: {e}")
+            return []
 
 
 # ========== USER OPERATIONS ==========
 
 def save_user(user_id: int, user_name: str) -> None:
     """Save or update user information"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            # Проверяем, существует ли уже запись для этого пользователя
+            cursor.execute('SELECT user_id FROM users WHERE user_id = %s', (user_id,))
+            exists = cursor.fetchone()
+
+            if exists:
+                cursor.execute('UPDATE users SET user_name = %s WHERE user_id = %s', (user_name, user_id))
+                logger.info(f"User updated: user_id={user_id}, user_name={user_name}")
+            else:
+                today = datetime.now().strftime('%Y-%m-%d')
+                cursor.execute('INSERT INTO users (user_id, user_name, created_date) VALUES (%s, %s, %s)',
+                              (user_id, user_name, today))
+                logger.info(f"User created: user_id={user_id}, user_name={user_name}")
 
-    try:
-        # Проверяем, существует ли уже запись для этого пользователя
-        cursor.execute('SELECT user_id FROM users WHERE user_id = %s', (user_id,))
-        exists = cursor.fetchone()
-
-        if exists:
-            cursor.execute('UPDATE users SET user_name = %s WHERE user_id = %s', (user_name, user_id))
-            logger.info(f"User updated: user_id={user_id}, user_name={user_name}")
-        else:
-            today = datetime.now().strftime('%Y-%m-%d')
-            cursor.execute('INSERT INTO users (user_id, user_name, created_date) VALUES (%s, %s, %s)',
-                          (user_id, user_name, today))
-            logger.info(f"User created: user_id={user_id}, user_name={user_name}")
-
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error saving user: {e}")
-        raise
-    finally:
-        conn.close()
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error saving user: {e}")
+            raise
 
+    user_name_cache.invalidate(user_id)
 
-def get_user_name(user_id: int) -> Optional[str]:
-    """Get user name from database"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
 
-    try:
-        cursor.execute('SELECT user_name FROM users WHERE user_id = %s', (user_id,))
+def _load_user_name(user_id: int) -> Optional[str]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        execute_prepared(cursor, USER_NAME_QUERY, (user_id,))
         result = cursor.fetchone()
         return result['user_name'] if result else None
+
+
+def get_user_name(user_id: int) -> Optional[str]:
+    """Get user name (cached)"""
+    try:
+        return user_name_cache.get_or_load(user_id, lambda: _load_user_name(user_id))
     except Exception as e:
         logger.error(f"Error getting user name: {e}")
         return None
-    finally:
-        conn.close()
 
 
-def get_all_users() -> List[Dict]:
-    """Get all users who have expenses"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def get_all_users(shard: int = 0, shards: int = 1) -> List[Dict]:
+    """Get all users who have expenses (only those in the given shard)"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-    try:
-        cursor.execute('SELECT DISTINCT user_id FROM expenses')
-        users = cursor.fetchall()
-        return users
-    except Exception as e:
-        logger.error(f"Error getting all users: {e}")
-        return []
-    finally:
-        conn.close()
+        try:
+            cursor.execute(
+                'SELECT DISTINCT user_id FROM daily_category_totals WHERE MOD(user_id, %s) = %s',
+                (shards, shard)
+            )
+            users = cursor.fetchall()
+            return users
+        except Exception as e:
+            logger.error(f"Error getting all users: {e}")
+            return []
 # ========== CATEGORY OPERATIONS ==========
 
-def get_available_categories() -> List[str]:
-    """Return list of categories from DB or fallback to defaults"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
+def _load_categories() -> List[str]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
         cursor.execute("SELECT name FROM categories ORDER BY name")
         rows = cursor.fetchall()
-        categories = [row["name"] for row in rows if row.get("name")]
-        if categories:
-            return categories
+        return [row["name"] for row in rows if row.get("name")]
+
+
+def get_available_categories() -> List[str]:
+    """Return list of categories from DB (cached) or fallback to defaults"""
+    try:
+        categories = category_cache.get_or_load('all', _load_categories)
     except Exception as e:
         logger.warning(f"Error fetching categories from DB: {e}")
-    finally:
-        conn.close()
-    return CATEGORIES
+        return CATEGORIES
+    return list(categories) if categories else CATEGORIES
+
+
+def invalidate_categories() -> None:
+    """Drop cached categories (categories are written by the Go backend)"""
+    category_cache.invalidate()
 
 
 # ========== PORTAL ACCOUNTS ==========
 
 def get_app_user_by_telegram_id(user_id: int) -> Optional[Dict]:
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
+    with get_connection() as conn:
+        cursor = conn.cursor()
         cursor.execute(
             """
             SELECT id, login, role, full_name
@@ -620,62 +877,15 @@ def get_app_user_by_telegram_id(user_id: int) -> Optional[Dict]:
             (user_id,),
         )
         return cursor.fetchone()
-    finally:
-        conn.close()
 
 
 def create_portal_user(login: str, password: str, telegram_user_id: int, full_name: str = "", role: str = "analyst") -> None:
     password_hash = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        # Синхронизируем таблицу users
-        user_display_name = full_name if full_name else "Пользователь"
-        cursor.execute(
-            """
-            INSERT INTO users (user_id, user_name, created_date)
-            VALUES (%s, %s, CURRENT_DATE)
-            ON CONFLICT (user_id) DO UPDATE SET user_name = EXCLUDED.user_name
-            """,
-            (telegram_user_id, user_display_name)
-        )
-
-        # Создаем app_users
-        cursor.execute(
-            """
-            INSERT INTO app_users (login, password_hash, full_name, role, telegram_user_id)
-            VALUES (%s, %s, NULLIF(%s, ''), %s, %s)
-            """,
-            (login, password_hash, full_name or "", role, telegram_user_id),
-        )
-        conn.commit()
-        logger.info(f"Portal user created: login={login}, telegram_user_id={telegram_user_id}")
-    except IntegrityError as exc:
-        conn.rollback()
-        logger.error(f"Error creating portal user: {exc}")
-        raise ValueError("Login already exists") from exc
-    finally:
-        conn.close()
-
-
-def reset_app_user_password(telegram_user_id: int, new_password: str) -> Optional[str]:
-    password_hash = bcrypt.hashpw(new_password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            """
-            UPDATE app_users
-            SET password_hash = %s
-            WHERE telegram_user_id = %s
-            RETURNING login, full_name
-            """,
-            (password_hash, telegram_user_id),
-        )
-        result = cursor.fetchone()
-        if result:
-            # Синхронизируем таблицу users при сбросе пароля
-            user_display_name = result['full_name'] if result.get('full_name') else "Пользователь"
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            # Синхронизируем таблицу users
+            user_display_name = full_name if full_name else "Пользователь"
             cursor.execute(
                 """
                 INSERT INTO users (user_id, user_name, created_date)
@@ -684,15 +894,58 @@ def reset_app_user_password(telegram_user_id: int, new_password: str) -> Optiona
                 """,
                 (telegram_user_id, user_display_name)
             )
+
+            # Создаем app_users
+            cursor.execute(
+                """
+                INSERT INTO app_users (login, password_hash, full_name, role, telegram_user_id)
+                VALUES (%s, %s, NULLIF(%s, ''), %s, %s)
+                """,
+                (login, password_hash, full_name or "", role, telegram_user_id),
+            )
             conn.commit()
-            logger.info(f"Password reset for telegram_user_id={telegram_user_id}, login={result['login']}")
-            return result["login"]
-        conn.rollback()
-        logger.warning(f"No app_user found for telegram_user_id={telegram_user_id}")
-        return None
-    except psycopg2.Error as exc:
-        conn.rollback()
-        logger.error(f"Error resetting password: {exc}")
-        return None
-    finally:
-        conn.close()
+            user_name_cache.invalidate(telegram_user_id)
+            logger.info(f"Portal user created: login={login}, telegram_user_id={telegram_user_id}")
+        except IntegrityError as exc:
+            conn.rollback()
+            logger.error(f"Error creating portal user: {exc}")
+            raise ValueError("Login already exists") from exc
+
+
+def reset_app_user_password(telegram_user_id: int, new_password: str) -> Optional[str]:
+    password_hash = bcrypt.hashpw(new_password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                """
+                UPDATE app_users
+                SET password_hash = %s
+                WHERE telegram_user_id = %s
+                RETURNING login, full_name
+                """,
+                (password_hash, telegram_user_id),
+            )
+            result = cursor.fetchone()
+            if result:
+                # Синхронизируем таблицу users при сбросе пароля
+                user_display_name = result['full_name'] if result.get('full_name') else "Пользователь"
+                cursor.execute(
+                    """
+                    INSERT INTO users (user_id, user_name, created_date)
+                    VALUES (%s, %s, CURRENT_DATE)
+                    ON CONFLICT (user_id) DO UPDATE SET user_name = EXCLUDED.user_name
+                    """,
+                    (telegram_user_id, user_display_name)
+                )
+                conn.commit()
+                user_name_cache.invalidate(telegram_user_id)
+                logger.info(f"Password reset for telegram_user_id={telegram_user_id}, login={result['login']}")
+                return result["login"]
+            conn.rollback()
+            logger.warning(f"No app_user found for telegram_user_id={telegram_user_id}")
+            return None
+        except psycopg2.Error as exc:
+            conn.rollback()
+            logger.error(f"Error resetting password: {exc}")
+            return None
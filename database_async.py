@@ -0,0 +1,117 @@
+"""
+Async data-access API for the bot's coroutine handlers.
+Mirrors the functions in database.py; every call runs the synchronous
+implementation on a bounded thread pool so the event loop keeps processing
+updates while queries are in flight.
+"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+import database
+from config import Config
+from metrics import instrument_db_call
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the shared database executor, creating it on first use"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=Config.DB_EXECUTOR_WORKERS,
+                    thread_name_prefix="db",
+                )
+                logger.info(f"Database executor started with {Config.DB_EXECUTOR_WORKERS} workers")
+    return _executor
+
+
+def shutdown_executor(wait: bool = True) -> None:
+    """Stop the database executor (called on bot shutdown)"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
+
+
+async def run_in_db_thread(func: Callable, *args, **kwargs) -> Any:
+    """
+    Run a blocking callable on the database executor and await its result.
+    Context variables of the calling task are visible inside the call.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(
+        get_executor(), functools.partial(ctx.run, func, *args, **kwargs)
+    )
+
+
+def _offload(func: Callable) -> Callable:
+    timed = instrument_db_call(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_db_thread(timed, *args, **kwargs)
+    return wrapper
+
+
+# ========== EXPENSE OPERATIONS ==========
+
+add_expense = _offload(database.add_expense)
+get_recent_expenses = _offload(database.get_recent_expenses)
+delete_expense = _offload(database.delete_expense)
+get_daily_expenses = _offload(database.get_daily_expenses)
+get_weekly_expenses = _offload(database.get_weekly_expenses)
+get_monthly_expenses = _offload(database.get_monthly_expenses)
+get_detailed_monthly_expenses = _offload(database.get_detailed_monthly_expenses)
+refresh_monthly_summaries = _offload(database.refresh_monthly_summaries)
+
+# ========== BUDGET OPERATIONS ==========
+
+set_budget = _offload(database.set_budget)
+get_budgets = _offload(database.get_budgets)
+check_budget_status = _offload(database.check_budget_status)
+get_budget_statuses = _offload(database.get_budget_statuses)
+check_budget_alerts = _offload(database.check_budget_alerts)
+record_expense_with_alerts = _offload(database.record_expense_with_alerts)
+
+# ========== SAVINGS GOAL OPERATIONS ==========
+
+add_savings_goal = _offload(database.add_savings_goal)
+get_savings_goals = _offload(database.get_savings_goals)
+update_savings_progress = _offload(database.update_savings_progress)
+
+# ========== REMINDER OPERATIONS ==========
+
+add_reminder = _offload(database.add_reminder)
+get_reminders = _offload(database.get_reminders)
+delete_reminder = _offload(database.delete_reminder)
+get_todays_reminders = _offload(database.get_todays_reminders)
+
+# ========== USER OPERATIONS ==========
+
+save_user = _offload(database.save_user)
+get_user_name = _offload(database.get_user_name)
+get_all_users = _offload(database.get_all_users)
+
+# ========== CATEGORY OPERATIONS ==========
+
+get_available_categories = _offload(database.get_available_categories)
+
+# ========== PORTAL ACCOUNTS ==========
+
+get_app_user_by_telegram_id = _offload(database.get_app_user_by_telegram_id)
+create_portal_user = _offload(database.create_portal_user)
+reset_app_user_password = _offload(database.reset_app_user_password)
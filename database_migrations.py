@@ -1,12 +1,233 @@
+import argparse
 import logging
-from datetime import datetime
+import re
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from config import Config
+from db import get_connection, get_database_url, wait_for_db
+from db_schema import (
+    BOT_PERSISTENCE_SCHEMA,
+    CACHE_NOTIFY_FUNCTION,
+    CACHE_NOTIFY_TABLES,
+    DAILY_TOTALS_SCHEMA,
+    INDEXES,
+    JOB_LEASES_SCHEMA,
+    JOB_PAYLOADS_SCHEMA,
+    MONTHLY_SUMMARY_SCHEMA,
+    cache_notify_trigger_statements,
+)
 
-import psycopg2
-from psycopg2.extras import RealDictCursor
+logger = logging.getLogger(__name__)
 
-from db import get_database_url, wait_for_db
 
-logger = logging.getLogger(__name__)
+def rebuild_daily_totals(cursor, start_date=None, end_date=None):
+    """
+    Пересчитывает daily_category_totals из expenses за [start_date, end_date]
+    (весь период, если границы не заданы). Блокирует запись в expenses
+    до конца транзакции, чтобы триггер и пересчет не посчитали строку дважды.
+    """
+    cursor.execute("LOCK TABLE expenses IN SHARE MODE")
+
+    conditions = []
+    params = []
+    if start_date:
+        conditions.append("date >= %s")
+        params.append(start_date)
+    if end_date:
+        conditions.append("date <= %s")
+        params.append(end_date)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    cursor.execute(f"DELETE FROM daily_category_totals {where}", params)
+    cursor.execute(
+        f"""
+        INSERT INTO daily_category_totals
+            (date, category, user_id, transaction_type, user_name, total, expense_count)
+        SELECT date, category, user_id, transaction_type,
+               (ARRAY_AGG(user_name ORDER BY id DESC) FILTER (WHERE user_name IS NOT NULL))[1],
+               SUM(amount), COUNT(*)
+        FROM expenses
+        {where}
+        GROUP BY date, category, user_id, transaction_type
+        """,
+        params,
+    )
+    return cursor.rowcount
+
+
+# ========== ПАРТИЦИИ EXPENSES ==========
+# expenses секционирована по месяцам (миграция 10): expenses_YYYY_MM на каждый
+# месяц и expenses_default для дат вне созданных партиций.
+
+PARTITION_NAME_RE = re.compile(r"^expenses_(\d{4})_(\d{2})$")
+ARCHIVE_SCHEMA = "expenses_archive"
+
+# Ключ advisory-блокировки: миграции и секционирование не идут из двух процессов сразу
+MIGRATION_LOCK_KEY = 727001
+
+
+def add_months(month: date, months: int) -> date:
+    """Первое число месяца, отстоящего на months от month"""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"expenses_{month:%Y_%m}"
+
+
+def is_expenses_partitioned(cursor) -> bool:
+    cursor.execute(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('expenses')"
+    )
+    return cursor.fetchone() is not None
+
+
+def create_expense_partition(cursor, month: date) -> bool:
+    """
+    Создает партицию месяца month, если ее нет. Строки этого месяца, уже
+    попавшие в expenses_default, переносятся в новую партицию, а свертка
+    за месяц пересчитывается. Возвращает True, если партиция создана.
+    """
+    name = partition_name(month)
+    cursor.execute("SELECT to_regclass(%s) AS relation", (name,))
+    if cursor.fetchone()["relation"] is not None:
+        return False
+
+    start, end = month, add_months(month, 1)
+    cursor.execute(
+        "SELECT COUNT(*) AS count FROM expenses_default WHERE date >= %s AND date < %s",
+        (start, end),
+    )
+    if cursor.fetchone()["count"] == 0:
+        cursor.execute(
+            f"CREATE TABLE {name} PARTITION OF expenses FOR VALUES FROM (%s) TO (%s)",
+            (start, end),
+        )
+    else:
+        cursor.execute(f"CREATE TABLE {name} (LIKE expenses INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM expenses_default WHERE date >= %s AND date < %s RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+            """,
+            (start, end),
+        )
+        cursor.execute(
+            f"ALTER TABLE expenses ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+            (start, end),
+        )
+        # DELETE из default уменьшил свертку, а вставка в еще не подключенную
+        # партицию триггер не вызывала
+        rebuild_daily_totals(cursor, start, end - timedelta(days=1))
+
+    logger.info("Создана партиция %s", name)
+    return True
+
+
+def ensure_expense_partitions(cursor, months_ahead: int, start: date | None = None) -> list:
+    """Создает партиции от start (по умолчанию текущий месяц) до months_ahead месяцев вперед"""
+    if not is_expenses_partitioned(cursor):
+        return []
+
+    current = date.today().replace(day=1)
+    month = (start or current).replace(day=1)
+    last = add_months(current, months_ahead)
+    created = []
+    while month <= last:
+        if create_expense_partition(cursor, month):
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    return created
+
+
+def archive_expense_partitions(cursor, before: date, drop: bool = False) -> list:
+    """
+    Отключает партиции месяцев раньше before и переносит их в схему
+    expenses_archive (или удаляет при drop=True). Строки свертки за эти
+    месяцы удаляются, чтобы она по-прежнему совпадала с expenses.
+    """
+    cursor.execute(
+        """
+        SELECT c.relname AS name
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass('expenses')
+        ORDER BY c.relname
+        """
+    )
+    archived = []
+    for row in cursor.fetchall():
+        match = PARTITION_NAME_RE.match(row["name"])
+        if not match:
+            continue
+        month = date(int(match.group(1)), int(match.group(2)), 1)
+        if add_months(month, 1) > before:
+            continue
+
+        name = row["name"]
+        cursor.execute(f"ALTER TABLE expenses DETACH PARTITION {name}")
+        cursor.execute(
+            "DELETE FROM daily_category_totals WHERE date >= %s AND date < %s",
+            (month, add_months(month, 1)),
+        )
+        if drop:
+            cursor.execute(f"DROP TABLE {name}")
+        else:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}")
+            cursor.execute(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}")
+        logger.info("Партиция %s %s", name, "удалена" if drop else f"перенесена в {ARCHIVE_SCHEMA}")
+        archived.append(name)
+    return archived
+
+
+def partition_expenses(cursor, months_ahead: int, lock_timeout: str = "10s") -> None:
+    """
+    Пересоздает expenses как таблицу, секционированную по месяцам (date),
+    и переносит в нее все строки. Выполняется в одной транзакции под
+    эксклюзивной блокировкой; свертка не меняется, так как данные те же.
+    Если блокировку не удалось взять за lock_timeout (долгие транзакции),
+    команда падает, а не держит очередь из всех запросов к expenses.
+    """
+    cursor.execute("SELECT set_config('lock_timeout', %s, true)", (lock_timeout,))
+    cursor.execute("LOCK TABLE expenses IN ACCESS EXCLUSIVE MODE")
+    cursor.execute("SELECT set_config('lock_timeout', '0', true)")
+    cursor.execute("SELECT pg_get_serial_sequence('expenses', 'id') AS sequence")
+    sequence = cursor.fetchone()["sequence"]
+
+    cursor.execute("ALTER TABLE expenses RENAME TO expenses_unpartitioned")
+    cursor.execute(
+        """
+        CREATE TABLE expenses (LIKE expenses_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+        PARTITION BY RANGE (date)
+        """
+    )
+    cursor.execute("CREATE TABLE expenses_default PARTITION OF expenses DEFAULT")
+
+    cursor.execute("SELECT MIN(date) AS first_date FROM expenses_unpartitioned")
+    first_date = cursor.fetchone()["first_date"]
+    created = ensure_expense_partitions(cursor, months_ahead, start=first_date)
+    logger.info("Создано партиций: %s", len(created))
+
+    # Триггера свертки на новой таблице еще нет, поэтому копирование ее не трогает
+    cursor.execute("INSERT INTO expenses SELECT * FROM expenses_unpartitioned")
+    logger.info("Перенесено строк: %s", cursor.rowcount)
+
+    if sequence:
+        cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY expenses.id")
+    cursor.execute("DROP TABLE expenses_unpartitioned")
+
+    # Имена индексов и первичного ключа освободились вместе со старой таблицей
+    cursor.execute("ALTER TABLE expenses ADD PRIMARY KEY (id, date)")
+    for name, table, definition in INDEXES:
+        if table == "expenses":
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} {definition}")
+    for statement in DAILY_TOTALS_SCHEMA:
+        cursor.execute(statement)
 
 
 class DatabaseMigration:
@@ -14,60 +235,100 @@ class DatabaseMigration:
         self.db_url = db_url or get_database_url()
 
     def get_connection(self):
-        return psycopg2.connect(self.db_url, cursor_factory=RealDictCursor)
+        """Пулевое соединение с БД миграций (контекстный менеджер)"""
+        return get_connection(self.db_url)
 
     def init_migration_table(self):
         """Создание таблицы для отслеживания миграций"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS migrations (
-                id SERIAL PRIMARY KEY,
-                version INTEGER UNIQUE NOT NULL,
-                description TEXT,
-                applied_at TIMESTAMP NOT NULL
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS migrations (
+                    id SERIAL PRIMARY KEY,
+                    version INTEGER UNIQUE NOT NULL,
+                    description TEXT,
+                    applied_at TIMESTAMP NOT NULL
+                )
+                """
             )
-            """
-        )
 
-        conn.commit()
-        conn.close()
+            conn.commit()
 
     def get_current_version(self):
         """Получение текущей версии БД"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("SELECT COALESCE(MAX(version), 0) as version FROM migrations")
-        result = cursor.fetchone()
-        version = result["version"] if result else 0
+            cursor.execute("SELECT COALESCE(MAX(version), 0) as version FROM migrations")
+            result = cursor.fetchone()
+            version = result["version"] if result else 0
 
-        conn.close()
         return version
 
     def column_exists(self, table_name, column_name):
         """Проверка существования колонки в таблице"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute(
-            """
-            SELECT 1
-            FROM information_schema.columns
-            WHERE table_schema = 'public'
-              AND table_name = %s
-              AND column_name = %s
-            """,
-            (table_name, column_name),
-        )
-        exists = cursor.fetchone() is not None
-        conn.close()
+            cursor.execute(
+                """
+                SELECT 1
+                FROM information_schema.columns
+                WHERE table_schema = 'public'
+                  AND table_name = %s
+                  AND column_name = %s
+                """,
+                (table_name, column_name),
+            )
+            exists = cursor.fetchone() is not None
         return exists
 
-    def apply_migration(self, version, description, migration_func):
-        """Применение миграции"""
+    def index_status(self, index_name):
+        """Возвращает None, если индекса нет, иначе признак его валидности"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(
+                """
+                SELECT i.indisvalid
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = 'public' AND c.relname = %s
+                """,
+                (index_name,),
+            )
+            row = cursor.fetchone()
+        return row["indisvalid"] if row else None
+
+    def create_index_concurrently(self, cursor, name, table, definition):
+        """
+        CREATE INDEX CONCURRENTLY с повторным созданием невалидного индекса,
+        оставшегося от прерванной попытки. Требует autocommit-соединения.
+        """
+        cursor.execute("SELECT to_regclass(%s) AS relation", (table,))
+        if cursor.fetchone()["relation"] is None:
+            logger.warning("Таблица %s не найдена, индекс %s пропущен", table, name)
+            return
+
+        status = self.index_status(name)
+        if status is True:
+            return
+        if status is False:
+            logger.warning("Индекс %s невалиден, пересоздаем", name)
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+        cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}")
+        logger.info("Создан индекс %s на %s", name, table)
+
+    def apply_migration(self, version, description, migration_func, transactional=True):
+        """
+        Применение миграции.
+        transactional=False выполняет миграцию в autocommit (нужно для
+        CREATE INDEX CONCURRENTLY), поэтому такие миграции должны быть идемпотентны.
+        """
         current_version = self.get_current_version()
 
         if version <= current_version:
@@ -76,34 +337,37 @@ class DatabaseMigration:
 
         logger.info("Применение миграции %s: %s", version, description)
 
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        try:
-            migration_func(cursor)
-
-            cursor.execute(
-                """
-                INSERT INTO migrations (version, description, applied_at)
-                VALUES (%s, %s, %s)
-                """,
-                (version, description, datetime.now()),
-            )
-
-            conn.commit()
-            logger.info("Миграция %s успешно применена", version)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
 
-        except Exception as e:
-            conn.rollback()
-            logger.error("Ошибка при применении миграции %s: %s", version, e)
-            raise
-        finally:
-            conn.close()
+            try:
+                if not transactional:
+                    conn.autocommit = True
+                    try:
+                        migration_func(cursor)
+                    finally:
+                        conn.autocommit = False
+                else:
+                    migration_func(cursor)
+
+                cursor.execute(
+                    """
+                    INSERT INTO migrations (version, description, applied_at)
+                    VALUES (%s, %s, %s)
+                    """,
+                    (version, description, datetime.now()),
+                )
+
+                conn.commit()
+                logger.info("Миграция %s успешно применена", version)
 
-    def run_migrations(self):
-        """Запуск всех миграций"""
-        self.init_migration_table()
+            except Exception as e:
+                conn.rollback()
+                logger.error("Ошибка при применении миграции %s: %s", version, e)
+                raise
 
+    def migrations(self):
+        """Список миграций: (версия, описание, функция[, transactional])"""
         def migration_1(cursor):
             if not self.column_exists("expenses", "user_name"):
                 cursor.execute("ALTER TABLE expenses ADD COLUMN user_name TEXT")
@@ -129,19 +393,229 @@ class DatabaseMigration:
                 cursor.execute("ALTER TABLE savings_goals ADD COLUMN goal_name TEXT")
                 logger.info("Добавлена колонка goal_name в таблицу savings_goals")
 
+        def migration_6(cursor):
+            # То же, что миграция #1 backend'а: индексы ниже опираются на эту колонку
+            cursor.execute(
+                "ALTER TABLE expenses ADD COLUMN IF NOT EXISTS transaction_type TEXT NOT NULL DEFAULT 'expense'"
+            )
+
+        def migration_7(cursor):
+            for name, table, definition in INDEXES:
+                self.create_index_concurrently(cursor, name, table, definition)
+
+        def migration_8(cursor):
+            for statement in DAILY_TOTALS_SCHEMA:
+                cursor.execute(statement)
+            for name, table, definition in INDEXES:
+                if table == "daily_category_totals":
+                    cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} {definition}")
+            rows = rebuild_daily_totals(cursor)
+            logger.info("daily_category_totals заполнена: %s строк", rows)
+
+        def migration_9(cursor):
+            cursor.execute(CACHE_NOTIFY_FUNCTION)
+            for table, level in CACHE_NOTIFY_TABLES:
+                cursor.execute("SELECT to_regclass(%s) AS relation", (table,))
+                if cursor.fetchone()["relation"] is None:
+                    logger.warning("Таблица %s не найдена, триггер сброса кэша не создан", table)
+                    continue
+                for statement in cache_notify_trigger_statements(table, level):
+                    cursor.execute(statement)
+
+        def migration_10(cursor):
+            # Перезапись всей таблицы под эксклюзивной блокировкой не запускается
+            # неявно при выкладке: оператор выполняет ее отдельно в окно обслуживания
+            if not is_expenses_partitioned(cursor):
+                logger.warning(
+                    "expenses не секционирована; выполните в окно обслуживания: "
+                    "python database_migrations.py partition-expenses"
+                )
+
+        def migration_11(cursor):
+            for statement in MONTHLY_SUMMARY_SCHEMA:
+                cursor.execute(statement)
+
+        def migration_12(cursor):
+            for statement in BOT_PERSISTENCE_SCHEMA:
+                cursor.execute(statement)
+
+        def migration_13(cursor):
+            for statement in JOB_LEASES_SCHEMA:
+                cursor.execute(statement)
+
+        def migration_14(cursor):
+            for statement in JOB_PAYLOADS_SCHEMA:
+                cursor.execute(statement)
+
         migrations = [
             (1, "Добавление user_name в expenses", migration_1),
             (2, "Добавление user_name в budgets", migration_2),
             (3, "Добавление user_name в savings_goals", migration_3),
             (4, "Добавление description в expenses", migration_4),
             (5, "Добавление goal_name в savings_goals", migration_5),
+            (6, "Добавление transaction_type в expenses", migration_6),
+            (7, "Индексы для отчетов по expenses, reminders и budgets", migration_7, False),
+            (8, "Свертка daily_category_totals с триггером на expenses", migration_8),
+            (9, "NOTIFY для сброса кэшей при изменении categories, budgets, users", migration_9),
+            (10, "Секционирование expenses по месяцам (командой partition-expenses)", migration_10),
+            (11, "Материализованные итоги за 30 дней для отчетов", migration_11),
+            (12, "Таблица bot_persistence для общего состояния реплик бота", migration_12),
+            (13, "Аренды плановых задач для нескольких реплик бота", migration_13),
+            (14, "Общие данные запуска плановых задач для всех шардов", migration_14),
         ]
+        return migrations
+
+    def pending_migrations(self):
+        """Миграции, еще не примененные к базе: [(версия, описание)]"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT to_regclass('migrations') AS relation")
+            has_table = cursor.fetchone()["relation"] is not None
+        current = self.get_current_version() if has_table else 0
+        return [(version, description) for version, description, *_ in self.migrations() if version > current]
+
+    @contextmanager
+    def migration_lock(self):
+        """Сессионная advisory-блокировка на время миграций; второй процесс ждет первого"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_try_advisory_lock(%s) AS locked", (MIGRATION_LOCK_KEY,))
+            if not cursor.fetchone()["locked"]:
+                logger.info("Миграции выполняет другой процесс, ждем его завершения")
+                cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+            conn.commit()
+            try:
+                yield
+            finally:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+                conn.commit()
 
-        for version, description, func in migrations:
+    def run_migrations(self):
+        """Запуск всех миграций"""
+        with self.migration_lock():
+            self.init_migration_table()
+
+            for version, description, func, *options in self.migrations():
+                try:
+                    self.apply_migration(version, description, func, *options)
+                except Exception as e:
+                    # Следующие миграции опираются на предыдущие, поэтому останавливаемся
+                    logger.error("Ошибка при применении миграции %s: %s", version, e)
+                    break
+
+    def partition(self, months_ahead=None, lock_timeout="10s"):
+        """
+        Секционирует expenses (см. partition_expenses). Возвращает время под
+        блокировкой в секундах или None, если таблица уже секционирована.
+        """
+        months_ahead = Config.EXPENSE_PARTITIONS_AHEAD if months_ahead is None else months_ahead
+        with self.migration_lock(), self.get_connection() as conn:
+            cursor = conn.cursor()
             try:
-                self.apply_migration(version, description, func)
-            except Exception as e:
-                logger.error("Ошибка при применении миграции %s: %s", version, e)
+                if is_expenses_partitioned(cursor):
+                    conn.rollback()
+                    return None
+                started = time.perf_counter()
+                partition_expenses(cursor, months_ahead, lock_timeout)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return time.perf_counter() - started
+
+    def backfill_daily_totals(self, start_date=None, end_date=None):
+        """Пересчет свертки daily_category_totals в отдельной транзакции"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                rows = rebuild_daily_totals(cursor, start_date, end_date)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        logger.info("daily_category_totals пересчитана: %s строк", rows)
+        return rows
+
+    def ensure_partitions(self, months_ahead=None):
+        """Создает недостающие партиции expenses на months_ahead месяцев вперед"""
+        months_ahead = Config.EXPENSE_PARTITIONS_AHEAD if months_ahead is None else months_ahead
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                created = ensure_expense_partitions(cursor, months_ahead)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return created
+
+    def archive_partitions(self, before, drop=False):
+        """Отключает (и архивирует или удаляет) партиции expenses раньше месяца before"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                archived = archive_expense_partitions(cursor, before, drop)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return archived
+
+    def check_indexes(self):
+        """
+        Отчет по индексам: отсутствующие и невалидные из INDEXES,
+        а также индексы, которые ни разу не использовались с момента сброса статистики.
+        """
+        expected = {name for name, _, _ in INDEXES}
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(
+                """
+                SELECT c.relname AS name, i.indisvalid AS valid
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = 'public' AND c.relname = ANY(%s)
+                """,
+                (list(expected),),
+            )
+            existing = {row["name"]: row["valid"] for row in cursor.fetchall()}
+
+            # Индексы партиций (expenses_YYYY_MM) складываются в индекс родителя:
+            # у секционированного индекса своей статистики нет
+            cursor.execute(
+                """
+                WITH usage AS (
+                    SELECT COALESCE(p.inhparent, s.indexrelid) AS indexrelid,
+                           s.idx_scan,
+                           pg_relation_size(s.indexrelid) AS bytes
+                    FROM pg_stat_user_indexes s
+                    LEFT JOIN pg_inherits p ON p.inhrelid = s.indexrelid
+                    WHERE s.schemaname = 'public'
+                )
+                SELECT t.relname AS table_name, c.relname AS index_name,
+                       SUM(u.idx_scan)::bigint AS idx_scan,
+                       pg_size_pretty(SUM(u.bytes)) AS size
+                FROM usage u
+                JOIN pg_index i ON i.indexrelid = u.indexrelid
+                JOIN pg_class c ON c.oid = u.indexrelid
+                JOIN pg_class t ON t.oid = i.indrelid
+                WHERE NOT i.indisunique
+                  AND NOT i.indisprimary
+                GROUP BY t.relname, c.relname
+                HAVING SUM(u.idx_scan) = 0
+                ORDER BY SUM(u.bytes) DESC
+                """
+            )
+            unused = cursor.fetchall()
+
+        return {
+            "missing": sorted(expected - existing.keys()),
+            "invalid": sorted(name for name, valid in existing.items() if not valid),
+            "unused": unused,
+        }
 
 
 def check_and_update_database():
@@ -149,4 +623,89 @@ def check_and_update_database():
     wait_for_db()
     migration = DatabaseMigration()
     migration.run_migrations()
+    migration.ensure_partitions()
     logger.info("Проверка и обновление базы данных завершены")
+
+
+def report_indexes():
+    """Печатает отчет check_indexes; возвращает код выхода (1 при проблемах)"""
+    report = DatabaseMigration().check_indexes()
+
+    for name in report["missing"]:
+        print(f"❌ Отсутствует индекс: {name}")
+    for name in report["invalid"]:
+        print(f"⚠️  Невалидный индекс (прерванный CONCURRENTLY): {name}")
+    for row in report["unused"]:
+        print(f"💤 Не используется: {row['index_name']} на {row['table_name']} ({row['size']})")
+
+    if not any(report.values()):
+        print("✅ Все индексы на месте и используются")
+
+    return 1 if report["missing"] or report["invalid"] else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции и обслуживание БД бота")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("migrate", help="применить миграции (по умолчанию)")
+    subparsers.add_parser("check-indexes", help="отчет об отсутствующих и неиспользуемых индексах")
+    backfill = subparsers.add_parser("backfill-rollup", help="пересчитать daily_category_totals из expenses")
+    backfill.add_argument("--from", dest="start_date", help="начальная дата YYYY-MM-DD (по умолчанию вся история)")
+    backfill.add_argument("--to", dest="end_date", help="конечная дата YYYY-MM-DD включительно")
+    partition = subparsers.add_parser(
+        "partition-expenses",
+        help="секционировать expenses по месяцам (переписывает таблицу под эксклюзивной блокировкой)",
+    )
+    partition.add_argument("--lock-timeout", default="10s",
+                           help="сколько ждать блокировку expenses, прежде чем отказаться (по умолчанию 10s)")
+    ensure = subparsers.add_parser("ensure-partitions", help="создать партиции expenses на ближайшие месяцы")
+    ensure.add_argument("--ahead", type=int, help="сколько месяцев вперед (по умолчанию EXPENSE_PARTITIONS_AHEAD)")
+    archive = subparsers.add_parser("archive-partitions", help="отключить партиции expenses старше месяца")
+    archive.add_argument("--before", required=True, help="месяц YYYY-MM: архивируются все более ранние")
+    archive.add_argument("--drop", action="store_true", help="удалить партиции вместо переноса в expenses_archive")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    if args.command == "check-indexes":
+        wait_for_db()
+        return report_indexes()
+
+    if args.command == "backfill-rollup":
+        wait_for_db()
+        rows = DatabaseMigration().backfill_daily_totals(args.start_date, args.end_date)
+        print(f"✅ daily_category_totals пересчитана: {rows} строк")
+        return 0
+
+    if args.command == "partition-expenses":
+        wait_for_db()
+        seconds = DatabaseMigration().partition(lock_timeout=args.lock_timeout)
+        if seconds is None:
+            print("✅ expenses уже секционирована")
+        else:
+            print(f"✅ expenses секционирована, запись была заблокирована {seconds:.1f} с")
+        return 0
+
+    if args.command == "ensure-partitions":
+        wait_for_db()
+        created = DatabaseMigration().ensure_partitions(args.ahead)
+        print(f"✅ Создано партиций: {len(created)}")
+        return 0
+
+    if args.command == "archive-partitions":
+        before = datetime.strptime(args.before, "%Y-%m").date()
+        # Отчеты бота смотрят не дальше прошлого месяца
+        if before > add_months(date.today().replace(day=1), -1):
+            print("❌ Нельзя архивировать текущий и прошлый месяц")
+            return 1
+        wait_for_db()
+        archived = DatabaseMigration().archive_partitions(before, args.drop)
+        print(f"✅ Архивировано партиций: {len(archived)}")
+        return 0
+
+    check_and_update_database()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,120 +1,366 @@
 import logging
-from db import get_db_connection
+from db import get_connection
 
 logger = logging.getLogger(__name__)
 
+# Индексы под горячие запросы database.py: (имя, таблица, определение)
+INDEXES = [
+    # сводка backend'а (/api/expenses-summary): transaction_type = ... AND date >= ... GROUP BY category/date
+    ("idx_expenses_type_date_category", "expenses",
+     "(transaction_type, date, category) INCLUDE (amount)"),
+    # бюджеты backend'а (/api/budgets): category = ... AND transaction_type = ... AND date >= ...
+    ("idx_expenses_category_type_date", "expenses",
+     "(category, transaction_type, date) INCLUDE (amount)"),
+    # get_detailed_monthly_expenses (диапазон дат) и get_recent_expenses (ORDER BY date DESC, id DESC)
+    ("idx_expenses_date_id", "expenses",
+     "(date, id) INCLUDE (user_name, category, amount)"),
+    # check_budget_status, бюджетные алерты и get_budget_statuses по свертке
+    # (отчеты по датам используют первичный ключ daily_category_totals)
+    ("idx_daily_totals_category_type_date", "daily_category_totals",
+     "(category, transaction_type, date) INCLUDE (total)"),
+    # get_todays_reminders: next_reminder_date <= today
+    ("idx_reminders_next_date", "reminders", "(next_reminder_date)"),
+    # поиск бюджета по категории и периоду
+    ("idx_budgets_category_period", "budgets", "(category, period)"),
+    # get_app_user_by_telegram_id на каждый /start
+    ("idx_app_users_telegram_user_id", "app_users", "(telegram_user_id)"),
+]
+
+
+# Дневная свертка expenses для отчетов; поддерживается триггером на expenses
+DAILY_TOTALS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS daily_category_totals (
+        date DATE NOT NULL,
+        category TEXT NOT NULL,
+        user_id BIGINT NOT NULL,
+        transaction_type TEXT NOT NULL,
+        user_name TEXT,
+        total NUMERIC(14, 2) NOT NULL DEFAULT 0,
+        expense_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (date, category, user_id, transaction_type)
+    )
+    ''',
+    '''
+    CREATE OR REPLACE FUNCTION maintain_daily_category_totals() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            UPDATE daily_category_totals
+               SET total = total - OLD.amount,
+                   expense_count = expense_count - 1
+             WHERE date = OLD.date AND category = OLD.category
+               AND user_id = OLD.user_id AND transaction_type = OLD.transaction_type;
+
+            DELETE FROM daily_category_totals
+             WHERE date = OLD.date AND category = OLD.category
+               AND user_id = OLD.user_id AND transaction_type = OLD.transaction_type
+               AND expense_count <= 0;
+        END IF;
+
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO daily_category_totals
+                (date, category, user_id, transaction_type, user_name, total, expense_count)
+            VALUES (NEW.date, NEW.category, NEW.user_id, NEW.transaction_type, NEW.user_name, NEW.amount, 1)
+            ON CONFLICT (date, category, user_id, transaction_type) DO UPDATE
+            SET total = daily_category_totals.total + EXCLUDED.total,
+                expense_count = daily_category_totals.expense_count + 1,
+                user_name = COALESCE(EXCLUDED.user_name, daily_category_totals.user_name);
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    ''',
+    'DROP TRIGGER IF EXISTS expenses_daily_totals ON expenses',
+    '''
+    CREATE TRIGGER expenses_daily_totals
+    AFTER INSERT OR UPDATE OR DELETE ON expenses
+    FOR EACH ROW EXECUTE FUNCTION maintain_daily_category_totals()
+    ''',
+]
+
+
+# Материализованные итоги за последние 30 дней для /monthly_report, /detailed_report
+# и сводки веб-кабинета. Обновляются REFRESH ... CONCURRENTLY (нужен уникальный
+# индекс); summary_refreshes хранит время обновления и день, на который посчитано окно.
+MONTHLY_SUMMARY_VIEWS = ["monthly_category_totals", "monthly_user_category_totals"]
+
+MONTHLY_SUMMARY_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS summary_refreshes (
+        view_name TEXT PRIMARY KEY,
+        refreshed_at TIMESTAMPTZ NOT NULL,
+        window_end DATE NOT NULL
+    )
+    ''',
+    '''
+    CREATE MATERIALIZED VIEW IF NOT EXISTS monthly_category_totals AS
+    SELECT category, SUM(total) AS total
+    FROM daily_category_totals
+    WHERE date BETWEEN CURRENT_DATE - 30 AND CURRENT_DATE
+      AND transaction_type = 'expense'
+    GROUP BY category
+    ''',
+    '''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_monthly_category_totals_category
+    ON monthly_category_totals (category)
+    ''',
+    '''
+    CREATE MATERIALIZED VIEW IF NOT EXISTS monthly_user_category_totals AS
+    SELECT COALESCE(user_name, 'Пользователь') AS user_name, category, SUM(total) AS total
+    FROM daily_category_totals
+    WHERE date BETWEEN CURRENT_DATE - 30 AND CURRENT_DATE
+    GROUP BY COALESCE(user_name, 'Пользователь'), category
+    ''',
+    '''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_monthly_user_category_totals_user_category
+    ON monthly_user_category_totals (user_name, category)
+    ''',
+    '''
+    INSERT INTO summary_refreshes (view_name, refreshed_at, window_end)
+    SELECT view_name, now(), CURRENT_DATE
+    FROM unnest(ARRAY['monthly_category_totals', 'monthly_user_category_totals']) AS view_name
+    ON CONFLICT (view_name) DO NOTHING
+    ''',
+]
+
+
+# Общее состояние реплик бота (persistence.py): user_data, chat_data, bot_data и
+# состояния ConversationHandler. data = NULL - запись удалена (чтобы другие
+# реплики увидели удаление по версии), version растет при каждой записи.
+BOT_PERSISTENCE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS bot_persistence (
+        namespace TEXT NOT NULL,
+        key TEXT NOT NULL,
+        data JSONB,
+        version BIGINT NOT NULL DEFAULT 1,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (namespace, key)
+    )
+    ''',
+]
+
+
+# Аренды плановых задач (job_leases.py): строка на (задача, запуск, шард). Реплика
+# выполняет шард, только захватив аренду; если она упала, аренда истекает и шард
+# забирает другая реплика. completed_at - шард этого запуска уже выполнен.
+JOB_LEASES_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS job_leases (
+        job_name TEXT NOT NULL,
+        run_key TEXT NOT NULL,
+        shard INTEGER NOT NULL,
+        owner TEXT NOT NULL,
+        lease_until TIMESTAMPTZ NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 1,
+        started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        completed_at TIMESTAMPTZ,
+        PRIMARY KEY (job_name, run_key, shard)
+    )
+    ''',
+]
+
+
+# Данные, общие для всех шардов одного запуска (например, текст семейного
+# отчета): их готовит первый выполняемый шард, остальные читают готовое.
+JOB_PAYLOADS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS job_payloads (
+        job_name TEXT NOT NULL,
+        run_key TEXT NOT NULL,
+        payload JSONB,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (job_name, run_key)
+    )
+    ''',
+]
+
+
+# Справочники, изменения которых (в т.ч. из Go backend) сбрасывают кэши бота:
+# триггеры шлют NOTIFY, cache_listener.py слушает канал и чистит кэш
+CACHE_NOTIFY_CHANNEL = "cache_invalidation"
+
+# (таблица, уровень триггера): для users передаем user_id, остальные сбрасываются целиком
+CACHE_NOTIFY_TABLES = [
+    ("categories", "STATEMENT"),
+    ("budgets", "STATEMENT"),
+    ("users", "ROW"),
+]
+
+CACHE_NOTIFY_FUNCTION = f'''
+    CREATE OR REPLACE FUNCTION notify_cache_invalidation() RETURNS trigger AS $$
+    DECLARE
+        payload TEXT := TG_TABLE_NAME;
+    BEGIN
+        IF TG_LEVEL = 'ROW' AND TG_TABLE_NAME = 'users' THEN
+            IF TG_OP = 'DELETE' THEN
+                payload := payload || ':' || OLD.user_id;
+            ELSE
+                payload := payload || ':' || NEW.user_id;
+            END IF;
+        END IF;
+        PERFORM pg_notify('{CACHE_NOTIFY_CHANNEL}', payload);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    '''
+
+
+def cache_notify_trigger_statements(table: str, level: str) -> list:
+    """DROP/CREATE statements for the cache invalidation trigger on a table"""
+    trigger = f"{table}_cache_invalidation"
+    return [
+        f"DROP TRIGGER IF EXISTS {trigger} ON {table}",
+        f"""
+        CREATE TRIGGER {trigger}
+        AFTER INSERT OR UPDATE OR DELETE ON {table}
+        FOR EACH {level} EXECUTE FUNCTION notify_cache_invalidation()
+        """,
+    ]
+
 
 def init_db():
     """Initialize database schema with all required tables"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    logger.info("Creating expenses table if not exists...")
-    cursor.execute(
-        '''
-        CREATE TABLE IF NOT EXISTS expenses (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            amount NUMERIC(12, 2) NOT NULL,
-            category TEXT NOT NULL,
-            date DATE NOT NULL,
-            user_name TEXT,
-            description TEXT
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        logger.info("Creating expenses table if not exists...")
+        cursor.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS expenses (
+                id SERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                amount NUMERIC(12, 2) NOT NULL,
+                category TEXT NOT NULL,
+                date DATE NOT NULL,
+                user_name TEXT,
+                description TEXT,
+                transaction_type TEXT NOT NULL DEFAULT 'expense'
+            )
+            '''
         )
-        '''
-    )
 
-    logger.info("Creating budgets table if not exists...")
-    cursor.execute(
-        '''
-        CREATE TABLE IF NOT EXISTS budgets (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            category TEXT NOT NULL,
-            amount NUMERIC(12, 2) NOT NULL,
-            period TEXT NOT NULL,
-            start_date DATE NOT NULL,
-            user_name TEXT
+        logger.info("Creating budgets table if not exists...")
+        cursor.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS budgets (
+                id SERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                category TEXT NOT NULL,
+                amount NUMERIC(12, 2) NOT NULL,
+                period TEXT NOT NULL,
+                start_date DATE NOT NULL,
+                user_name TEXT
+            )
+            '''
         )
-        '''
-    )
 
-    logger.info("Creating savings_goals table if not exists...")
-    cursor.execute(
-        '''
-        CREATE TABLE IF NOT EXISTS savings_goals (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            description TEXT NOT NULL,
-            target_amount NUMERIC(12, 2) NOT NULL,
-            current_amount NUMERIC(12, 2) DEFAULT 0,
-            target_date DATE,
-            created_date DATE NOT NULL,
-            goal_name TEXT,
-            user_name TEXT
+        logger.info("Creating savings_goals table if not exists...")
+        cursor.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS savings_goals (
+                id SERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                description TEXT NOT NULL,
+                target_amount NUMERIC(12, 2) NOT NULL,
+                current_amount NUMERIC(12, 2) DEFAULT 0,
+                target_date DATE,
+                created_date DATE NOT NULL,
+                goal_name TEXT,
+                user_name TEXT
+            )
+            '''
         )
-        '''
-    )
 
-    logger.info("Creating reminders table if not exists...")
-    cursor.execute(
-        '''
-        CREATE TABLE IF NOT EXISTS reminders (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            message TEXT NOT NULL,
-            frequency TEXT NOT NULL,
-            next_reminder_date DATE NOT NULL,
-            created_date DATE NOT NULL
+        logger.info("Creating reminders table if not exists...")
+        cursor.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS reminders (
+                id SERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                message TEXT NOT NULL,
+                frequency TEXT NOT NULL,
+                next_reminder_date DATE NOT NULL,
+                created_date DATE NOT NULL
+            )
+            '''
         )
-        '''
-    )
 
-    logger.info("Creating users table if not exists...")
-    cursor.execute(
-        '''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id BIGINT PRIMARY KEY,
-            user_name TEXT NOT NULL,
-            created_date DATE NOT NULL
+        logger.info("Creating users table if not exists...")
+        cursor.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id BIGINT PRIMARY KEY,
+                user_name TEXT NOT NULL,
+                created_date DATE NOT NULL
+            )
+            '''
         )
-        '''
-    )
 
-    conn.commit()
-    conn.close()
+        logger.info("Creating daily_category_totals rollup if not exists...")
+        for statement in DAILY_TOTALS_SCHEMA:
+            cursor.execute(statement)
+
+        logger.info("Creating monthly summary views if not exist...")
+        for statement in MONTHLY_SUMMARY_SCHEMA:
+            cursor.execute(statement)
+
+        logger.info("Creating bot persistence table if not exists...")
+        for statement in BOT_PERSISTENCE_SCHEMA:
+            cursor.execute(statement)
+
+        logger.info("Creating job leases table if not exists...")
+        for statement in JOB_LEASES_SCHEMA + JOB_PAYLOADS_SCHEMA:
+            cursor.execute(statement)
+
+        logger.info("Creating cache invalidation triggers...")
+        cursor.execute(CACHE_NOTIFY_FUNCTION)
+        for table, level in CACHE_NOTIFY_TABLES:
+            cursor.execute("SELECT to_regclass(%s) AS relation", (table,))
+            if cursor.fetchone()["relation"] is None:
+                continue
+            for statement in cache_notify_trigger_statements(table, level):
+                cursor.execute(statement)
+
+        logger.info("Creating indexes if not exist...")
+        for name, table, definition in INDEXES:
+            cursor.execute("SELECT to_regclass(%s) AS relation", (table,))
+            if cursor.fetchone()["relation"] is None:
+                continue
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} {definition}")
+
+        conn.commit()
     logger.info("Database schema initialization completed")
 
 
 def update_database_structure():
     """Legacy method to update database structure (use migrations instead)"""
     logger.info("Running legacy database structure update...")
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-    def ensure_column(table, column, ddl):
-        cursor.execute(
-            """
-            SELECT 1 FROM information_schema.columns
-            WHERE table_schema = 'public' AND table_name = %s AND column_name = %s
-            """,
-            (table, column),
-        )
-        if cursor.fetchone() is None:
-            logger.info("Adding column %s to table %s", column, table)
-            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {ddl}")
-
-    try:
-        ensure_column("expenses", "user_name", "TEXT")
-        ensure_column("expenses", "description", "TEXT")
-        ensure_column("budgets", "user_name", "TEXT")
-        ensure_column("savings_goals", "user_name", "TEXT")
-        ensure_column("savings_goals", "goal_name", "TEXT")
-        conn.commit()
-        logger.info("Legacy database structure update completed")
-    except Exception as e:
-        logger.error(f"Error updating database structure: {e}")
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
+        def ensure_column(table, column, ddl):
+            cursor.execute(
+                """
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = 'public' AND table_name = %s AND column_name = %s
+                """,
+                (table, column),
+            )
+            if cursor.fetchone() is None:
+                logger.info("Adding column %s to table %s", column, table)
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {ddl}")
+
+        try:
+            ensure_column("expenses", "user_name", "TEXT")
+            ensure_column("expenses", "description", "TEXT")
+            ensure_column("budgets", "user_name", "TEXT")
+            ensure_column("savings_goals", "user_name", "TEXT")
+            ensure_column("savings_goals", "goal_name", "TEXT")
+            conn.commit()
+            logger.info("Legacy database structure update completed")
+        except Exception as e:
+            logger.error(f"Error updating database structure: {e}")
+            conn.rollback()
+            raise
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Потоковая выгрузка таблицы expenses в CSV или Parquet (для бухгалтерии).
+
+CSV пишется через COPY ... TO STDOUT прямо в файл, Parquet - пачками из
+серверного (именованного) курсора, поэтому расход памяти не зависит от
+размера таблицы. Для Parquet нужен pyarrow из requirements.txt (ветка <18,
+совместимая с numpy 1.x).
+
+Пример:
+    python export_expenses.py expenses.csv --from 2024-01-01 --to 2024-12-31
+    python export_expenses.py expenses.parquet --category Продукты --category Дом
+"""
+
+import argparse
+import logging
+import sys
+import time
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import psycopg2.extensions
+
+from db import get_connection, wait_for_db
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = ["id", "date", "user_id", "user_name", "category", "transaction_type", "amount", "description"]
+
+
+def build_export_query(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    categories: Optional[Sequence[str]] = None,
+) -> Tuple[str, list]:
+    """SELECT для выгрузки с необязательными фильтрами по датам и категориям"""
+    conditions = []
+    params: list = []
+    if start_date:
+        conditions.append("date >= %s")
+        params.append(start_date)
+    if end_date:
+        conditions.append("date <= %s")
+        params.append(end_date)
+    if categories:
+        conditions.append("category = ANY(%s)")
+        params.append(list(categories))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"SELECT {', '.join(EXPORT_COLUMNS)} FROM expenses {where} ORDER BY id", params
+
+
+def export_csv(out, start_date=None, end_date=None, categories=None) -> int:
+    """Пишет CSV с заголовком в файловый объект out через COPY TO STDOUT; возвращает число строк"""
+    query, params = build_export_query(start_date, end_date, categories)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        copy_query = cursor.mogrify(query, params).decode("utf-8")
+        cursor.copy_expert(f"COPY ({copy_query}) TO STDOUT WITH (FORMAT csv, HEADER)", out)
+        return cursor.rowcount
+
+
+def iter_expense_batches(
+    start_date=None,
+    end_date=None,
+    categories=None,
+    batch_size: int = 10000,
+) -> Iterator[List[tuple]]:
+    """Отдает строки expenses (кортежи в порядке EXPORT_COLUMNS) пачками из серверного курсора"""
+    query, params = build_export_query(start_date, end_date, categories)
+    with get_connection() as conn:
+        # Обычный курсор вместо RealDictCursor: кортежи не создают dict на каждую строку
+        cursor = conn.cursor(name="expenses_export", cursor_factory=psycopg2.extensions.cursor)
+        cursor.itersize = batch_size
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+
+def export_parquet(path: str, start_date=None, end_date=None, categories=None, batch_size: int = 10000) -> int:
+    """Пишет Parquet по одной row group на пачку; возвращает число строк"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Для Parquet установите pyarrow: pip install -r requirements.txt") from e
+
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("date", pa.date32()),
+        ("user_id", pa.int64()),
+        ("user_name", pa.string()),
+        ("category", pa.string()),
+        ("transaction_type", pa.string()),
+        ("amount", pa.decimal128(12, 2)),
+        ("description", pa.string()),
+    ])
+
+    total = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in iter_expense_batches(start_date, end_date, categories, batch_size):
+            columns = list(zip(*rows))
+            batch = pa.RecordBatch.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema,
+            )
+            writer.write_batch(batch)
+            total += len(rows)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Потоковая выгрузка expenses в CSV / Parquet")
+    parser.add_argument("path", help="файл выгрузки ('-' для CSV в stdout)")
+    parser.add_argument("--format", choices=["csv", "parquet"], help="формат (по умолчанию по расширению)")
+    parser.add_argument("--from", dest="start_date", help="начальная дата YYYY-MM-DD")
+    parser.add_argument("--to", dest="end_date", help="конечная дата YYYY-MM-DD включительно")
+    parser.add_argument("--category", dest="categories", action="append", help="категория (можно несколько раз)")
+    parser.add_argument("--batch-size", type=int, default=10000, help="строк в пачке для Parquet")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    wait_for_db()
+
+    file_format = args.format or ("parquet" if args.path.endswith(".parquet") else "csv")
+    started = time.perf_counter()
+
+    if file_format == "parquet":
+        rows = export_parquet(args.path, args.start_date, args.end_date, args.categories, args.batch_size)
+    elif args.path == "-":
+        rows = export_csv(sys.stdout, args.start_date, args.end_date, args.categories)
+    else:
+        with open(args.path, "w", encoding="utf-8", newline="") as out:
+            rows = export_csv(out, args.start_date, args.end_date, args.categories)
+
+    seconds = time.perf_counter() - started
+    print(f"✅ Выгружено {rows} строк в {args.path} за {seconds:.2f} с", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
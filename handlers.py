@@ -14,24 +14,29 @@ from telegram.ext import (
     MessageHandler, CallbackQueryHandler, filters
 )
 
-from database import (
-    add_expense, get_daily_expenses, get_weekly_expenses, get_monthly_expenses,
-    check_budget_alerts, set_budget, get_budgets,
+from database_async import (
+    run_in_db_thread,
+    record_expense_with_alerts, get_daily_expenses, get_weekly_expenses, get_monthly_expenses,
+    set_budget, get_budget_statuses,
     add_savings_goal, get_savings_goals, update_savings_progress,
     add_reminder, get_reminders, delete_reminder,
     save_user, get_user_name, get_all_users, get_detailed_monthly_expenses,
     get_available_categories, get_app_user_by_telegram_id,
     create_portal_user, reset_app_user_password,
-    get_recent_expenses, delete_expense
+    get_recent_expenses, delete_expense, get_todays_reminders,
+    refresh_monthly_summaries
 )
 from utils import (
-    build_web_url, get_main_keyboard, is_bot_command, create_monthly_chart,
+    build_web_url, get_main_keyboard, is_bot_command, load_charts,
     format_expense_report, format_budget_report, format_savings_goals_report,
     format_reminders_report, format_detailed_monthly_report,
     get_user_display_name
 )
+from outbound import send_bulk_messages
+from persistence import SharedConversationHandler
+from database_migrations import DatabaseMigration
 from config import (
-    REMINDER_FREQUENCIES, PERIOD_LABEL_TO_CODE,
+    Config, REMINDER_FREQUENCIES, PERIOD_LABEL_TO_CODE,
     CODE_TO_PERIOD_LABEL, EXPENSE_AMOUNT, EXPENSE_CATEGORY,
     BUDGET_AMOUNT, BUDGET_CATEGORY, SAVINGS_AMOUNT, SAVINGS_DESCRIPTION
 )
@@ -39,8 +44,8 @@ from config import (
 logger = logging.getLogger(__name__)
 
 
-def get_dynamic_categories():
-    categories = get_available_categories()
+async def get_dynamic_categories():
+    categories = await get_available_categories()
     return categories if categories else ["Прочее"]
 
 
@@ -53,7 +58,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     full_name = get_user_display_name(user)
     context.user_data['user_name'] = full_name
-    save_user(user_id, full_name)
+    await save_user(user_id, full_name)
 
     # Создаем инлайн-кнопку для веб-интерфейса
     web_url = build_web_url(user_id)
@@ -79,7 +84,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     )
 
     # Создаем или получаем доступ к порталу
-    portal_message = build_portal_message(user, full_name)
+    portal_message = await build_portal_message(user, full_name)
     await update.message.reply_text(portal_message, reply_markup=get_main_keyboard())
 
 
@@ -99,7 +104,7 @@ async def expense_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         context.user_data['amount'] = amount
 
         # Создаем ИНЛАЙН-клавиатуру с категориями (работает в группах)
-        categories = get_dynamic_categories()
+        categories = await get_dynamic_categories()
         keyboard = []
         row = []
         for i, category in enumerate(categories):
@@ -121,7 +126,7 @@ async def expense_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def expense_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle expense category (text input - for backward compatibility)"""
     category = update.message.text.strip()
-    categories = context.user_data.get('available_categories') or get_dynamic_categories()
+    categories = context.user_data.get('available_categories') or await get_dynamic_categories()
     if category not in categories:
         await update.message.reply_text(
             "Такой категории нет в справочнике. Пожалуйста, выберите одну из предложенных кнопок или добавьте категорию через веб-интерфейс."
@@ -131,10 +136,8 @@ async def expense_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     user_id = update.effective_user.id
     amount = context.user_data['amount']
 
-    add_expense(user_id, amount, category)
-
-    # Проверяем превышение бюджета
-    budget_alerts = check_budget_alerts(user_id, category, amount)
+    # Добавляем расход и проверяем превышение бюджета одним запросом
+    budget_alerts = await record_expense_with_alerts(user_id, amount, category)
 
     # Основное сообщение о добавлении расхода
     message = f'✅ Расход добавлен: {amount} руб. в категорию "{category}"'
@@ -166,7 +169,7 @@ async def category_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await query.edit_message_text("❌ Ошибка выбора категории")
         return ConversationHandler.END
 
-    categories = context.user_data.get('available_categories') or get_dynamic_categories()
+    categories = context.user_data.get('available_categories') or await get_dynamic_categories()
 
     # Получаем выбранную категорию из callback_data
     category = query.data.replace("category_", "")
@@ -182,16 +185,13 @@ async def category_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     if not user_name:
         # Пытаемся получить имя из базы данных
-        user_name = get_user_name(user_id)
+        user_name = await get_user_name(user_id)
         if user_name:
             # Сохраняем в контекст для будущего использования
             context.user_data['user_name'] = user_name
 
-    # Добавляем расход
-    add_expense(user_id, amount, category)
-
-    # Проверяем превышение бюджета
-    budget_alerts = check_budget_alerts(user_id, category, amount)
+    # Добавляем расход и проверяем превышение бюджета одним запросом
+    budget_alerts = await record_expense_with_alerts(user_id, amount, category)
 
     # Основное сообщение о добавлении расхода
     message = f'✅ Расход добавлен: {amount} руб. в категорию "{category}"'
@@ -212,7 +212,7 @@ async def category_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 def create_expense_handler():
     """Create conversation handler for adding expenses"""
-    return ConversationHandler(
+    return SharedConversationHandler(
         entry_points=[CommandHandler("add_expense", add_expense_start)],
         states={
             EXPENSE_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, expense_amount)],
@@ -226,7 +226,9 @@ def create_expense_handler():
         ],
         allow_reentry=True,
         per_chat=True,
-        per_user=True
+        per_user=True,
+        name="expense",
+        persistent=Config.BOT_PERSISTENCE
     )
 
 
@@ -235,7 +237,7 @@ def create_expense_handler():
 async def daily_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /daily_report command"""
     user_id = update.effective_user.id
-    expenses, total = get_daily_expenses()  # Теперь без user_id - показывает всю семью
+    expenses, total = await get_daily_expenses()  # Теперь без user_id - показывает всю семью
 
     report = format_expense_report(expenses, total, "сегодня (вся семья)")
     await update.message.reply_text(report, reply_markup=get_main_keyboard())
@@ -244,7 +246,7 @@ async def daily_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 async def weekly_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /weekly_report command"""
     user_id = update.effective_user.id
-    expenses, total = get_weekly_expenses()  # Теперь без user_id - показывает всю семью
+    expenses, total = await get_weekly_expenses()  # Теперь без user_id - показывает всю семью
 
     if not expenses:
         await update.message.reply_text('За последнюю неделю нет расходов.', reply_markup=get_main_keyboard())
@@ -262,7 +264,7 @@ async def weekly_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 async def monthly_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /monthly_report command"""
     user_id = update.effective_user.id
-    expenses, total = get_monthly_expenses()  # Теперь без user_id - показывает всю семью
+    expenses, total = await get_monthly_expenses()  # Теперь без user_id - показывает всю семью
 
     if not expenses:
         await update.message.reply_text('За последний месяц нет расходов.', reply_markup=get_main_keyboard())
@@ -277,14 +279,15 @@ async def monthly_report(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await update.message.reply_text(report, reply_markup=get_main_keyboard())
 
     # Отправляем график расходов (теперь для всей семьи)
-    chart = create_monthly_chart(None)  # Передаем None чтобы показать всю семью
+    charts = await load_charts()  # matplotlib загружается лениво
+    chart = await charts.render_monthly_chart(expenses)  # Рисуем по уже полученным данным, без повторного запроса
     if chart:
         await update.message.reply_photo(chart, reply_markup=get_main_keyboard())
 
 
 async def detailed_monthly_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /detailed_report command - show expenses by user"""
-    expenses = get_detailed_monthly_expenses()
+    expenses = await get_detailed_monthly_expenses()
     report = format_detailed_monthly_report(expenses)
     await update.message.reply_text(report, reply_markup=get_main_keyboard())
 
@@ -328,7 +331,7 @@ async def budget_category(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         context.user_data['budget_amount'] = amount
 
         # Создаем клавиатуру с категориями из базы данных
-        categories = get_dynamic_categories()
+        categories = await get_dynamic_categories()
         keyboard = [[category] for category in categories]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
@@ -347,7 +350,7 @@ async def save_budget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     period = context.user_data['budget_period']
     period_label = context.user_data.get('budget_period_label', CODE_TO_PERIOD_LABEL.get(period, period))
 
-    set_budget(user_id, category, amount, period)
+    await set_budget(user_id, category, amount, period)
 
     # Возвращаем основное меню
     await update.message.reply_text(
@@ -361,7 +364,7 @@ async def save_budget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 async def show_budgets(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /my_budgets command"""
     user_id = update.effective_user.id
-    budgets = get_budgets()  # Теперь без user_id - показывает общие семейные бюджеты
+    budgets = await get_budget_statuses()  # Общие семейные бюджеты вместе с тратами одним запросом
 
     report = format_budget_report(budgets, None)  # Передаем None для семейного режима
     await update.message.reply_text(report, reply_markup=get_main_keyboard())
@@ -392,7 +395,7 @@ async def savings_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         user_id = update.effective_user.id
         description = context.user_data['savings_description']
 
-        add_savings_goal(user_id, description, amount)
+        await add_savings_goal(user_id, description, amount)
 
         # Возвращаем основное меню
         await update.message.reply_text(
@@ -409,7 +412,7 @@ async def savings_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def show_savings_goals(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /savings_goals command"""
     user_id = update.effective_user.id
-    goals = get_savings_goals()  # Теперь без user_id - показывает общие семейные цели
+    goals = await get_savings_goals()  # Теперь без user_id - показывает общие семейные цели
 
     if not goals:
         await update.message.reply_text('Пока нет целей экономии.', reply_markup=get_main_keyboard())
@@ -438,7 +441,7 @@ async def add_to_savings_goal(update: Update, context: ContextTypes.DEFAULT_TYPE
         goal_id = context.user_data.get('current_goal_id')
 
         if goal_id:
-            update_savings_progress(user_id, goal_id, amount)
+            await update_savings_progress(user_id, goal_id, amount)
             await update.message.reply_text(
                 f'✅ Добавлено {amount} руб. к цели экономии.',
                 reply_markup=get_main_keyboard()
@@ -495,7 +498,7 @@ async def process_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         frequency = text
         reminder_text = context.user_data.get('reminder_text', 'Напоминание')
 
-        add_reminder(user_id, reminder_text, frequency)
+        await add_reminder(user_id, reminder_text, frequency)
 
         # Возвращаем основное меню
         await update.message.reply_text(
@@ -518,7 +521,7 @@ async def process_reminder_callback(update: Update, context: ContextTypes.DEFAUL
         reminder_id = int(query.data.split("_")[-1])
         user_id = update.effective_user.id
 
-        delete_reminder(user_id, reminder_id)
+        await delete_reminder(user_id, reminder_id)
 
         await query.message.reply_text("Напоминание удалено.", reply_markup=get_main_keyboard())
 
@@ -528,7 +531,7 @@ async def process_reminder_callback(update: Update, context: ContextTypes.DEFAUL
 async def show_recent_expenses(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /delete_last command - show recent expenses with delete buttons"""
     user_id = update.effective_user.id
-    expenses = get_recent_expenses(user_id, limit=5)
+    expenses = await get_recent_expenses(user_id, limit=5)
 
     if not expenses:
         await update.message.reply_text(
@@ -569,7 +572,7 @@ async def process_delete_expense_callback(update: Update, context: ContextTypes.
         expense_id = int(query.data.split("_")[-1])
         user_id = update.effective_user.id
 
-        success = delete_expense(user_id, expense_id)
+        success = await delete_expense(user_id, expense_id)
 
         if success:
             await query.message.edit_text(
@@ -594,24 +597,24 @@ async def reset_portal_password(update: Update, context: ContextTypes.DEFAULT_TY
     new_password = generate_password()
 
     # Пытаемся сбросить пароль
-    login = reset_app_user_password(user_id, new_password)
+    login = await reset_app_user_password(user_id, new_password)
 
     if not login:
         # Аккаунт не найден - создаем автоматически
         full_name = get_user_display_name(user)
 
         # Сначала убедимся что users существует
-        save_user(user_id, full_name)
+        await save_user(user_id, full_name)
 
         # Теперь создаем app_user
         login_candidate = sanitize_login(user.username, user_id)
         try:
-            create_portal_user(login_candidate, new_password, user_id, full_name)
+            await create_portal_user(login_candidate, new_password, user_id, full_name)
             login = login_candidate
         except ValueError:
             # Логин занят, используем запасной вариант
             login = f"user{user_id}"
-            create_portal_user(login, new_password, user_id, full_name)
+            await create_portal_user(login, new_password, user_id, full_name)
 
     await update.message.reply_text(
         "✅ Пароль для веб-кабинета сброшен.\n"
@@ -623,45 +626,50 @@ async def reset_portal_password(update: Update, context: ContextTypes.DEFAULT_TY
 
 # ========== SCHEDULED TASKS ==========
 
-async def send_daily_reports(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Send daily reports to all users (scheduled task)"""
-    users = get_all_users()
+async def build_daily_report(context: ContextTypes.DEFAULT_TYPE) -> Optional[str]:
+    """Build today's family expense report; None if there were no expenses"""
+    expenses, total = await get_daily_expenses()
+    if not expenses:
+        return None
 
-    for user in users:
-        user_id = user['user_id']
-        expenses, total = get_daily_expenses(user_id)
+    report = "📊 Ежедневный отчет о расходах:\n\n"
+    for expense in expenses:
+        total_value = float(expense['total']) if expense['total'] else 0
+        report += f"{expense['category']}: {total_value:.2f} руб.\n"
 
-        if expenses:
-            report = "📊 Ежедневный отчет о расходах:\n\n"
-            for expense in expenses:
-                total_value = float(expense['total']) if expense['total'] else 0
-                report += f"{expense['category']}: {total_value:.2f} руб.\n"
+    report += f"\nОбщая сумма за сегодня: {total:.2f} руб."
+    return report
 
-            report += f"\nОбщая сумма за сегодня: {total:.2f} руб."
 
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=report
-                )
-            except Exception as e:
-                logger.error(f"Error sending daily report to user {user_id}: {e}")
+async def send_daily_reports(
+    context: ContextTypes.DEFAULT_TYPE, shard: int = 0, shards: int = 1, *, prepared: Optional[str]
+) -> None:
+    """Send the report built once per run by build_daily_report to the shard's users (scheduled task)"""
+    # Отчет общий для всей семьи: шарды только рассылают его своим пользователям
+    if prepared is None:
+        return
 
+    users = await get_all_users(shard, shards)
+    if not users:
+        return
 
-async def check_reminders(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Check and send reminders (scheduled task)"""
-    from database import get_todays_reminders
+    sent, failed = await send_bulk_messages(
+        context.bot, [(user['user_id'], prepared) for user in users]
+    )
+    logger.info(f"Daily reports sent: {sent}, failed: {failed}")
 
-    reminders = get_todays_reminders()
 
-    for reminder in reminders:
-        try:
-            await context.bot.send_message(
-                chat_id=reminder['user_id'],
-                text=f"📣 Напоминание: {reminder['message']}"
-            )
-        except Exception as e:
-            logger.error(f"Error sending reminder: {e}")
+async def check_reminders(context: ContextTypes.DEFAULT_TYPE, shard: int = 0, shards: int = 1) -> None:
+    """Check and send reminders of the shard's users (scheduled task)"""
+    reminders = await get_todays_reminders(shard, shards)
+    if not reminders:
+        return
+
+    sent, failed = await send_bulk_messages(
+        context.bot,
+        [(reminder['user_id'], f"📣 Напоминание: {reminder['message']}") for reminder in reminders]
+    )
+    logger.info(f"Reminders sent: {sent}, failed: {failed}")
 
 
 # ========== GENERAL MESSAGE HANDLER ==========
@@ -711,9 +719,9 @@ def sanitize_login(username: Optional[str], user_id: int) -> str:
     return f"user{user_id}"
 
 
-def build_portal_message(user, full_name: str) -> str:
+async def build_portal_message(user, full_name: str) -> str:
     """Build message about portal access (create or show existing)"""
-    existing = get_app_user_by_telegram_id(user.id)
+    existing = await get_app_user_by_telegram_id(user.id)
     if existing:
         return (
             "🔑 Доступ к веб-кабинету уже создан.\n"
@@ -727,12 +735,12 @@ def build_portal_message(user, full_name: str) -> str:
 
     try:
         # create_portal_user автоматически синхронизирует таблицу users
-        create_portal_user(login, password, user.id, full_name)
+        await create_portal_user(login, password, user.id, full_name)
     except ValueError:
         # Логин занят, используем запасной вариант
         login = f"user{user.id}"
         password = generate_password()
-        create_portal_user(login, password, user.id, full_name)
+        await create_portal_user(login, password, user.id, full_name)
 
     return (
         "🎉 Создан доступ в веб-кабинет!\n"
@@ -740,3 +748,22 @@ def build_portal_message(user, full_name: str) -> str:
         f"Пароль: {password}\n"
         "Сохраните данные или сразу измените пароль в UI."
     )
+
+
+async def refresh_summary_views(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Refresh materialized monthly summaries (scheduled task)"""
+    try:
+        await refresh_monthly_summaries()
+    except Exception as e:
+        logger.error(f"Error refreshing summary views: {e}")
+
+
+async def maintain_expense_partitions(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Create upcoming monthly partitions of expenses (scheduled task)"""
+    try:
+        created = await run_in_db_thread(DatabaseMigration().ensure_partitions)
+    except Exception as e:
+        logger.error(f"Error creating expense partitions: {e}")
+        return
+    if created:
+        logger.info(f"Expense partitions created: {', '.join(created)}")
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Массовый импорт расходов из CSV / NDJSON / JSON (например, выгрузок банка).
+
+Файл читается потоково, строки проверяются (сумма, дата, категория из таблицы
+categories) и пачками загружаются через COPY во временную таблицу, после чего
+одна команда INSERT ... SELECT переносит их в expenses, подставляя user_name
+из users одним JOIN. Все выполняется в одной транзакции.
+
+По умолчанию свертку daily_category_totals обновляет построчный триггер, и бот
+с backend могут писать в expenses во время импорта. --fast отключает триггер
+и пересчитывает свертку одним запросом: это быстрее на миллионах строк, но
+ALTER TABLE держит ACCESS EXCLUSIVE блокировку expenses до конца импорта,
+и вся запись в expenses (бот, веб-кабинет) ждет.
+
+Пример:
+    python import_expenses.py bank_2023.csv --user-id 123456789
+    python import_expenses.py history.jsonl --dry-run
+    python import_expenses.py archive_2019.csv --fast  # в окно обслуживания
+"""
+
+import argparse
+import csv
+import io
+import json
+import logging
+import sys
+import time
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from config import CATEGORIES
+from database_migrations import rebuild_daily_totals
+from db import get_connection, wait_for_db
+
+logger = logging.getLogger(__name__)
+
+STAGING_COLUMNS = ["user_id", "amount", "category", "date", "description", "transaction_type", "user_name"]
+TRANSACTION_TYPES = {"expense", "income"}
+DATE_FORMATS = ["%d.%m.%Y", "%d/%m/%Y"]  # кроме ISO YYYY-MM-DD
+AMOUNT_PRECISION, AMOUNT_SCALE = 12, 2  # expenses.amount NUMERIC(12, 2)
+MAX_REPORTED_ERRORS = 20
+
+
+class RowError(ValueError):
+    """Строка файла не прошла проверку"""
+
+
+def read_rows(path: str, file_format: Optional[str] = None) -> Iterator[Dict]:
+    """
+    Читает записи из CSV (с заголовком), NDJSON (объект JSON на строку) или
+    JSON (массив объектов). CSV и NDJSON читаются потоково, JSON - целиком.
+    """
+    if file_format is None:
+        if path.endswith((".jsonl", ".ndjson")):
+            file_format = "jsonl"
+        elif path.endswith(".json"):
+            file_format = "json"
+        else:
+            file_format = "csv"
+
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8-sig", newline="")
+    try:
+        if file_format == "csv":
+            yield from csv.DictReader(stream)
+        elif file_format == "json":
+            try:
+                records = json.load(stream)
+            except json.JSONDecodeError as e:
+                yield RowError(f"неверный JSON: {e.msg}")
+                return
+            if not isinstance(records, list):
+                yield RowError(f"ожидался массив объектов, получено: {type(records).__name__}")
+                return
+            yield from records
+        else:
+            for line in stream:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    # Битая строка отклоняется как невалидная запись, импорт продолжается
+                    yield RowError(f"неверный JSON: {e.msg}")
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def parse_date(value: str) -> date:
+    try:
+        return date.fromisoformat(value)  # быстрый путь для YYYY-MM-DD
+    except ValueError:
+        pass
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise RowError(f"неверная дата: {value!r}")
+
+
+def normalize_row(raw: Dict, categories: Set[str], default_user_id: Optional[int]) -> Tuple:
+    """Проверяет запись и возвращает кортеж в порядке STAGING_COLUMNS"""
+    if isinstance(raw, RowError):
+        raise raw
+    if not isinstance(raw, dict):
+        raise RowError(f"ожидался объект, получено: {type(raw).__name__}")
+    user_id = raw.get("user_id") or default_user_id
+    if user_id in (None, ""):
+        raise RowError("нет user_id (укажите колонку или --user-id)")
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        raise RowError(f"неверный user_id: {user_id!r}")
+
+    try:
+        amount = Decimal(str(raw.get("amount", "")).replace(",", ".").replace(" ", ""))
+    except InvalidOperation:
+        raise RowError(f"неверная сумма: {raw.get('amount')!r}")
+    if not amount.is_finite():
+        raise RowError(f"неверная сумма: {raw.get('amount')!r}")
+    if amount <= 0:
+        raise RowError(f"сумма должна быть положительной: {amount}")
+    # Иначе COPY упадет на переполнении NUMERIC(12, 2) и откатит весь импорт
+    if amount.adjusted() >= AMOUNT_PRECISION - AMOUNT_SCALE:
+        raise RowError(f"слишком большая сумма: {amount}")
+    if amount != amount.quantize(Decimal(1).scaleb(-AMOUNT_SCALE)):
+        raise RowError(f"больше {AMOUNT_SCALE} знаков после запятой: {amount}")
+
+    category = str(raw.get("category") or "").strip()
+    if category not in categories:
+        raise RowError(f"неизвестная категория: {category!r}")
+
+    expense_date = parse_date(str(raw.get("date") or "").strip())
+
+    transaction_type = str(raw.get("transaction_type") or "expense").strip()
+    if transaction_type not in TRANSACTION_TYPES:
+        raise RowError(f"неверный transaction_type: {transaction_type!r}")
+
+    description = raw.get("description") or None
+    user_name = raw.get("user_name") or None
+    return user_id, amount, category, expense_date, description, transaction_type, user_name
+
+
+def load_categories(cursor) -> Set[str]:
+    """Допустимые категории из таблицы categories (или CATEGORIES, если она пуста)"""
+    cursor.execute("SELECT name FROM categories")
+    names = {row["name"] for row in cursor.fetchall()}
+    return names or set(CATEGORIES)
+
+
+def copy_batch(cursor, batch: List[Tuple]) -> None:
+    buf = io.StringIO()
+    csv.writer(buf).writerows(batch)
+    buf.seek(0)
+    cursor.copy_expert(
+        f"COPY expense_import ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+        buf,
+    )
+
+
+def import_expenses(
+    rows: Iterable[Dict],
+    default_user_id: Optional[int] = None,
+    batch_size: int = 50000,
+    dry_run: bool = False,
+    fast: bool = False,
+) -> Dict:
+    """
+    Импортирует записи в expenses одной транзакцией.
+
+    По умолчанию свертку daily_category_totals обновляет построчный триггер.
+    fast=True отключает триггер на время вставки и пересчитывает свертку за
+    затронутые даты одним запросом; ALTER TABLE при этом держит ACCESS
+    EXCLUSIVE блокировку expenses до коммита.
+
+    Returns:
+        Словарь со статистикой: read, rejected, inserted, seconds, errors
+    """
+    started = time.perf_counter()
+    stats = {"read": 0, "rejected": 0, "inserted": 0, "errors": []}
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            categories = load_categories(cursor)
+            cursor.execute(
+                """
+                CREATE TEMP TABLE expense_import (
+                    user_id BIGINT NOT NULL,
+                    amount NUMERIC(12, 2) NOT NULL,
+                    category TEXT NOT NULL,
+                    date DATE NOT NULL,
+                    description TEXT,
+                    transaction_type TEXT NOT NULL,
+                    user_name TEXT
+                ) ON COMMIT DROP
+                """
+            )
+
+            batch = []
+            for raw in rows:
+                stats["read"] += 1
+                try:
+                    batch.append(normalize_row(raw, categories, default_user_id))
+                except RowError as e:
+                    stats["rejected"] += 1
+                    if len(stats["errors"]) < MAX_REPORTED_ERRORS:
+                        stats["errors"].append(f"запись {stats['read']}: {e}")
+                    continue
+                if len(batch) >= batch_size:
+                    copy_batch(cursor, batch)
+                    batch = []
+            if batch:
+                copy_batch(cursor, batch)
+
+            if dry_run:
+                conn.rollback()
+            else:
+                if fast:
+                    cursor.execute("ALTER TABLE expenses DISABLE TRIGGER expenses_daily_totals")
+
+                # Имя пользователя берется из файла или один раз на пользователя из users
+                cursor.execute(
+                    """
+                    INSERT INTO expenses (user_id, amount, category, date, description, transaction_type, user_name)
+                    SELECT s.user_id, s.amount, s.category, s.date, s.description, s.transaction_type,
+                           COALESCE(s.user_name, u.user_name, 'Пользователь')
+                    FROM expense_import s
+                    LEFT JOIN users u ON u.user_id = s.user_id
+                    """
+                )
+                stats["inserted"] = cursor.rowcount
+
+                if fast:
+                    cursor.execute("ALTER TABLE expenses ENABLE TRIGGER expenses_daily_totals")
+                    cursor.execute("SELECT MIN(date) AS start_date, MAX(date) AS end_date FROM expense_import")
+                    bounds = cursor.fetchone()
+                    if bounds["start_date"] is not None:
+                        rebuild_daily_totals(cursor, bounds["start_date"], bounds["end_date"])
+
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Массовый импорт расходов из CSV / NDJSON / JSON")
+    parser.add_argument("path", help="файл CSV с заголовком, NDJSON или JSON-массив ('-' для stdin)")
+    parser.add_argument("--format", choices=["csv", "jsonl", "json"], help="формат файла (по умолчанию по расширению)")
+    parser.add_argument("--user-id", type=int, help="user_id для строк без этой колонки")
+    parser.add_argument("--batch-size", type=int, default=50000, help="строк в одном COPY")
+    parser.add_argument("--dry-run", action="store_true", help="только проверить файл, ничего не записывать")
+    parser.add_argument("--fast", action="store_true",
+                        help="отключить триггер свертки и пересчитать ее в конце "
+                             "(быстрее, но блокирует запись в expenses на все время импорта)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    wait_for_db()
+
+    stats = import_expenses(
+        read_rows(args.path, args.format),
+        default_user_id=args.user_id,
+        batch_size=args.batch_size,
+        dry_run=args.dry_run,
+        fast=args.fast,
+    )
+
+    for error in stats["errors"]:
+        print(f"⚠️  {error}")
+    rate = stats["read"] / stats["seconds"] if stats["seconds"] > 0 else 0
+    action = "проверено" if args.dry_run else f"загружено {stats['inserted']}"
+    print(
+        f"✅ Прочитано {stats['read']}, отклонено {stats['rejected']}, {action} "
+        f"за {stats['seconds']:.2f} с ({rate:,.0f} строк/с)"
+    )
+    return 1 if stats["rejected"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,268 @@
+"""
+Scheduled jobs coordinated across bot replicas.
+Every replica polls its JobQueue, but a run of a job is split into shards and
+each shard is executed only by the replica that holds its lease in the
+job_leases table. A replica renews its lease while working; if it dies, the
+lease expires and another replica picks the shard up on its next poll.
+Completed shards are never run again for the same run key. Data that every
+shard of a run needs (the family report) is prepared once by the first shard
+and stored in job_payloads for the others.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import socket
+import uuid
+from datetime import datetime, time, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from psycopg2.extras import Json
+
+from config import Config
+from database_async import run_in_db_thread
+from db import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Идентификатор этой реплики в job_leases.owner
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+JOB_LEASES_RETENTION_DAYS = 30
+JOB_MAX_ATTEMPTS = 3  # упавший шард повторяется не больше стольких раз за запуск
+
+
+def claim_shard(job_name: str, run_key: str, shard: int, owner: str, lease_seconds: float) -> bool:
+    """Take the shard's lease unless it is completed, held by a live owner or out of attempts"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                '''INSERT INTO job_leases (job_name, run_key, shard, owner, lease_until)
+                   VALUES (%(job)s, %(run)s, %(shard)s, %(owner)s, now() + make_interval(secs => %(lease)s))
+                   ON CONFLICT (job_name, run_key, shard) DO UPDATE
+                   SET owner = EXCLUDED.owner,
+                       lease_until = EXCLUDED.lease_until,
+                       attempts = job_leases.attempts + 1,
+                       started_at = now()
+                   WHERE job_leases.completed_at IS NULL
+                     AND job_leases.lease_until < now()
+                     AND job_leases.attempts < %(max_attempts)s
+                   RETURNING attempts''',
+                {
+                    'job': job_name, 'run': run_key, 'shard': shard, 'owner': owner,
+                    'lease': lease_seconds, 'max_attempts': JOB_MAX_ATTEMPTS,
+                }
+            )
+            claimed = cursor.fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    if claimed and claimed['attempts'] > 1:
+        logger.warning(f"Job {job_name} [{run_key}] shard {shard} taken over (attempt {claimed['attempts']})")
+    return claimed is not None
+
+
+def renew_lease(job_name: str, run_key: str, shard: int, owner: str, lease_seconds: float) -> bool:
+    """Extend our lease; False if another replica has taken the shard over"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''UPDATE job_leases SET lease_until = now() + make_interval(secs => %s)
+               WHERE job_name = %s AND run_key = %s AND shard = %s AND owner = %s AND completed_at IS NULL''',
+            (lease_seconds, job_name, run_key, shard, owner)
+        )
+        renewed = cursor.rowcount == 1
+        conn.commit()
+        return renewed
+
+
+def complete_shard(job_name: str, run_key: str, shard: int, owner: str) -> None:
+    """Mark the shard done and drop this job's leases older than the retention period"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''UPDATE job_leases SET completed_at = now()
+               WHERE job_name = %s AND run_key = %s AND shard = %s AND owner = %s''',
+            (job_name, run_key, shard, owner)
+        )
+        cursor.execute(
+            "DELETE FROM job_leases WHERE job_name = %s AND started_at < now() - make_interval(days => %s)",
+            (job_name, JOB_LEASES_RETENTION_DAYS)
+        )
+        cursor.execute(
+            "DELETE FROM job_payloads WHERE job_name = %s AND created_at < now() - make_interval(days => %s)",
+            (job_name, JOB_LEASES_RETENTION_DAYS)
+        )
+        conn.commit()
+
+
+def release_shard(job_name: str, run_key: str, shard: int, owner: str) -> None:
+    """Give the lease up after a failure so another poll can retry the shard right away"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''UPDATE job_leases SET lease_until = now()
+               WHERE job_name = %s AND run_key = %s AND shard = %s AND owner = %s AND completed_at IS NULL''',
+            (job_name, run_key, shard, owner)
+        )
+        conn.commit()
+
+
+def fetch_payload(job_name: str, run_key: str) -> Optional[Dict]:
+    """The run's shared payload row, None if no shard has prepared it yet"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT payload FROM job_payloads WHERE job_name = %s AND run_key = %s",
+            (job_name, run_key)
+        )
+        return cursor.fetchone()
+
+
+def store_payload(job_name: str, run_key: str, payload: Any) -> Any:
+    """Save the run's shared payload unless another shard got there first; returns the stored one"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                '''INSERT INTO job_payloads (job_name, run_key, payload) VALUES (%s, %s, %s)
+                   ON CONFLICT (job_name, run_key) DO NOTHING''',
+                (job_name, run_key, Json(payload))
+            )
+            cursor.execute(
+                "SELECT payload FROM job_payloads WHERE job_name = %s AND run_key = %s",
+                (job_name, run_key)
+            )
+            stored = cursor.fetchone()['payload']
+            conn.commit()
+            return stored
+        except Exception:
+            conn.rollback()
+            raise
+
+
+# ========== SCHEDULES ==========
+
+def daily_at(at: time, grace: Optional[float] = None) -> Callable[[datetime], Optional[str]]:
+    """Run key (UTC date) once at..at+grace has passed today, None outside that window"""
+    def run_key(now: datetime) -> Optional[str]:
+        scheduled = datetime.combine(now.date(), at, tzinfo=timezone.utc)
+        window = Config.JOB_MISFIRE_GRACE if grace is None else grace
+        if scheduled <= now <= scheduled + timedelta(seconds=window):
+            return now.date().isoformat()
+        return None
+    return run_key
+
+
+def every(seconds: float) -> Callable[[datetime], Optional[str]]:
+    """Run key of the current interval bucket (one run per interval across replicas)"""
+    def run_key(now: datetime) -> Optional[str]:
+        return str(int(now.timestamp() // seconds))
+    return run_key
+
+
+# ========== COORDINATED JOB ==========
+
+class CoordinatedJob:
+    """
+    JobQueue callback that runs callback(context, shard, shards) for every
+    shard of the current run that this replica manages to lease.
+
+    Args:
+        name: Job name in job_leases
+        callback: Coroutine taking (context, shard, shards), or just (context) when shards == 1
+        schedule: Function returning the run key for "now" or None if the job is not due
+        shards: Number of independent parts of one run
+        prepare: Coroutine taking (context) whose JSON result is built once per
+            run and passed to every shard's callback as prepared=
+    """
+
+    def __init__(
+        self,
+        name: str,
+        callback: Callable[..., Awaitable[None]],
+        schedule: Callable[[datetime], Optional[str]],
+        shards: int = 1,
+        lease_seconds: Optional[float] = None,
+        prepare: Optional[Callable[[Any], Awaitable[Any]]] = None,
+    ):
+        self.name = name
+        self.__name__ = name
+        self.callback = callback
+        self.schedule = schedule
+        self.shards = shards
+        self.lease_seconds = lease_seconds or Config.JOB_LEASE_SECONDS
+        self.prepare = prepare
+
+    async def __call__(self, context) -> None:
+        run_key = self.schedule(datetime.now(timezone.utc))
+        if run_key is None:
+            return
+
+        # Случайный порядок: реплики, опросившие одновременно, берут разные шарды
+        shards = list(range(self.shards))
+        random.shuffle(shards)
+        for shard in shards:
+            try:
+                claimed = await run_in_db_thread(claim_shard, self.name, run_key, shard, OWNER, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Cannot claim job {self.name} [{run_key}] shard {shard}: {e}")
+                return
+            if claimed:
+                await self._run_shard(context, run_key, shard)
+
+    async def _run_shard(self, context, run_key: str, shard: int) -> None:
+        work = asyncio.ensure_future(self._work(context, run_key, shard))
+        heartbeat = asyncio.ensure_future(self._heartbeat(run_key, shard, work))
+        try:
+            await work
+        except asyncio.CancelledError:
+            if not (heartbeat.done() and not heartbeat.cancelled() and heartbeat.result()):
+                raise
+            logger.warning(f"Job {self.name} [{run_key}] shard {shard} stopped: lease taken by another replica")
+            return
+        except Exception as e:
+            logger.error(f"Job {self.name} [{run_key}] shard {shard} failed: {e}")
+            await run_in_db_thread(release_shard, self.name, run_key, shard, OWNER)
+            return
+        finally:
+            heartbeat.cancel()
+
+        await run_in_db_thread(complete_shard, self.name, run_key, shard, OWNER)
+        logger.info(f"Job {self.name} [{run_key}] shard {shard + 1}/{self.shards} completed")
+
+    async def _work(self, context, run_key: str, shard: int) -> None:
+        kwargs = {}
+        if self.prepare is not None:
+            kwargs["prepared"] = await self._prepared(context, run_key)
+        if self.shards > 1:
+            await self.callback(context, shard, self.shards, **kwargs)
+        else:
+            await self.callback(context, **kwargs)
+
+    async def _prepared(self, context, run_key: str) -> Any:
+        # Шарды запуска могут выполняться на разных репликах, поэтому готовое храним в БД.
+        # Реплики, начавшие в один момент, могут построить его обе, но разошлют одну версию
+        row = await run_in_db_thread(fetch_payload, self.name, run_key)
+        if row is not None:
+            return row["payload"]
+        payload = await self.prepare(context)
+        return await run_in_db_thread(store_payload, self.name, run_key, payload)
+
+    async def _heartbeat(self, run_key: str, shard: int, work: asyncio.Future) -> bool:
+        """Renew the lease every third of its length; True (and work cancelled) if it was lost"""
+        # Потеряли аренду - останавливаем работу, чтобы не дублировать другую реплику
+        while not work.done():
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = await run_in_db_thread(renew_lease, self.name, run_key, shard, OWNER, self.lease_seconds)
+            except Exception as e:
+                logger.warning(f"Cannot renew lease of {self.name} [{run_key}] shard {shard}: {e}")
+                continue
+            if not renewed:
+                work.cancel()
+                return True
+        return False
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест обработчиков бота без сети.
+
+Собирает настоящее Application через bot.build_application(), но с Bot, чей
+HTTP-запрос подменен RecordingRequest: ответы Telegram имитируются, а все
+исходящие вызовы (sendMessage, editMessageText, sendPhoto, ...) считаются.
+Синтетические Update кладутся в update_queue с заданной частотой сценариев
+(например, /add_expense -> сумма -> выбор категории, отчеты) и проходят через
+дерево обработчиков setup_handlers как в продакшене.
+
+Данные - во временной базе PostgreSQL, как в bench_database.py. В конце
+печатаются пропускная способность, задержка event loop и p50/p95/p99 по шагам.
+
+Пример:
+    python load_test.py --flows 2000 --rate 100 --mix add_expense=6,monthly_report=1,daily_report=2
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ExtBot
+from telegram.request import BaseRequest, RequestData
+
+from bench_database import (
+    BENCH_USER_BASE, create_database, drop_database, git_commit, prepare_schema, seed, summarize
+)
+from config import CATEGORIES, Config
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": 777000, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+
+# Сценарий - последовательность шагов одного пользователя: (метка, тип, данные)
+FLOWS = {
+    "add_expense": [
+        ("/add_expense", "command", "/add_expense"),
+        ("expense_amount", "text", "{amount}"),
+        ("category_callback", "callback", "category_{category}"),
+    ],
+    "daily_report": [("/daily_report", "command", "/daily_report")],
+    "weekly_report": [("/weekly_report", "command", "/weekly_report")],
+    "monthly_report": [("/monthly_report", "command", "/monthly_report")],
+    "detailed_report": [("/detailed_report", "command", "/detailed_report")],
+    "my_budgets": [("/my_budgets", "command", "/my_budgets")],
+    "savings_goals": [("/savings_goals", "command", "/savings_goals")],
+    "delete_last": [("/delete_last", "command", "/delete_last")],
+}
+DEFAULT_MIX = "add_expense=6,daily_report=2,monthly_report=1,detailed_report=1,my_budgets=1"
+
+
+class RecordingRequest(BaseRequest):
+    """Запрос к Bot API без сети: отвечает как Telegram и считает вызовы по методам"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None,
+                         pool_timeout=None) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data is not None else {}
+        return 200, json.dumps({"ok": True, "result": self._result(api_method, params)}).encode("utf-8")
+
+    def _result(self, api_method: str, params: Dict):
+        if api_method == "getMe":
+            return {**BOT_USER, "can_join_groups": True, "can_read_all_group_messages": False,
+                    "supports_inline_queries": False}
+        if api_method in ("sendMessage", "sendPhoto", "editMessageText"):
+            chat_id = params.get("chat_id", 0)
+            return {
+                "message_id": params.get("message_id") or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        return True
+
+
+class UpdateFactory:
+    """Синтетические Update от пользователей в личных чатах"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _message(self, user_id: int, text: str, from_user: Dict) -> Dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": from_user,
+            "text": text,
+        }
+
+    def build(self, user_id: int, kind: str, data: str) -> Update:
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        update_id = next(self._update_ids)
+        if kind == "callback":
+            payload = {
+                "update_id": update_id,
+                "callback_query": {
+                    "id": str(update_id),
+                    "from": user,
+                    "chat_instance": str(user_id),
+                    "data": data,
+                    "message": self._message(user_id, "Выберите категорию:", BOT_USER),
+                },
+            }
+        else:
+            message = self._message(user_id, data, user)
+            if kind == "command":
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(data.split()[0])}]
+            payload = {"update_id": update_id, "message": message}
+        return Update.de_json(payload, self.bot)
+
+
+class LoadTest:
+    """Подает сценарии в Application с заданной частотой и собирает задержки по шагам"""
+
+    def __init__(self, application, factory: UpdateFactory, users: List[int], rng: random.Random):
+        self.application = application
+        self.factory = factory
+        self.rng = rng
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self._pending: Dict[int, Tuple[str, asyncio.Future]] = {}
+        self._idle_users: asyncio.Queue = asyncio.Queue()
+        for user_id in users:
+            self._idle_users.put_nowait(user_id)
+
+        process_update = application.process_update
+
+        async def tracked_process_update(update):
+            try:
+                await process_update(update)
+            finally:
+                entry = self._pending.pop(update.update_id, None)
+                if entry is not None and not entry[1].done():
+                    entry[1].set_result(None)
+
+        application.process_update = tracked_process_update
+        application.add_error_handler(self._on_error)
+
+    async def _on_error(self, update, context) -> None:
+        entry = self._pending.get(getattr(update, "update_id", None))
+        label = entry[0] if entry else "unknown"
+        self.errors[label] += 1
+        logger.debug("Ошибка в шаге %s: %s", label, context.error)
+
+    async def send(self, label: str, update: Update, record: bool = True) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._pending[update.update_id] = (label, future)
+        started = time.perf_counter()
+        await self.application.update_queue.put(update)
+        await future
+        if record:
+            self.latencies[label].append(time.perf_counter() - started)
+
+    async def run_flow(self, name: str, record: bool = True) -> None:
+        # Один пользователь не ведет два сценария сразу: иначе диалоги перепутаются
+        user_id = await self._idle_users.get()
+        try:
+            values = {"amount": self.rng.choice(["150", "99.5", "1200"]), "category": self.rng.choice(CATEGORIES)}
+            for label, kind, template in FLOWS[name]:
+                update = self.factory.build(user_id, kind, template.format(**values))
+                await self.send(label, update, record)
+        finally:
+            self._idle_users.put_nowait(user_id)
+
+    async def run(self, mix: Dict[str, int], flows: int, rate: float) -> float:
+        """Открытая модель нагрузки: сценарии стартуют по расписанию, не дожидаясь предыдущих"""
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        tasks = []
+        started = time.perf_counter()
+        for i in range(flows):
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.run_flow(self.rng.choices(names, weights)[0])))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - started
+
+
+async def monitor_loop_lag(samples: List[float], stop: asyncio.Event, interval: float = 0.01) -> None:
+    """Насколько позже запланированного просыпается event loop"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - started - interval))
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in FLOWS:
+            raise argparse.ArgumentTypeError(f"неизвестный сценарий {name!r}; доступны: {', '.join(FLOWS)}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+async def run_load_test(args) -> Dict:
+    from bot import build_application
+    from outbound import OutboundDispatcher
+
+    # bot настраивает INFO-логи в консоль; на каждом апдейте они только мешают
+    logging.getLogger().setLevel(logging.WARNING)
+    request = RecordingRequest(latency=args.api_latency / 1000)
+    rate_limiter = OutboundDispatcher() if args.outbound_limits else None
+    bot = ExtBot(
+        token="123456:LOADTEST", request=request, get_updates_request=RecordingRequest(), rate_limiter=rate_limiter
+    )
+    application = build_application(bot=bot, scheduled_tasks=False)
+    users = [BENCH_USER_BASE + i for i in range(1, args.users + 1)]
+    load = LoadTest(application, UpdateFactory(bot), users, random.Random(42))
+
+    lag: List[float] = []
+    stop = asyncio.Event()
+    await application.initialize()
+    await application.start()
+    try:
+        # Прогрев: ленивые импорты (графики), кэши, пул соединений
+        for name in args.mix:
+            await load.run_flow(name, record=False)
+        request.calls.clear()
+
+        monitor = asyncio.create_task(monitor_loop_lag(lag, stop))
+        seconds = await load.run(args.mix, args.flows, args.rate)
+        stop.set()
+        await monitor
+    finally:
+        await application.stop()
+        await application.shutdown()
+        await application.post_shutdown(application)
+
+    steps = sum(len(samples) for samples in load.latencies.values())
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "flows": args.flows,
+            "rate": args.rate,
+            "users": args.users,
+            "mix": args.mix,
+            "api_latency_ms": args.api_latency,
+            "concurrent_updates": application.concurrent_updates,
+            "outbound_limits": args.outbound_limits,
+        },
+        "seconds": round(seconds, 3),
+        "updates_per_sec": round(steps / seconds, 1),
+        "flows_per_sec": round(args.flows / seconds, 1),
+        "loop_lag": summarize(lag) if lag else {},
+        "steps": {
+            label: {**summarize(samples), "errors": load.errors[label]}
+            for label, samples in sorted(load.latencies.items())
+        },
+        "errors": dict(load.errors),
+        "outgoing_calls": dict(request.calls),
+    }
+
+
+def print_report(report: Dict) -> None:
+    print(
+        f"Сценариев: {report['meta']['flows']} за {report['seconds']:.1f} с "
+        f"({report['flows_per_sec']} сценариев/с, {report['updates_per_sec']} апдейтов/с)"
+    )
+    lag = report["loop_lag"]
+    if lag:
+        print(f"Задержка event loop: p50 {lag['p50_ms']:.2f} ms, p99 {lag['p99_ms']:.2f} ms, max {lag['max_ms']:.2f} ms")
+    print(f"{'шаг':20} {'n':>7} {'ошибки':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for label, stats in report["steps"].items():
+        print(
+            f"{label:20} {stats['iterations']:>7} {stats['errors']:>7} {stats['p50_ms']:>9.2f} "
+            f"{stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['max_ms']:>9.2f}"
+        )
+    calls = ", ".join(f"{method}={count}" for method, count in sorted(report["outgoing_calls"].items()))
+    print(f"Исходящие вызовы Bot API: {calls}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест обработчиков бота на фейковом Bot API")
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL", Config.DATABASE_URL),
+                        help="сервер для временной базы (нужно право CREATE DATABASE)")
+    parser.add_argument("--rows", type=int, default=100000, help="строк в expenses перед тестом")
+    parser.add_argument("--users", type=int, default=200, help="синтетических пользователей (параллельных диалогов)")
+    parser.add_argument("--flows", type=int, default=1000, help="сколько сценариев запустить")
+    parser.add_argument("--rate", type=float, default=50, help="сценариев в секунду")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"веса сценариев (по умолчанию {DEFAULT_MIX})")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="имитация задержки Bot API, мс")
+    parser.add_argument("--concurrent-updates", type=int, default=Config.CONCURRENT_UPDATES,
+                        help="апдейтов одновременно (1 - последовательно, как раньше)")
+    parser.add_argument("--outbound-limits", action="store_true",
+                        help="пропускать ответы через OutboundDispatcher (лимиты Telegram на чат и бота)")
+    parser.add_argument("--output", help="записать результаты в JSON")
+    parser.add_argument("--keep", action="store_true", help="не удалять временную базу")
+    args = parser.parse_args()
+
+    Config.CONCURRENT_UPDATES = args.concurrent_updates
+
+    name = f"loadtest_{os.getpid()}"
+    bench_dsn = create_database(args.dsn, name)
+    os.environ["DATABASE_URL"] = bench_dsn
+
+    try:
+        prepare_schema(days=365)
+        seed(args.users, args.rows, days=365, reminders=0)
+        report = asyncio.run(run_load_test(args))
+    finally:
+        from db import close_pools
+        close_pools()
+        if args.keep:
+            print(f"Временная база оставлена: {bench_dsn}")
+        else:
+            drop_database(args.dsn, name)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ Результаты записаны в {args.output}")
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,419 @@
+"""
+Runtime metrics and profiling hooks for the bot.
+
+Keeps latency histograms for handlers, jobs, updates and database calls,
+query and error counters, and serves them in the Prometheus text format on
+a local /metrics endpoint. Optionally profiles slow updates (cProfile or a
+low-overhead stack sampler) and writes the profiles to Config.PROFILE_DIR.
+"""
+
+import cProfile
+import contextvars
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as _StackCounter, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, list] = {}  # labels -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {series[-2]}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_count{labels} {series[-2]}")
+                lines.append(f"{self.name}_sum{labels} {series[-1]}")
+        return lines
+
+
+REGISTRY: list = []
+# Один сборщик на имя: новый экземпляр диспетчера или процессора заменяет старый,
+# иначе одни и те же серии попали бы в выдачу дважды
+_collectors: Dict[str, Callable[[], Iterable[str]]] = {}
+_collectors_lock = threading.Lock()
+
+
+def register_collector(name: str, collector: Callable[[], Iterable[str]]) -> None:
+    """Set the callable returning extra exposition lines (gauges read on scrape) under name"""
+    with _collectors_lock:
+        _collectors[name] = collector
+
+
+def unregister_collector(name: str, collector: Callable[[], Iterable[str]]) -> None:
+    """Remove the collector registered under name if it is still this one"""
+    with _collectors_lock:
+        if _collectors.get(name) == collector:
+            del _collectors[name]
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    with _collectors_lock:
+        collectors = list(_collectors.values())
+    for collector in collectors:
+        try:
+            lines.extend(collector())
+        except Exception as e:
+            logger.warning(f"Metrics collector failed: {e}")
+    return "\n".join(lines) + "\n"
+
+
+# ========== BOT METRICS ==========
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Handler and job callback latency", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Exceptions raised by handlers and jobs", ["handler"])
+UPDATE_SECONDS = Histogram("bot_update_seconds", "Time to process one Telegram update")
+UPDATE_QUERIES = Histogram(
+    "bot_update_db_queries", "Database statements executed per update",
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55),
+)
+DB_CALL_SECONDS = Histogram("bot_db_call_seconds", "Latency of database.py functions", ["function"])
+DB_CALL_ERRORS = Counter("bot_db_call_errors_total", "Exceptions raised by database.py functions", ["function"])
+DB_QUERIES = Counter("bot_db_queries_total", "Database statements executed")
+DB_READ_ROUTES = Counter(
+    "bot_db_read_routes_total",
+    "Read-only connections by target (replica, pinned, fallback, primary; saturated - busy replica skipped)",
+    ["route"],
+)
+OUTBOUND_WAIT_SECONDS = Histogram(
+    "bot_outbound_wait_seconds", "Time a Bot API request waited for per-chat and global send limits", ["lane"]
+)
+OUTBOUND_RETRY_AFTER = Counter("bot_outbound_retry_after_total", "Flood-control answers (RetryAfter) from Telegram", ["lane"])
+
+# Счетчик запросов текущего апдейта; список, чтобы его видели потоки БД (copy_context)
+_update_queries: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("update_queries", default=None)
+
+
+def count_query() -> None:
+    """Called by the database cursor for every executed statement"""
+    DB_QUERIES.inc()
+    counter = _update_queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def instrument(callback: Callable, name: Optional[str] = None) -> Callable:
+    """Wrap an async handler/job callback with latency and error metrics"""
+    if getattr(callback, "_instrumented", False):
+        return callback
+    name = name or getattr(callback, "__name__", repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+
+    wrapper._instrumented = True
+    return wrapper
+
+
+def instrument_db_call(func: Callable) -> Callable:
+    """Wrap a blocking database.py function with latency and error metrics"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            DB_CALL_ERRORS.inc(function=name)
+            raise
+        finally:
+            DB_CALL_SECONDS.observe(time.perf_counter() - started, function=name)
+
+    return wrapper
+
+
+def instrument_handlers(application) -> None:
+    """Wrap the callbacks of every registered handler, including conversation states"""
+    def wrap(handler):
+        nested = []
+        if hasattr(handler, "entry_points"):
+            nested = list(handler.entry_points) + list(handler.fallbacks)
+            for state_handlers in handler.states.values():
+                nested.extend(state_handlers)
+        if nested:
+            for inner in nested:
+                wrap(inner)
+        elif hasattr(handler, "callback"):
+            handler.callback = instrument(handler.callback)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            wrap(handler)
+
+
+# ========== SLOW UPDATE PROFILING ==========
+
+class StackSampler:
+    """
+    Samples the stack of one thread at a fixed interval into a ring buffer.
+    Samples of a slow update are written as collapsed stacks (flamegraph input).
+    """
+
+    def __init__(self, thread_id: int, interval: float, max_samples: int = 100000):
+        self.thread_id = thread_id
+        self.interval = interval
+        self._samples: deque = deque(maxlen=max_samples)  # (timestamp, stack)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = ";".join(
+                f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})"
+                for entry in traceback.extract_stack(frame)
+            )
+            self._samples.append((time.perf_counter(), stack))
+
+    def collapsed(self, started: float, finished: float) -> str:
+        counts = _StackCounter(stack for ts, stack in list(self._samples) if started <= ts <= finished)
+        return "\n".join(f"{stack} {count}" for stack, count in counts.most_common()) + "\n"
+
+
+class SlowUpdateProfiler:
+    """Keeps profiles of updates slower than Config.PROFILE_SLOW_UPDATE_SECONDS"""
+
+    def __init__(self, mode: str, threshold: float, directory: str, sample_interval: float):
+        self.mode = mode
+        self.threshold = threshold
+        self.directory = directory
+        self._busy = threading.Lock()  # cProfile может профилировать один апдейт за раз
+        self._sampler: Optional[StackSampler] = None
+        if mode == "sample":
+            self._sampler = StackSampler(threading.get_ident(), sample_interval)
+            self._sampler.start()
+
+    def _path(self, update_id, extension: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f"update-{int(time.time())}-{update_id}.{extension}")
+
+    async def run(self, coro_func, update):
+        update_id = getattr(update, "update_id", "job")
+        started = time.perf_counter()
+
+        if self.mode == "cprofile" and self._busy.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                try:
+                    return await coro_func(update)
+                finally:
+                    profiler.disable()
+                    if time.perf_counter() - started >= self.threshold:
+                        path = self._path(update_id, "prof")
+                        profiler.dump_stats(path)
+                        logger.warning(f"Slow update {update_id}: profile written to {path}")
+            finally:
+                self._busy.release()
+
+        try:
+            return await coro_func(update)
+        finally:
+            finished = time.perf_counter()
+            if self._sampler is not None and finished - started >= self.threshold:
+                path = self._path(update_id, "folded")
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(self._sampler.collapsed(started, finished))
+                logger.warning(f"Slow update {update_id}: stack samples written to {path}")
+
+
+_profiler: Optional[SlowUpdateProfiler] = None
+
+
+def get_profiler() -> Optional[SlowUpdateProfiler]:
+    """Profiler configured by PROFILE_MODE (created in the event loop thread on first use)"""
+    global _profiler
+    if _profiler is None and Config.PROFILE_MODE in ("cprofile", "sample"):
+        _profiler = SlowUpdateProfiler(
+            Config.PROFILE_MODE,
+            Config.PROFILE_SLOW_UPDATE_SECONDS,
+            Config.PROFILE_DIR,
+            Config.PROFILE_SAMPLE_INTERVAL,
+        )
+    return _profiler
+
+
+async def observe_update(process: Callable, update) -> None:
+    """Run process(update) recording latency, query count and (optionally) a profile"""
+    counter = [0]
+    token = _update_queries.set(counter)
+    started = time.perf_counter()
+    try:
+        profiler = get_profiler()
+        if profiler is not None:
+            await profiler.run(process, update)
+        else:
+            await process(update)
+    finally:
+        UPDATE_SECONDS.observe(time.perf_counter() - started)
+        UPDATE_QUERIES.observe(counter[0])
+        _update_queries.reset(token)
+
+
+# ========== /metrics ENDPOINT ==========
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # скрейпы Prometheus не пишем в лог
+
+
+_server: Optional[ThreadingHTTPServer] = None
+
+
+def start_metrics_server(host: Optional[str] = None, port: Optional[int] = None) -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics on a daemon thread (METRICS_PORT=0 disables it)"""
+    global _server
+    host = host or Config.METRICS_HOST
+    port = Config.METRICS_PORT if port is None else port
+    if _server is not None or not port:
+        return _server
+
+    _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return _server
+
+
+def stop_metrics_server() -> None:
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+
+
+def resource_gauges() -> List[str]:
+    """Connection pool and cache gauges, read on every scrape"""
+    from cache import cache_stats
+    from db import get_pool
+
+    lines = ["# TYPE bot_db_pool_connections gauge"]
+    for key, value in get_pool().stats().items():
+        lines.append(f'bot_db_pool_connections{{state="{key}"}} {value}')
+
+    lines.append("# TYPE bot_cache_events_total counter")
+    for name, stats in cache_stats().items():
+        for event in ("hits", "misses", "evictions"):
+            lines.append(f'bot_cache_events_total{{cache="{name}",event="{event}"}} {stats[event]}')
+    return lines
+
+
+register_collector("resources", resource_gauges)
@@ -0,0 +1,308 @@
+"""
+Outbound message delivery.
+OutboundDispatcher is the bot's rate limiter: every request that targets a chat
+passes a per-chat token bucket (Telegram allows about one message per second
+in a private chat and 20 per minute in a group) and then the global bucket
+(about 30 messages per second per bot). Interactive replies use the high
+priority lane and get both the chat's and the bot's next token before queued
+bulk sends from scheduled jobs.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Coroutine, Deque, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import Config
+from metrics import OUTBOUND_RETRY_AFTER, OUTBOUND_WAIT_SECONDS, register_collector, unregister_collector
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Async token bucket: at most `rate` acquisitions per second, bursts up to `burst`"""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Seconds Telegram asked us to wait (int or timedelta depending on PTB version)"""
+    value = error.retry_after
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+# ========== DISPATCHER ==========
+
+PRIORITY_HIGH = "high"  # ответы на действия пользователя
+PRIORITY_LOW = "low"  # рассылки из запланированных задач
+LANES = (PRIORITY_HIGH, PRIORITY_LOW)
+
+CHAT_BUCKET_IDLE_SECONDS = 60  # корзины чатов, простаивающие дольше, удаляются
+
+
+class PriorityRateLimiter:
+    """
+    Token bucket whose waiters are served lane by lane: a token goes to the
+    first lane of LANES that has someone waiting, FIFO within a lane.
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._queues: Dict[str, Deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def acquire(self, lane: str = PRIORITY_HIGH) -> None:
+        self._refill()
+        if self._tokens >= 1 and not self.waiting() and self._paused_until <= self._updated:
+            self._tokens -= 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues[lane].append(waiter)
+        self._schedule()
+        await waiter
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no tokens for the next `seconds` (after RetryAfter)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def waiting(self, lane: Optional[str] = None) -> int:
+        lanes = LANES if lane is None else (lane,)
+        return sum(1 for name in lanes for waiter in self._queues[name] if not waiter.done())
+
+    def idle_for(self, now: float) -> float:
+        """Seconds since the last acquisition (0 while someone is waiting)"""
+        return 0.0 if self.waiting() else now - self._updated
+
+    def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for queue in self._queues.values():
+            while queue:
+                queue.popleft().cancel()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _grant(self) -> None:
+        self._timer = None
+        self._refill()
+        if self._paused_until <= self._updated:
+            # Токен достается высокому приоритету, даже если он пришел, пока мы ждали
+            while self._tokens >= 1:
+                waiter = self._next_waiter()
+                if waiter is None:
+                    break
+                waiter.set_result(None)
+                self._tokens -= 1
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self._timer is not None or not self.waiting():
+            return
+        delay = max((1 - self._tokens) / self.rate, self._paused_until - time.monotonic(), 0)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._grant)
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        for lane in LANES:
+            queue = self._queues[lane]
+            while queue:
+                waiter = queue.popleft()
+                if not waiter.done():
+                    return waiter
+        return None
+
+
+class OutboundDispatcher(BaseRateLimiter[Dict[str, Any]]):
+    """
+    Central limiter for all Bot API calls of the application.
+
+    Requests pass rate_limit_args={"priority": PRIORITY_LOW} to queue behind
+    interactive traffic, both in their chat and for the bot's global budget;
+    anything without it is high priority. Requests
+    without a chat_id (answerCallbackQuery, getMe...) are not limited.
+    After RetryAfter every lane is paused for the requested time and the
+    request is retried up to max_retries times.
+
+    Args:
+        global_rate: Messages per second for the whole bot
+        chat_rate: Messages per second in one private chat
+        group_rate_per_minute: Messages per minute in one group chat
+        chat_burst: Messages a chat may receive back to back
+        max_retries: Retries after RetryAfter before the error is raised
+    """
+
+    def __init__(
+        self,
+        global_rate: Optional[float] = None,
+        chat_rate: Optional[float] = None,
+        group_rate_per_minute: Optional[float] = None,
+        chat_burst: Optional[int] = None,
+        max_retries: Optional[int] = None,
+    ):
+        self.global_rate = global_rate or Config.OUTBOUND_GLOBAL_RATE
+        self.chat_rate = chat_rate or Config.OUTBOUND_CHAT_RATE
+        self.group_rate = (group_rate_per_minute or Config.OUTBOUND_GROUP_RATE_PER_MINUTE) / 60
+        self.chat_burst = chat_burst or Config.OUTBOUND_CHAT_BURST
+        self.max_retries = Config.OUTBOUND_MAX_RETRIES if max_retries is None else max_retries
+        self._global = PriorityRateLimiter(self.global_rate)
+        self._chats: Dict[Hashable, PriorityRateLimiter] = {}
+        self._chats_pruned = time.monotonic()
+        register_collector("outbound", self.gauges)
+
+    async def initialize(self) -> None:
+        logger.info(
+            f"Outbound limits: {self.global_rate}/s per bot, {self.chat_rate}/s per chat, "
+            f"{self.group_rate * 60:g}/min per group"
+        )
+
+    async def shutdown(self) -> None:
+        unregister_collector("outbound", self.gauges)
+        self._global.close()
+        for bucket in self._chats.values():
+            bucket.close()
+        self._chats.clear()
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Any:
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+
+        lane = (rate_limit_args or {}).get("priority", PRIORITY_HIGH)
+        if lane not in LANES:
+            lane = PRIORITY_HIGH
+        started = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            await self._chat_bucket(chat_id).acquire(lane)
+            await self._global.acquire(lane)
+            if attempt == 0:
+                OUTBOUND_WAIT_SECONDS.observe(time.monotonic() - started, lane=lane)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                delay = retry_after_seconds(e)
+                OUTBOUND_RETRY_AFTER.inc(lane=lane)
+                if attempt == self.max_retries:
+                    raise
+                # Флуд-контроль касается всего бота: притормаживаем обе очереди
+                self._global.pause(delay)
+                logger.warning(f"Flood control on {endpoint} for chat {chat_id}, retrying in {delay}s")
+                await asyncio.sleep(delay)
+
+    def _chat_bucket(self, chat_id: Hashable) -> PriorityRateLimiter:
+        now = time.monotonic()
+        if now - self._chats_pruned > CHAT_BUCKET_IDLE_SECONDS:
+            self._chats_pruned = now
+            for key in [key for key, bucket in self._chats.items() if bucket.idle_for(now) > CHAT_BUCKET_IDLE_SECONDS]:
+                del self._chats[key]
+
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательный id - группа или канал с более строгим лимитом
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            bucket = self._chats[chat_id] = PriorityRateLimiter(rate, self.chat_burst)
+        return bucket
+
+    def queue_depth(self, lane: Optional[str] = None) -> int:
+        """Requests waiting for a global token (in one lane or in all of them)"""
+        return self._global.waiting(lane)
+
+    def gauges(self) -> List[str]:
+        """Queue depth per lane and chat-limited requests, read on every scrape"""
+        lines = ["# TYPE bot_outbound_queue_depth gauge"]
+        lines.extend(f'bot_outbound_queue_depth{{lane="{lane}"}} {self.queue_depth(lane)}' for lane in LANES)
+        lines.extend([
+            "# TYPE bot_outbound_chat_waiting gauge",
+            f"bot_outbound_chat_waiting {sum(bucket.waiting() for bucket in list(self._chats.values()))}",
+            "# TYPE bot_outbound_chat_buckets gauge",
+            f"bot_outbound_chat_buckets {len(self._chats)}",
+        ])
+        return lines
+
+
+async def send_bulk_messages(
+    bot,
+    messages: Iterable[Tuple[int, str]],
+    concurrency: Optional[int] = None,
+    rate: Optional[float] = None,
+    max_retries: Optional[int] = None,
+) -> Tuple[int, int]:
+    """
+    Send (chat_id, text) pairs concurrently with bounded parallelism.
+    With an OutboundDispatcher on the bot, limits and retries are left to it
+    and the messages go through its low priority lane; otherwise they are
+    paced at OUTBOUND_GLOBAL_RATE and retried OUTBOUND_MAX_RETRIES times
+    after RetryAfter, the same budget the dispatcher would apply.
+
+    Returns:
+        Tuple of (sent, failed) message counts
+    """
+    concurrency = concurrency or Config.BULK_SEND_CONCURRENCY
+    semaphore = asyncio.Semaphore(concurrency)
+    if isinstance(getattr(bot, "rate_limiter", None), OutboundDispatcher):
+        limiter = None
+        max_retries = 0
+        send_kwargs = {"rate_limit_args": {"priority": PRIORITY_LOW}}
+    else:
+        limiter = RateLimiter(rate or Config.OUTBOUND_GLOBAL_RATE)
+        max_retries = Config.OUTBOUND_MAX_RETRIES if max_retries is None else max_retries
+        send_kwargs = {}
+
+    async def deliver(chat_id: int, text: str) -> bool:
+        async with semaphore:
+            for attempt in range(max_retries + 1):
+                if limiter is not None:
+                    await limiter.acquire()
+                try:
+                    await bot.send_message(chat_id=chat_id, text=text, **send_kwargs)
+                    return True
+                except RetryAfter as e:
+                    delay = retry_after_seconds(e)
+                    if attempt == max_retries:
+                        logger.error(f"Giving up on chat {chat_id} after {attempt + 1} attempts (flood control)")
+                        return False
+                    logger.warning(f"Flood control for chat {chat_id}, retrying in {delay}s")
+                    await asyncio.sleep(delay)
+                except Exception as e:
+                    logger.error(f"Error sending message to chat {chat_id}: {e}")
+                    return False
+            return False
+
+    results = await asyncio.gather(*(deliver(chat_id, text) for chat_id, text in messages))
+    sent = sum(1 for ok in results if ok)
+    return sent, len(results) - sent
@@ -0,0 +1,317 @@
+"""
+PostgreSQL persistence for bot replicas.
+Stores user_data, chat_data, bot_data and ConversationHandler states in the
+bot_persistence table so several bot processes behind one webhook can serve
+the same users without losing mid-flow state.
+
+Reads are lazy: before an update is processed, prefetch() loads only the rows
+for that update's user, chat and conversation keys whose version is newer than
+what this process already holds. Writes are coalesced: changes of all updates
+finished within BOT_PERSISTENCE_FLUSH_DELAY are upserted in a single
+statement, unchanged entries are skipped. A row is only overwritten at the
+version this process loaded; if another replica got there first, its state is
+re-read and wins.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from psycopg2.extras import execute_values
+from telegram import Update
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+
+from database_async import run_in_db_thread
+from db import get_connection
+
+logger = logging.getLogger(__name__)
+
+USER_DATA = "user_data"
+CHAT_DATA = "chat_data"
+BOT_DATA = "bot_data"
+CONVERSATION_PREFIX = "conversation:"
+
+StateKey = Tuple[str, str]
+
+
+def _dump(data: Any) -> Optional[str]:
+    return None if data is None else json.dumps(data, ensure_ascii=False, sort_keys=True)
+
+
+def _conversation_key(key: Tuple) -> str:
+    return json.dumps(list(key))
+
+
+def fetch_rows(keys: List[StateKey]) -> List[Dict]:
+    """Rows of bot_persistence for the given (namespace, key) pairs"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT namespace, key, data, version FROM bot_persistence WHERE (namespace, key) IN %s",
+            (tuple(keys),),
+        )
+        return cursor.fetchall()
+
+
+def write_rows(rows: List[Tuple[str, str, Optional[str], int]]) -> List[Dict]:
+    """
+    Upsert (namespace, key, json, new version) rows in one statement.
+    An existing row is updated only if it is still at new version - 1;
+    returns the rows that were written.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            result = execute_values(
+                cursor,
+                """
+                INSERT INTO bot_persistence AS p (namespace, key, data, version)
+                VALUES %s
+                ON CONFLICT (namespace, key) DO UPDATE
+                SET data = EXCLUDED.data, version = EXCLUDED.version, updated_at = now()
+                WHERE p.version = EXCLUDED.version - 1
+                RETURNING namespace, key, version
+                """,
+                rows,
+                template="(%s, %s, %s::jsonb, %s)",
+                fetch=True,
+            )
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+
+
+class SharedConversationHandler(ConversationHandler):
+    """ConversationHandler whose states PostgresPersistence can refresh with other replicas' writes"""
+
+    # Живые словари состояний PTB отдает только из защищенного _initialize_persistence
+    # (его вызывает Application.initialize): get_conversations() их лишь заполняет.
+    # Поэтому версия PTB закреплена в requirements.txt, а tests/test_persistence.py
+    # падает, если хук переименуют или он перестанет возвращать эти словари.
+    async def _initialize_persistence(self, application) -> Dict[str, Any]:
+        conversations = await super()._initialize_persistence(application)
+        if isinstance(application.persistence, PostgresPersistence):
+            application.persistence.track_conversations(conversations)
+        return conversations
+
+
+class PostgresPersistence(BasePersistence[Dict, Dict, Dict]):
+    """BasePersistence backed by the bot_persistence table with a read-through, write-coalescing layer"""
+
+    def __init__(self, update_interval: float = 60):
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self._versions: Dict[StateKey, int] = {}
+        self._written: Dict[StateKey, Optional[str]] = {}
+        self._fetched: Dict[StateKey, Optional[Dict]] = {}
+        self._pending: Dict[StateKey, Optional[str]] = {}
+        self._write_lock = asyncio.Lock()
+        self._next_write: Optional[asyncio.Future] = None
+        self._conversation_handlers: Optional[List[ConversationHandler]] = None
+        # Словари состояний диалогов по имени; их передает SharedConversationHandler
+        self._conversations: Dict[str, Dict] = {}
+
+    # ========== READ-THROUGH ==========
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        # Ничего не грузим при старте: данные подтягиваются в prefetch() по мере апдейтов
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def get_bot_data(self) -> Dict:
+        rows = await run_in_db_thread(fetch_rows, [(BOT_DATA, "")])
+        for row in rows:
+            self._remember(row)
+            return row["data"] or {}
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        return {}
+
+    def track_conversations(self, conversations: Dict[str, Dict]) -> None:
+        """Remember the live state dicts of persistent conversations so prefetch() can update them"""
+        self._conversations.update(conversations)
+
+    def _persistent_conversations(self, application) -> List[ConversationHandler]:
+        if self._conversation_handlers is None:
+            self._conversation_handlers = [
+                handler
+                for handlers in application.handlers.values()
+                for handler in handlers
+                if isinstance(handler, ConversationHandler) and handler.persistent
+                and handler.name in self._conversations
+            ]
+        return self._conversation_handlers
+
+    @staticmethod
+    def _handler_key(handler: ConversationHandler, update: Update) -> Optional[Tuple]:
+        key: List[Hashable] = []
+        if handler.per_chat:
+            if update.effective_chat is None:
+                return None
+            key.append(update.effective_chat.id)
+        if handler.per_user:
+            if update.effective_user is None:
+                return None
+            key.append(update.effective_user.id)
+        if handler.per_message:
+            return None
+        return tuple(key)
+
+    async def prefetch(self, application, update: object) -> None:
+        """Load newer state of this update's user, chat and conversations written by other replicas"""
+        if not isinstance(update, Update):
+            return
+
+        keys: List[StateKey] = []
+        if update.effective_user is not None:
+            keys.append((USER_DATA, str(update.effective_user.id)))
+        if update.effective_chat is not None:
+            keys.append((CHAT_DATA, str(update.effective_chat.id)))
+        for handler in self._persistent_conversations(application):
+            key = self._handler_key(handler, update)
+            if key is not None:
+                keys.append((CONVERSATION_PREFIX + handler.name, _conversation_key(key)))
+        if not keys:
+            return
+
+        for row in await run_in_db_thread(fetch_rows, keys):
+            if row["version"] > self._versions.get((row["namespace"], row["key"]), 0):
+                self._apply_row(row)
+
+    def _apply_row(self, row: Dict) -> None:
+        """Take over a row written by another replica; it replaces any local unsaved change"""
+        state_key = (row["namespace"], row["key"])
+        self._remember(row)
+        self._pending.pop(state_key, None)
+        if not row["namespace"].startswith(CONVERSATION_PREFIX):
+            self._fetched[state_key] = row["data"]
+            return
+
+        states = self._conversations.get(row["namespace"][len(CONVERSATION_PREFIX):])
+        if states is None:
+            return
+        key = tuple(json.loads(row["key"]))
+        if row["data"] is None:
+            states.data.pop(key, None)  # без пометки на запись: удаление уже в БД
+        else:
+            states.update_no_track({key: row["data"]})
+
+    def _remember(self, row: Dict) -> None:
+        state_key = (row["namespace"], row["key"])
+        self._versions[state_key] = row["version"]
+        self._written[state_key] = _dump(row["data"])
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        self._apply_fetched((USER_DATA, str(user_id)), user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        self._apply_fetched((CHAT_DATA, str(chat_id)), chat_data)
+
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        self._apply_fetched((BOT_DATA, ""), bot_data)
+
+    def _apply_fetched(self, state_key: StateKey, target: Dict) -> None:
+        if state_key in self._fetched:
+            data = self._fetched.pop(state_key)
+            target.clear()
+            target.update(data or {})
+
+    # ========== WRITE COALESCING ==========
+
+    def _stage(self, state_key: StateKey, data: Any) -> None:
+        payload = _dump(data)
+        if state_key in self._versions:
+            unchanged = self._written[state_key] == payload
+        else:
+            unchanged = payload in (None, "{}")  # пустые данные новых пользователей не пишем
+        if unchanged:
+            self._pending.pop(state_key, None)
+        else:
+            self._pending[state_key] = payload
+
+    async def update_user_data(self, user_id: int, data: Dict) -> None:
+        self._stage((USER_DATA, str(user_id)), data)
+
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        self._stage((CHAT_DATA, str(chat_id)), data)
+
+    async def update_bot_data(self, data: Dict) -> None:
+        self._stage((BOT_DATA, ""), data)
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]) -> None:
+        self._stage((CONVERSATION_PREFIX + name, _conversation_key(key)), new_state)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stage((USER_DATA, str(user_id)), None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._stage((CHAT_DATA, str(chat_id)), None)
+
+    async def write_pending(self) -> None:
+        """Write staged changes; callers arriving during a write share the next single upsert"""
+        if not self._pending and self._next_write is None:
+            return
+        if self._next_write is None:
+            self._next_write = asyncio.ensure_future(self._write_batch())
+        await asyncio.shield(self._next_write)
+
+    async def _write_batch(self) -> None:
+        async with self._write_lock:
+            # Дальнейшие изменения уйдут следующей пачкой
+            self._next_write = None
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            rows = [
+                (namespace, key, payload, self._versions.get((namespace, key), 0) + 1)
+                for (namespace, key), payload in pending.items()
+            ]
+            try:
+                result = await run_in_db_thread(write_rows, rows)
+            except Exception as e:
+                # Вернем в очередь то, что не успели перезаписать более новые данные
+                for state_key, payload in pending.items():
+                    self._pending.setdefault(state_key, payload)
+                logger.error(f"Failed to write bot persistence ({len(rows)} rows): {e}")
+                return
+
+            for row in result:
+                state_key = (row["namespace"], row["key"])
+                self._versions[state_key] = row["version"]
+                self._written[state_key] = pending.pop(state_key)
+
+            if pending:
+                await self._resolve_conflicts(pending)
+
+    async def _resolve_conflicts(self, pending: Dict[StateKey, Optional[str]]) -> None:
+        """Rows another replica changed since we loaded them: re-read them, their state wins"""
+        logger.warning(f"Bot persistence changed by another replica ({len(pending)} rows), reloading")
+        try:
+            rows = await run_in_db_thread(fetch_rows, list(pending))
+        except Exception as e:
+            for state_key, payload in pending.items():
+                self._pending.setdefault(state_key, payload)
+            logger.error(f"Failed to reload bot persistence ({len(pending)} rows): {e}")
+            return
+
+        for row in rows:
+            self._apply_row(row)
+            pending.pop((row["namespace"], row["key"]))
+        # Строки исчезли из таблицы: следующей пачкой вставим их заново
+        for state_key, payload in pending.items():
+            self._versions.pop(state_key, None)
+            self._pending.setdefault(state_key, payload)
+
+    async def flush(self) -> None:
+        await self.write_pending()
@@ -0,0 +1,72 @@
+"""TTL expiry, LRU eviction and invalidation of cache.TTLCache."""
+
+import cache
+from cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(monkeypatch, maxsize=3, ttl=10.0):
+    clock = FakeClock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return TTLCache("test", maxsize=maxsize, ttl=ttl), clock
+
+
+def test_entry_expires_after_ttl(monkeypatch):
+    c, clock = make_cache(monkeypatch)
+    c.set("a", 1)
+    clock.now += 9.9
+    assert c.get("a") == 1
+    clock.now += 0.2
+    assert c.get("a", "missing") == "missing"
+    assert c.stats() == {"size": 0, "hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_least_recently_used_entry_is_evicted(monkeypatch):
+    c, _ = make_cache(monkeypatch, maxsize=2)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1  # "b" становится самым старым
+    c.set("c", 3)
+    assert c.get("b") is None
+    assert c.get("a") == 1
+    assert c.get("c") == 3
+    assert c.stats()["evictions"] == 1
+
+
+def test_get_or_load_caches_loader_result(monkeypatch):
+    c, _ = make_cache(monkeypatch)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return "value"
+
+    assert c.get_or_load("k", loader) == "value"
+    assert c.get_or_load("k", loader) == "value"
+    assert len(calls) == 1
+
+
+def test_value_loaded_during_invalidation_is_not_stored(monkeypatch):
+    c, _ = make_cache(monkeypatch)
+
+    def loader():
+        c.invalidate("k")  # запись изменилась, пока грузили старое значение
+        return "stale"
+
+    assert c.get_or_load("k", loader) == "stale"
+    assert c.get("k") is None
+
+
+def test_invalidate_without_key_clears_everything(monkeypatch):
+    c, _ = make_cache(monkeypatch)
+    c.set("a", 1)
+    c.set("b", 2)
+    c.invalidate()
+    assert c.stats()["size"] == 0
@@ -0,0 +1,74 @@
+"""Bookkeeping of local expense writes around the monthly summary refresh."""
+
+from contextlib import contextmanager
+
+import psycopg2
+import pytest
+
+import database
+
+
+class FakeConnection:
+    def __init__(self, on_execute=None):
+        self.on_execute = on_execute
+        self.committed = False
+        self.rolled_back = False
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        if self.on_execute is not None:
+            self.on_execute(sql)
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    monkeypatch.setattr(database.Config, "MONTHLY_SUMMARY_REFRESH_WRITES", 0)
+    monkeypatch.setattr(database, "_expense_writes", 0)
+
+    def connect(conn):
+        @contextmanager
+        def get_connection():
+            yield conn
+        monkeypatch.setattr(database, "get_connection", get_connection)
+        return conn
+    return connect
+
+
+def test_successful_refresh_makes_summaries_usable(writes):
+    writes(FakeConnection())
+    database._note_expense_writes(3)
+    assert not database._summary_usable()
+    assert database.refresh_monthly_summaries()
+    assert database._summary_usable()
+
+
+def test_failed_refresh_keeps_summaries_bypassed(writes):
+    def fail(sql):
+        raise psycopg2.OperationalError("canceling statement due to statement timeout")
+
+    conn = writes(FakeConnection(fail))
+    database._note_expense_writes()
+    with pytest.raises(psycopg2.OperationalError):
+        database.refresh_monthly_summaries()
+    assert conn.rolled_back
+    assert not database._summary_usable()
+
+
+def test_writes_made_during_refresh_are_still_counted(writes):
+    def write_once(sql):
+        if sql.startswith("REFRESH"):
+            database._note_expense_writes()
+
+    writes(FakeConnection(write_once))
+    database._note_expense_writes(2)
+    assert database.refresh_monthly_summaries()
+    assert database._expense_writes == len(database.MONTHLY_SUMMARY_VIEWS)
+    assert not database._summary_usable()
@@ -0,0 +1,106 @@
+"""The bounded thread-pool executor behind database_async."""
+
+import asyncio
+import contextvars
+import inspect
+import threading
+import time
+
+import pytest
+
+import database_async
+from metrics import DB_CALL_ERRORS, DB_CALL_SECONDS
+
+request_user = contextvars.ContextVar("request_user", default=None)
+
+
+@pytest.fixture(autouse=True)
+def executor(monkeypatch):
+    database_async.shutdown_executor()
+    monkeypatch.setattr(database_async.Config, "DB_EXECUTOR_WORKERS", 2)
+    yield
+    database_async.shutdown_executor()
+
+
+def test_executor_is_shared_and_sized_from_config():
+    first = database_async.get_executor()
+    assert database_async.get_executor() is first
+    assert first._max_workers == 2
+    database_async.shutdown_executor()
+    assert database_async.get_executor() is not first
+
+
+def test_call_runs_on_a_db_thread_with_arguments():
+    def query(a, b, scale=1):
+        return threading.current_thread().name, (a + b) * scale
+
+    thread_name, result = asyncio.run(database_async.run_in_db_thread(query, 1, 2, scale=10))
+    assert thread_name.startswith("db")
+    assert thread_name != threading.current_thread().name
+    assert result == 30
+
+
+def test_context_variables_are_visible_in_the_call():
+    async def scenario():
+        request_user.set(42)
+        return await database_async.run_in_db_thread(request_user.get)
+
+    assert asyncio.run(scenario()) == 42
+
+
+def test_event_loop_keeps_running_during_a_blocking_call():
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        await database_async.run_in_db_thread(time.sleep, 0.2)
+        task.cancel()
+        return ticks
+
+    assert asyncio.run(scenario()) >= 5
+
+
+def test_concurrency_is_bounded_by_the_worker_count():
+    lock = threading.Lock()
+    running = 0
+    peak = 0
+
+    def slow_query():
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+
+    async def scenario():
+        await asyncio.gather(*(database_async.run_in_db_thread(slow_query) for _ in range(6)))
+
+    asyncio.run(scenario())
+    assert peak == 2
+
+
+def test_offloaded_function_keeps_name_and_records_metrics():
+    def failing_lookup(user_id):
+        raise LookupError(user_id)
+
+    def lookup(user_id):
+        return f"user {user_id}"
+
+    offloaded_failure = database_async._offload(failing_lookup)
+    offloaded = database_async._offload(lookup)
+    assert offloaded.__name__ == "lookup"
+    assert inspect.iscoroutinefunction(offloaded)
+
+    assert asyncio.run(offloaded(7)) == "user 7"
+    with pytest.raises(LookupError):
+        asyncio.run(offloaded_failure(7))
+    assert 'bot_db_call_errors_total{function="failing_lookup"} 1' in DB_CALL_ERRORS.collect()
+    assert 'bot_db_call_seconds_count{function="lookup"} 1' in DB_CALL_SECONDS.collect()
@@ -0,0 +1,191 @@
+"""Prepared query rewriting and replica routing of read-only connections in db.py."""
+
+import time
+from contextlib import contextmanager
+from unittest.mock import patch
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+import db
+
+
+class FakeConnection:
+    closed = 0
+
+
+class BusyPool:
+    def getconn(self, timeout=None):
+        raise db.PoolTimeout("all connections are busy")
+
+
+class BrokenPool:
+    def getconn(self, timeout=None):
+        raise psycopg2.OperationalError("connection refused")
+
+
+class HealthyPool:
+    def __init__(self):
+        self.conn = FakeConnection()
+        self.timeouts = []
+        self.returned = []
+
+    def getconn(self, timeout=None):
+        self.timeouts.append(timeout)
+        return self.conn
+
+    def putconn(self, conn, discard=False):
+        self.returned.append((conn, discard))
+
+
+def routed(router, pools):
+    return patch.object(db, "get_router", lambda: router), patch.object(db, "get_pool", pools.get)
+
+
+def test_full_pool_gives_up_after_the_requested_timeout(monkeypatch):
+    pool = db.ConnectionPool("postgresql://unused", min_size=0, max_size=1, timeout=30)
+    monkeypatch.setattr(pool, "_connect", FakeConnection)
+    pool.getconn()
+    started = time.monotonic()
+    with pytest.raises(db.PoolTimeout):
+        pool.getconn(timeout=0)
+    assert time.monotonic() - started < 1
+
+
+def test_replica_checkout_does_not_wait_the_pool_timeout(monkeypatch):
+    monkeypatch.setattr(db.Config, "DB_REPLICA_POOL_TIMEOUT", 0.1)
+    router = db.ReplicaRouter(["healthy"])
+    healthy = HealthyPool()
+    get_router, get_pool = routed(router, {"healthy": healthy})
+    with get_router, get_pool:
+        with db.get_read_connection():
+            pass
+    assert healthy.timeouts == [0.1]
+
+
+def test_saturated_replica_is_skipped_without_marking_it_down():
+    router = db.ReplicaRouter(["busy", "healthy"])
+    healthy = HealthyPool()
+    pools = {"busy": BusyPool(), "healthy": healthy}
+    get_router, get_pool = routed(router, pools)
+    with get_router, get_pool:
+        with db.get_read_connection() as conn:
+            assert conn is healthy.conn
+    assert router._down_until == {}
+    assert healthy.returned == [(healthy.conn, False)]
+
+
+def test_unreachable_replica_is_marked_down():
+    router = db.ReplicaRouter(["broken", "healthy"])
+    healthy = HealthyPool()
+    get_router, get_pool = routed(router, {"broken": BrokenPool(), "healthy": healthy})
+    with get_router, get_pool:
+        with db.get_read_connection() as conn:
+            assert conn is healthy.conn
+    assert router.candidates() == ["healthy"]
+
+
+def test_failed_query_discards_the_connection_but_keeps_the_replica():
+    router = db.ReplicaRouter(["healthy"])
+    healthy = HealthyPool()
+    get_router, get_pool = routed(router, {"healthy": healthy})
+    with get_router, get_pool, pytest.raises(psycopg2.extensions.QueryCanceledError):
+        with db.get_read_connection():
+            raise psycopg2.extensions.QueryCanceledError("canceling statement due to statement timeout")
+    assert healthy.returned == [(healthy.conn, True)]
+    assert router.candidates() == ["healthy"]
+
+
+def test_lost_connection_marks_the_replica_down():
+    router = db.ReplicaRouter(["healthy"])
+    healthy = HealthyPool()
+    get_router, get_pool = routed(router, {"healthy": healthy})
+    with get_router, get_pool, pytest.raises(psycopg2.OperationalError):
+        with db.get_read_connection() as conn:
+            conn.closed = 2
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+    assert healthy.returned == [(healthy.conn, True)]
+    assert router.candidates() == []
+
+
+@contextmanager
+def primary_connection():
+    yield "primary-connection"
+
+
+def test_pinned_user_reads_from_primary():
+    router = db.ReplicaRouter(["healthy"])
+    router.pin(42)
+    with patch.object(db, "get_router", lambda: router), \
+            patch.object(db, "get_pool", lambda dsn: pytest.fail("replica used")), \
+            patch.object(db, "get_connection", primary_connection):
+        with db.acting_user(42), db.get_read_connection() as conn:
+            assert conn == "primary-connection"
+
+
+def test_positional_placeholders_are_numbered():
+    query = db.PreparedQuery("q_pos", "SELECT * FROM expenses WHERE user_id = %s AND date >= %s")
+    assert query.prepare_sql == "PREPARE q_pos AS SELECT * FROM expenses WHERE user_id = $1 AND date >= $2"
+    assert query.execute_sql == "EXECUTE q_pos (%s, %s)"
+    assert query.arguments((1, "2024-01-01")) == [1, "2024-01-01"]
+
+
+def test_repeated_named_placeholder_maps_to_one_parameter():
+    query = db.PreparedQuery(
+        "q_named",
+        "SELECT %(user)s, %(start)s WHERE user_id = %(user)s",
+    )
+    assert query.prepare_sql == "PREPARE q_named AS SELECT $1, $2 WHERE user_id = $1"
+    assert query.execute_sql == "EXECUTE q_named (%s, %s)"
+    assert query.arguments({"start": "2024-01-01", "user": 7, "unused": 0}) == [7, "2024-01-01"]
+
+
+def test_escaped_percent_and_no_parameters():
+    query = db.PreparedQuery("q_like", "SELECT name FROM categories WHERE name LIKE 'Прод%%'")
+    assert query.prepare_sql == "PREPARE q_like AS SELECT name FROM categories WHERE name LIKE 'Прод%'"
+    assert query.execute_sql == "EXECUTE q_like"
+
+
+def test_mixed_placeholders_are_rejected():
+    with pytest.raises(ValueError, match="mixes"):
+        db.PreparedQuery("q_mixed", "SELECT %s, %(user)s")
+
+
+def test_prepared_query_registration():
+    first = db.prepared_query("test_registration", "SELECT %s")
+    assert db.prepared_query("test_registration", "SELECT %s") is first
+    assert db.registered_queries()["test_registration"] is first
+    with pytest.raises(ValueError):
+        db.prepared_query("test_registration", "SELECT %s + 1")
+    with pytest.raises(ValueError):
+        db.prepared_query("test_registration", "SELECT %s", generic_plan=True)
+
+
+class RecordingCursor:
+    def __init__(self, prepared=None):
+        self.connection = type("Connection", (), {"prepared": prepared})()
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+
+def test_execute_prepared_prepares_once_and_scopes_generic_plan(monkeypatch):
+    monkeypatch.setattr(db.Config, "DB_PREPARED_STATEMENTS", True)
+    query = db.PreparedQuery("q_generic", "SELECT %(user)s", generic_plan=True)
+    cursor = RecordingCursor(prepared=set())
+    db.execute_prepared(cursor, query, {"user": 1})
+    db.execute_prepared(cursor, query, {"user": 2})
+    assert cursor.executed == [
+        ("PREPARE q_generic AS SELECT $1", None),
+        (f"{db.GENERIC_PLAN_SQL}; EXECUTE q_generic (%s)", [1]),
+        (f"{db.GENERIC_PLAN_SQL}; EXECUTE q_generic (%s)", [2]),
+    ]
+
+
+def test_execute_prepared_runs_plain_sql_outside_the_pool():
+    query = db.PreparedQuery("q_plain", "SELECT %s")
+    cursor = RecordingCursor(prepared=None)
+    db.execute_prepared(cursor, query, (1,))
+    assert cursor.executed == [("SELECT %s", (1,))]
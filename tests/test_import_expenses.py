@@ -0,0 +1,109 @@
+"""Row validation of import_expenses: normalize_row and read_rows."""
+
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from import_expenses import RowError, normalize_row, read_rows
+
+CATEGORIES = {"Продукты", "Транспорт"}
+
+
+def row(**overrides):
+    raw = {"user_id": "42", "amount": "150,50", "category": "Продукты", "date": "2024-03-01"}
+    raw.update(overrides)
+    return raw
+
+
+def test_valid_row_is_normalized():
+    assert normalize_row(row(description="хлеб"), CATEGORIES, None) == (
+        42, Decimal("150.50"), "Продукты", date(2024, 3, 1), "хлеб", "expense", None
+    )
+
+
+def test_default_user_id_and_other_date_formats():
+    normalized = normalize_row(row(user_id="", date="01.03.2024"), CATEGORIES, 7)
+    assert normalized[0] == 7
+    assert normalized[3] == date(2024, 3, 1)
+    assert normalize_row(row(date="01/03/2024"), CATEGORIES, None)[3] == date(2024, 3, 1)
+
+
+def test_amount_with_spaces():
+    assert normalize_row(row(amount="1 200.5"), CATEGORIES, None)[1] == Decimal("1200.5")
+
+
+def test_largest_amount_that_fits_numeric_12_2():
+    assert normalize_row(row(amount="9999999999.99"), CATEGORIES, None)[1] == Decimal("9999999999.99")
+    assert normalize_row(row(amount="12.500"), CATEGORIES, None)[1] == Decimal("12.5")
+
+
+@pytest.mark.parametrize("raw, message", [
+    (["not", "a", "dict"], "ожидался объект"),
+    (row(user_id=None), "нет user_id"),
+    (row(user_id="abc"), "неверный user_id"),
+    (row(amount="много"), "неверная сумма"),
+    (row(amount="NaN"), "неверная сумма"),
+    (row(amount="Infinity"), "неверная сумма"),
+    (row(amount="0"), "положительной"),
+    (row(amount="-5"), "положительной"),
+    (row(amount="10000000000"), "слишком большая сумма"),
+    (row(amount="1e12"), "слишком большая сумма"),
+    (row(amount="10.005"), "знаков после запятой"),
+    (row(category="Казино"), "неизвестная категория"),
+    (row(date="2024-13-01"), "неверная дата"),
+    (row(date=""), "неверная дата"),
+    (row(transaction_type="transfer"), "неверный transaction_type"),
+])
+def test_invalid_rows_are_rejected(raw, message):
+    with pytest.raises(RowError, match=message):
+        normalize_row(raw, CATEGORIES, None)
+
+
+def test_row_error_from_reader_is_raised():
+    with pytest.raises(RowError, match="неверный JSON"):
+        normalize_row(RowError("неверный JSON: Expecting value"), CATEGORIES, None)
+
+
+def test_read_rows_csv(tmp_path):
+    path = tmp_path / "bank.csv"
+    path.write_text("\ufeffuser_id,amount,category,date\n42,10,Продукты,2024-03-01\n", encoding="utf-8")
+    assert list(read_rows(str(path))) == [
+        {"user_id": "42", "amount": "10", "category": "Продукты", "date": "2024-03-01"}
+    ]
+
+
+def test_read_rows_ndjson_keeps_going_after_bad_line(tmp_path):
+    path = tmp_path / "history.jsonl"
+    path.write_text('{"amount": 1}\n\n{broken\n{"amount": 2}\n', encoding="utf-8")
+    rows = list(read_rows(str(path)))
+    assert rows[0] == {"amount": 1}
+    assert isinstance(rows[1], RowError) and "неверный JSON" in str(rows[1])
+    assert rows[2] == {"amount": 2}
+    assert len(rows) == 3
+
+
+def test_read_rows_explicit_format(tmp_path):
+    path = tmp_path / "export.txt"
+    path.write_text('{"amount": 3}\n', encoding="utf-8")
+    assert list(read_rows(str(path), "jsonl")) == [{"amount": 3}]
+    path.write_text('[{"amount": 4}]', encoding="utf-8")
+    assert list(read_rows(str(path), "json")) == [{"amount": 4}]
+
+
+def test_read_rows_json_array(tmp_path):
+    path = tmp_path / "export.json"
+    path.write_text('[{"amount": 1},\n {"amount": 2}]', encoding="utf-8")
+    assert list(read_rows(str(path))) == [{"amount": 1}, {"amount": 2}]
+
+
+@pytest.mark.parametrize("content, message", [
+    ('{"amount": 1}', "ожидался массив"),
+    ('[{"amount": 1},', "неверный JSON"),
+])
+def test_read_rows_rejects_json_that_is_not_an_array(tmp_path, content, message):
+    path = tmp_path / "export.json"
+    path.write_text(content, encoding="utf-8")
+    rows = list(read_rows(str(path)))
+    assert len(rows) == 1
+    assert isinstance(rows[0], RowError) and message in str(rows[0])
@@ -0,0 +1,37 @@
+"""Run keys of the job_leases schedules."""
+
+from datetime import datetime, time, timedelta, timezone
+
+from job_leases import daily_at, every
+
+
+def at(hour, minute=0, second=0, day=5):
+    return datetime(2024, 3, day, hour, minute, second, tzinfo=timezone.utc)
+
+
+def test_daily_at_window():
+    run_key = daily_at(time(9, 0), grace=300)
+    assert run_key(at(8, 59, 59)) is None
+    assert run_key(at(9, 0)) == "2024-03-05"
+    assert run_key(at(9, 5)) == "2024-03-05"
+    assert run_key(at(9, 5, 1)) is None
+
+
+def test_daily_at_key_changes_with_the_day():
+    run_key = daily_at(time(9, 0), grace=60)
+    assert run_key(at(9, 0, 30, day=6)) == "2024-03-06"
+
+
+def test_daily_at_uses_configured_grace(monkeypatch):
+    monkeypatch.setattr("job_leases.Config.JOB_MISFIRE_GRACE", 10)
+    run_key = daily_at(time(9, 0))
+    assert run_key(at(9, 0, 10)) == "2024-03-05"
+    assert run_key(at(9, 0, 11)) is None
+
+
+def test_every_groups_times_into_buckets():
+    run_key = every(600)
+    start = datetime(2024, 3, 5, 9, 0, tzinfo=timezone.utc)  # кратно 600 секундам
+    assert run_key(start) == run_key(start + timedelta(seconds=599))
+    assert run_key(start + timedelta(seconds=600)) != run_key(start)
+    assert run_key(start) != run_key(start - timedelta(seconds=1))
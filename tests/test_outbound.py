@@ -0,0 +1,134 @@
+"""Token buckets and priority lanes of outbound.py."""
+
+import asyncio
+import time
+
+import metrics
+from outbound import PRIORITY_HIGH, PRIORITY_LOW, OutboundDispatcher, PriorityRateLimiter, RateLimiter
+
+
+def test_rate_limiter_allows_burst_then_paces():
+    async def scenario():
+        limiter = RateLimiter(rate=50, burst=3)
+        started = time.monotonic()
+        for _ in range(3):
+            await limiter.acquire()
+        burst = time.monotonic() - started
+        for _ in range(5):
+            await limiter.acquire()
+        return burst, time.monotonic() - started
+
+    burst, total = asyncio.run(scenario())
+    assert burst < 0.02
+    assert total >= 5 / 50 * 0.9
+
+
+def test_high_lane_is_served_before_queued_low_lane():
+    async def scenario():
+        limiter = PriorityRateLimiter(rate=100, burst=1)
+        await limiter.acquire()  # корзина пуста, дальше все ждут
+        order = []
+
+        async def take(lane, name):
+            await limiter.acquire(lane)
+            order.append(name)
+
+        tasks = [asyncio.create_task(take(PRIORITY_LOW, f"low{i}")) for i in range(3)]
+        await asyncio.sleep(0)
+        assert limiter.waiting(PRIORITY_LOW) == 3
+        tasks.append(asyncio.create_task(take(PRIORITY_HIGH, "high")))
+        await asyncio.gather(*tasks)
+        limiter.close()
+        return order
+
+    assert asyncio.run(scenario()) == ["high", "low0", "low1", "low2"]
+
+
+def test_pause_holds_tokens_back():
+    async def scenario():
+        limiter = PriorityRateLimiter(rate=1000, burst=5)
+        limiter.pause(0.1)
+        started = time.monotonic()
+        await limiter.acquire()
+        limiter.close()
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) >= 0.09
+
+
+def test_close_cancels_waiters():
+    async def scenario():
+        limiter = PriorityRateLimiter(rate=0.01, burst=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.close()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    assert asyncio.run(scenario())
+
+
+def make_dispatcher():
+    return OutboundDispatcher(
+        global_rate=1000, chat_rate=20, group_rate_per_minute=60, chat_burst=1, max_retries=0
+    )
+
+
+def test_interactive_reply_overtakes_bulk_in_the_same_chat():
+    async def scenario():
+        dispatcher = make_dispatcher()
+        sent = []
+
+        async def send(name):
+            sent.append(name)
+
+        def request(name, priority=None):
+            rate_limit_args = {"priority": priority} if priority else None
+            return dispatcher.process_request(send, (name,), {}, "sendMessage", {"chat_id": 1}, rate_limit_args)
+
+        tasks = [asyncio.create_task(request(f"bulk{i}", PRIORITY_LOW)) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request("reply")))
+        await asyncio.gather(*tasks)
+        await dispatcher.shutdown()
+        return sent
+
+    assert asyncio.run(scenario()) == ["bulk0", "reply", "bulk1", "bulk2"]
+
+
+def test_chatless_requests_and_groups():
+    async def scenario():
+        dispatcher = make_dispatcher()
+
+        async def call():
+            return "ok"
+
+        result = await dispatcher.process_request(call, (), {}, "getMe", {}, None)
+        group_bucket = dispatcher._chat_bucket(-100)
+        private_bucket = dispatcher._chat_bucket(5)
+        await dispatcher.shutdown()
+        return result, group_bucket.rate, private_bucket.rate
+
+    assert asyncio.run(scenario()) == ("ok", 1, 20)
+
+
+def test_recreated_dispatcher_exposes_one_set_of_gauges(monkeypatch):
+    monkeypatch.setattr(metrics, "_collectors", {})  # без сборщика пула соединений
+
+    async def scenario():
+        first = make_dispatcher()
+        second = make_dispatcher()
+        exposition = metrics.render()
+        await first.shutdown()  # старый экземпляр не снимает сборщик нового
+        after_old_shutdown = metrics.render()
+        await second.shutdown()
+        return exposition, after_old_shutdown, metrics.render()
+
+    exposition, after_old_shutdown, after_shutdown = asyncio.run(scenario())
+    assert exposition.count('bot_outbound_queue_depth{lane="high"}') == 1
+    assert after_old_shutdown.count('bot_outbound_queue_depth{lane="high"}') == 1
+    assert "bot_outbound_queue_depth" not in after_shutdown
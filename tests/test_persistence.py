@@ -0,0 +1,68 @@
+"""PostgresPersistence hooks into ConversationHandler state without a database."""
+
+import asyncio
+import inspect
+from datetime import datetime
+from types import SimpleNamespace
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import CommandHandler, ConversationHandler, MessageHandler, filters
+
+from persistence import CONVERSATION_PREFIX, PostgresPersistence, SharedConversationHandler, _conversation_key
+
+AMOUNT = 1
+
+
+async def noop(update, context):
+    return None
+
+
+def make_handler():
+    return SharedConversationHandler(
+        entry_points=[CommandHandler("start", noop)],
+        states={AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, noop)]},
+        fallbacks=[],
+        name="budget",
+        persistent=True,
+    )
+
+
+def text_update(chat_id, text="150"):
+    user = User(chat_id, "user", False)
+    return Update(1, message=Message(1, datetime.now(), Chat(chat_id, Chat.PRIVATE), from_user=user, text=text))
+
+
+def test_ptb_still_has_the_initialization_hook():
+    # Если PTB переименует хук, SharedConversationHandler молча перестанет видеть состояния
+    hook = ConversationHandler.__dict__.get("_initialize_persistence")
+    assert hook is not None and inspect.iscoroutinefunction(hook)
+    assert list(inspect.signature(hook).parameters) == ["self", "application"]
+    assert "_initialize_persistence" in SharedConversationHandler.__dict__
+
+
+def test_state_written_by_another_replica_reaches_the_live_handler():
+    persistence = PostgresPersistence()
+    handler = make_handler()
+    application = SimpleNamespace(persistence=persistence)
+
+    conversations = asyncio.run(handler._initialize_persistence(application))
+    assert list(conversations) == ["budget"]
+
+    update = text_update(7)
+    assert not handler.check_update(update)  # вне диалога текст не обрабатывается
+
+    persistence._apply_row({
+        "namespace": CONVERSATION_PREFIX + "budget",
+        "key": _conversation_key((7, 7)),
+        "data": AMOUNT,
+        "version": 2,
+    })
+    assert handler.check_update(update)
+
+    persistence._apply_row({
+        "namespace": CONVERSATION_PREFIX + "budget",
+        "key": _conversation_key((7, 7)),
+        "data": None,
+        "version": 3,
+    })
+    assert not handler.check_update(update)
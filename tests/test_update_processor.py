@@ -0,0 +1,106 @@
+"""Per-chat ordering and concurrency of update_processor.PerChatUpdateProcessor."""
+
+import asyncio
+from datetime import datetime
+
+import pytest
+from telegram import Chat, Message, Update, User
+from telegram.ext import BaseUpdateProcessor
+
+from update_processor import PerChatUpdateProcessor
+
+
+def message_update(update_id, chat_id):
+    message = Message(update_id, datetime.now(), Chat(chat_id, Chat.PRIVATE), from_user=User(chat_id, "user", False))
+    return Update(update_id, message=message)
+
+
+def test_updates_of_one_chat_run_in_arrival_order():
+    async def scenario():
+        processor = PerChatUpdateProcessor(4)
+        order = []
+
+        async def handle(update_id, delay):
+            await asyncio.sleep(delay)
+            order.append(update_id)
+
+        # Первый апдейт самый долгий: без упорядочивания он закончился бы последним
+        delays = [0.05, 0.0, 0.02, 0.0]
+        await asyncio.gather(*(
+            processor.process_update(message_update(i, 1), handle(i, delay)) for i, delay in enumerate(delays)
+        ))
+        return order, processor.active_chats, processor.in_flight
+
+    assert asyncio.run(scenario()) == ([0, 1, 2, 3], 0, 0)
+
+
+def test_busy_chat_does_not_block_other_chats():
+    async def scenario():
+        processor = PerChatUpdateProcessor(2)
+        finished = []
+        release = asyncio.Event()
+
+        async def slow(update_id):
+            await release.wait()
+            finished.append(update_id)
+
+        async def fast(update_id):
+            finished.append(update_id)
+
+        # Очередь из пяти апдейтов одного чата держит только один слот из двух
+        busy = [asyncio.create_task(processor.process_update(message_update(i, 1), slow(i))) for i in range(5)]
+        await asyncio.sleep(0)
+        await asyncio.wait_for(processor.process_update(message_update(99, 2), fast(99)), timeout=1)
+        first = list(finished)
+        release.set()
+        await asyncio.gather(*busy)
+        return first, finished
+
+    first, finished = asyncio.run(scenario())
+    assert first == [99]
+    assert finished == [99, 0, 1, 2, 3, 4]
+
+
+def test_updates_without_chat_are_not_ordered():
+    async def scenario():
+        processor = PerChatUpdateProcessor(2)
+        ran = []
+
+        async def handle():
+            ran.append(True)
+
+        await processor.process_update(object(), handle())
+        return ran, processor.active_chats
+
+    assert asyncio.run(scenario()) == ([True], 0)
+
+
+def test_ordering_key():
+    update = message_update(1, 5)
+    assert PerChatUpdateProcessor.ordering_key(update) == 5
+    assert PerChatUpdateProcessor.ordering_key("not an update") is None
+
+
+def test_concurrency_limit_applies_across_chats():
+    async def scenario():
+        processor = PerChatUpdateProcessor(2)
+        running = peak = 0
+
+        async def handle():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(processor.process_update(message_update(i, i), handle()) for i in range(6)))
+        return peak, processor.max_concurrent_updates
+
+    assert asyncio.run(scenario()) == (2, 2)
+
+
+def test_stock_process_update_and_validated_limit():
+    # Ограничение и порядок реализованы в do_process_update, final-метод PTB не переопределен
+    assert PerChatUpdateProcessor.process_update is BaseUpdateProcessor.process_update
+    with pytest.raises(ValueError):
+        PerChatUpdateProcessor(0)
@@ -0,0 +1,106 @@
+"""
+Concurrent update processing for the bot.
+Updates from different chats are handled in parallel (up to
+CONCURRENT_UPDATES at a time), while updates from the same chat run strictly
+one after another in arrival order, so ConversationHandler state and
+context.user_data of a single user never race. Updates queued behind their
+own chat do not hold a concurrency slot, so a burst from one chat cannot
+starve the others.
+"""
+
+import asyncio
+import logging
+import sys
+from typing import Any, Awaitable, Dict, Hashable, List, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import register_collector, unregister_collector
+
+logger = logging.getLogger(__name__)
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Runs updates concurrently, serialising them per chat (or per user for chatless updates)"""
+
+    def __init__(self, max_concurrent_updates: int):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        # Семафор базового класса берется до do_process_update, и очередь одного чата
+        # занимала бы в нем все слоты, ожидая свою блокировку. Поэтому базовый класс
+        # создается без ограничения, а слоты раздает свой семафор после очереди чата.
+        self._limit = sys.maxsize
+        super().__init__(sys.maxsize)
+        self._limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._waiting: Dict[Hashable, int] = {}
+        self.in_flight = 0
+        register_collector("update_processor", self.gauges)
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        """Updates handled at the same time (CONCURRENT_UPDATES), not counting ones queued behind their chat"""
+        return self._limit
+
+    @staticmethod
+    def ordering_key(update: object) -> Optional[Hashable]:
+        """Key whose updates must not overlap; None lets the update run unordered"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return ("user", update.effective_user.id)
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self.ordering_key(update)
+        if key is None:
+            async with self._slots:
+                await self._run(coroutine)
+            return
+
+        # asyncio.Lock будит ожидающих по очереди, поэтому порядок апдейтов чата сохраняется
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            async with lock:
+                async with self._slots:
+                    await self._run(coroutine)
+        finally:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+                del self._locks[key]
+
+    async def _run(self, coroutine: Awaitable[Any]) -> None:
+        self.in_flight += 1
+        try:
+            await coroutine
+        finally:
+            self.in_flight -= 1
+
+    @property
+    def active_chats(self) -> int:
+        return len(self._locks)
+
+    async def initialize(self) -> None:
+        logger.info(f"Processing up to {self.max_concurrent_updates} updates concurrently (ordered per chat)")
+
+    async def shutdown(self) -> None:
+        unregister_collector("update_processor", self.gauges)
+        self._locks.clear()
+        self._waiting.clear()
+
+    def gauges(self) -> List[str]:
+        """In-flight updates and chats with queued updates, read on every scrape"""
+        return [
+            "# TYPE bot_updates_in_flight gauge",
+            f"bot_updates_in_flight {self.in_flight}",
+            "# TYPE bot_update_chats_active gauge",
+            f"bot_update_chats_active {self.active_chats}",
+        ]
@@ -1,20 +1,17 @@
 """
 Utility functions for the expense tracking bot.
-Includes chart generation, keyboards, and helper functions.
+Includes lazy chart loading, keyboards, and helper functions.
 """
 
+import asyncio
+import importlib
 import logging
-import io
-from typing import Optional
+import sys
+import time
 
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import pandas as pd
 from telegram import Update, ReplyKeyboardMarkup
 from telegram.ext import ContextTypes
 
-from database import get_monthly_expenses
 from config import Config
 
 logger = logging.getLogger(__name__)
@@ -39,10 +36,6 @@ def get_user_display_name(user) -> str:
         return user.username
     return "Пользователь"
 
-# Установка русских шрифтов для matplotlib
-matplotlib.rcParams['font.family'] = 'DejaVu Sans'
-matplotlib.rcParams['font.size'] = 12
-
 
 def build_web_url(user_id: int) -> str:
     """Build web interface URL with user_id parameter"""
@@ -96,53 +89,28 @@ def is_bot_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     return False
 
 
-def create_monthly_chart(user_id: int = None) -> Optional[io.BytesIO]:
+async def load_charts():
     """
-    Create a pie chart for monthly expenses by category (entire family).
-    user_id parameter kept for backward compatibility but is ignored.
-    Returns a BytesIO buffer with the chart image or None if no data.
+    Return the charts module, importing it (and matplotlib) on a worker
+    thread the first time so the event loop never blocks on the import.
     """
-    expenses, _ = get_monthly_expenses()  # Без user_id - показывает всю семью
-
-    if not expenses:
-        logger.warning("No expense data for creating chart")
-        return None
-
-    # Преобразуем строки БД в словари для корректной работы с pandas
-    expenses_dict = []
-    for expense in expenses:
-        total_value = float(expense['total']) if expense['total'] is not None else 0
-        expense_dict = {'category': expense['category'], 'total': total_value}
-        expenses_dict.append(expense_dict)
-
-    logger.info(f"Transformed data for chart: {expenses_dict}")
-
-    # Если после преобразования нет данных, возвращаем None
-    if not expenses_dict:
-        logger.warning("No data after transformation for chart")
-        return None
-
-    # Создаем DataFrame из списка словарей
-    df = pd.DataFrame(expenses_dict)
-
-    # Проверяем наличие данных
-    if df.empty:
-        logger.warning("DataFrame is empty after creation")
-        return None
+    module = sys.modules.get('charts')
+    if module is not None:
+        return module
 
-    # Создаем круговую диаграмму
-    plt.figure(figsize=(10, 6))
-    plt.pie(df['total'], labels=df['category'], autopct='%1.1f%%', startangle=90)
-    plt.axis('equal')  # Равные пропорции для круговой диаграммы
-    plt.title('Общие расходы семьи за месяц по категориям')
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    module = await loop.run_in_executor(None, importlib.import_module, 'charts')
+    logger.info(f"Chart module loaded in {time.perf_counter() - started:.2f}s")
+    return module
 
-    # Сохраняем график в буфер
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close()
 
-    return buf
+async def prewarm_charts() -> None:
+    """Load the chart module in the background after the bot has started"""
+    try:
+        await load_charts()
+    except Exception as e:
+        logger.warning(f"Chart prewarm failed, charts will load on first request: {e}")
 
 
 def setup_logging() -> logging.Logger:
@@ -213,13 +181,12 @@ def format_budget_report(budgets: list, user_id: int = None) -> str:
     Format budget report with current status (family-wide).
 
     Args:
-        budgets: List of budget records
+        budgets: List of budget status records from get_budget_statuses
         user_id: User ID (kept for compatibility, but uses family-wide budget status)
 
     Returns:
         Formatted report string
     """
-    from database import check_budget_status
     from config import CODE_TO_PERIOD_LABEL
 
     if not budgets:
@@ -233,8 +200,8 @@ def format_budget_report(budgets: list, user_id: int = None) -> str:
         period = budget['period']
         period_label = CODE_TO_PERIOD_LABEL.get(period, period)
 
-        # Используем user_id=0 как сигнал для семейного бюджета (check_budget_status теперь игнорирует user_id)
-        _, spent, percentage = check_budget_status(0, category, period)
+        spent = budget.get('spent', 0)
+        percentage = budget.get('percentage', 0)
 
         report += f"🔹 {category} ({period_label}): {spent:.2f} / {amount:.2f} руб. ({percentage:.1f}%)\n"
 